@@ -0,0 +1,46 @@
+# account_config.py
+# Per-account overrides of config.py values, used when reports for several
+# people run in one process (see team_runner.py).
+#
+# Every module reads settings as `config.NAME`. Rather than threading an
+# account object through all of them, the config module's attribute lookup
+# first checks the overrides of the current context, so each account's
+# threads see their own YAHOO_EMAIL, TOKEN_PATH, DOWNLOAD_DIR and so on.
+
+import contextvars
+import types
+from contextlib import contextmanager
+
+import config
+
+_overrides = contextvars.ContextVar("config_overrides", default={})
+
+
+class _OverridableConfig(types.ModuleType):
+    def __getattribute__(self, name):
+        overrides = _overrides.get()
+        if name in overrides:
+            return overrides[name]
+        return super().__getattribute__(name)
+
+
+config.__class__ = _OverridableConfig
+
+
+@contextmanager
+def overrides(values):
+    """
+    Applies config overrides for the current context (thread or task).
+    Stages started from inside the block inherit them, since the pipeline runs
+    each stage in a copy of the caller's context.
+    """
+    token = _overrides.set({**_overrides.get(), **values})
+    try:
+        yield
+    finally:
+        _overrides.reset(token)
+
+
+def current_overrides():
+    """Returns the overrides active in the current context."""
+    return dict(_overrides.get())
@@ -0,0 +1,351 @@
+# backends.py
+# Pluggable service backends: where Google API clients, the IMAP connection,
+# HTTP lookups, Chrome and per diem pages come from.
+#
+# LiveBackend talks to the real services. FakeBackend answers in-process from
+# a fixture directory, with optional latency injection, so the whole pipeline
+# can be run and load-tested without a network:
+#
+#   <fixture dir>/google/<api>.json    canned API responses (see FakeGoogleService)
+#   <fixture dir>/imap/*.eml           Uber receipt emails, served by date
+#   <fixture dir>/http.json            JSON documents keyed by host
+#   <fixture dir>/per_diem/<country>.html   saved per diem results pages
+#   <fixture dir>/pdfs/rendered.pdf    what Chrome "prints" (optional)
+#
+# The backend is chosen with config.SERVICE_BACKEND ("live" or "fake"), or
+# plugged in for a block of code with `with backends.use(backend):`.
+# The client libraries LiveBackend needs are imported on first use, and
+# Google clients come from google_services.build_service.
+
+import base64
+import contextvars
+import email
+import imaplib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+import config
+import google_services
+
+_current = contextvars.ContextVar("service_backend", default=None)
+_fake_backends = {}
+_fake_backends_lock = threading.Lock()
+
+
+class LiveBackend:
+    """The real services."""
+
+    name = "live"
+    rate_limited = True   # see resilience.call
+
+    def authenticate(self):
+        return google_services.authenticate()
+
+    def google_service(self, api, version, credentials):
+        return google_services.build_service(api, version, credentials)
+
+    def imap_connect(self, host):
+        return imaplib.IMAP4_SSL(host, timeout=getattr(config, "IMAP_TIMEOUT", 60))
+
+    def http_get(self, url, params=None):
+        import requests
+
+        response = requests.get(url, params=params, timeout=getattr(config, "HTTP_TIMEOUT", 30))
+        response.raise_for_status()
+        return response
+
+    def chrome(self, options):
+        from selenium import webdriver
+
+        return webdriver.Chrome(options=options)
+
+    def per_diem_page(self, year, month, country_name, scrape):
+        """scrape(year, month, country_name) fetches the page from the State Dept website."""
+        return scrape(year, month, country_name)
+
+
+class FakeBackend:
+    """
+    In-process stand-ins seeded from a fixture directory.
+
+    Args:
+        fixture_dir: Directory laid out as described at the top of this module.
+        latency_ms: Delay added to every call, either one number or a dict keyed
+            by "gmail", "drive", "sheets", "calendar", "imap", "http", "chrome"
+            (with an optional "default").
+        mailbox: Raw emails to serve over IMAP instead of <fixture_dir>/imap.
+    """
+
+    name = "fake"
+    rate_limited = False
+
+    def __init__(self, fixture_dir, latency_ms=0, mailbox=None):
+        self.fixture_dir = fixture_dir
+        if not isinstance(latency_ms, dict):
+            latency_ms = {"default": latency_ms}
+        self.latency_ms = latency_ms
+        self._responses = {}
+        self._lock = threading.Lock()
+        self.mailbox = _index_mailbox(mailbox if mailbox is not None else _read_mailbox(os.path.join(fixture_dir, "imap")))
+
+    def delay(self, kind):
+        """Sleeps for the latency configured for this kind of call."""
+        ms = self.latency_ms.get(kind, self.latency_ms.get("default", 0))
+        if ms:
+            time.sleep(ms / 1000)
+
+    def _load_json(self, *parts):
+        path = os.path.join(self.fixture_dir, *parts)
+        with self._lock:
+            if path not in self._responses:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._responses[path] = json.load(f)
+            return self._responses[path]
+
+    def authenticate(self):
+        return "fake-credentials"
+
+    def google_service(self, api, version, credentials):
+        return FakeGoogleService(self, api, self._load_json("google", f"{api}.json"))
+
+    def imap_connect(self, host):
+        self.delay("imap")
+        return FakeIMAP(self)
+
+    def http_get(self, url, params=None):
+        self.delay("http")
+        host = re.sub(r"^https?://", "", url).split("/")[0]
+        return FakeResponse(self._load_json("http.json")[host])
+
+    def chrome(self, options):
+        return FakeChromeDriver(self)
+
+    def per_diem_page(self, year, month, country_name, scrape):
+        path = os.path.join(self.fixture_dir, "per_diem", f"{country_name.lower().replace(' ', '_')}.html")
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+
+def _read_mailbox(imap_dir):
+    messages = []
+    if os.path.isdir(imap_dir):
+        for name in sorted(os.listdir(imap_dir)):
+            if name.endswith(".eml"):
+                with open(os.path.join(imap_dir, name), "rb") as f:
+                    messages.append(f.read())
+    return messages
+
+
+def _index_mailbox(messages):
+    """Groups raw emails by the date in their Date header."""
+    by_date = {}
+    for raw in messages:
+        msg = email.message_from_bytes(raw)
+        day = parsedate_to_datetime(msg["Date"]).date()
+        by_date.setdefault(day, []).append((msg, raw))
+    return by_date
+
+
+class FakeRequest:
+    """Stands in for a googleapiclient HttpRequest; execute() returns the canned response."""
+
+    def __init__(self, service, method, params):
+        self.service = service
+        self.method = method
+        self.params = params
+
+    def execute(self):
+        self.service.backend.delay(self.service.api)
+        for entry in self.service.responses.get(self.method, []):
+            match = entry.get("match", {})
+            if all(str(self.params.get(key)) == str(value) for key, value in match.items()):
+                if "error" in entry:
+                    import httplib2
+                    from googleapiclient.errors import HttpError
+
+                    error = entry["error"]
+                    raise HttpError(httplib2.Response({"status": error["status"]}),
+                                    json.dumps(error.get("content", {})).encode())
+                return json.loads(json.dumps(entry["response"]))
+        return {}
+
+
+class FakeGoogleService:
+    """
+    Stands in for a googleapiclient service object. Resources chain the same
+    way (service.users().messages().get(...)); a call becomes a request when it
+    has arguments or names a method in the canned responses.
+
+    Canned responses map a method path to a list of entries; the first entry
+    whose "match" values equal the call's arguments is returned (a missing
+    argument matches null), or raised as an HttpError if it has an "error":
+        {"users.messages.get": [{"match": {"id": "m1"}, "response": {...}},
+                                {"match": {"id": "gone"}, "error": {"status": 404}}]}
+    """
+
+    def __init__(self, backend, api, responses, path=()):
+        self.backend = backend
+        self.api = api
+        self.responses = responses
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(**params):
+            path = self._path + (name,)
+            method = ".".join(path)
+            if params or method in self.responses:
+                return FakeRequest(self, method, params)
+            return FakeGoogleService(self.backend, self.api, self.responses, path)
+
+        return call
+
+
+class FakeIMAP:
+    """An IMAP4_SSL stand-in supporting the commands yahoo_service uses."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._fetchable = {}
+        self._fetchable_uids = {}
+
+    def login(self, user, password):
+        self.backend.delay("imap")
+        return "OK", [b"LOGIN completed"]
+
+    def select(self, mailbox="INBOX"):
+        self.backend.delay("imap")
+        return "OK", [str(sum(len(v) for v in self.backend.mailbox.values())).encode()]
+
+    def noop(self):
+        self.backend.delay("imap")
+        return "OK", [b"NOOP completed"]
+
+    def _matching(self, query):
+        """
+        (sequence number, UID, raw email) of the messages matching the FROM,
+        SUBJECT and ON criteria (ON is required). Sequence numbers count every
+        message in date order; UIDs are made from the date and the message's
+        place on it.
+        """
+        criteria = dict(re.findall(r'(FROM|SUBJECT|ON) "([^"]*)"', query))
+        if "ON" not in criteria:
+            return []
+        day = datetime.strptime(criteria["ON"], "%d-%b-%Y").date()
+        first_seq = 1 + sum(len(messages) for other, messages in self.backend.mailbox.items() if other < day)
+        matches = []
+        for index, (msg, raw) in enumerate(self.backend.mailbox.get(day, [])):
+            if criteria.get("FROM", "").lower() not in (msg["From"] or "").lower():
+                continue
+            if criteria.get("SUBJECT", "").lower() not in (msg["Subject"] or "").lower():
+                continue
+            uid = f"{day:%Y%m%d}{index:04d}".encode()
+            matches.append((str(first_seq + index).encode(), uid, raw))
+        return matches
+
+    def search(self, charset, query):
+        self.backend.delay("imap")
+        matches = self._matching(query)
+        for seq, uid, raw in matches:
+            self._fetchable[seq] = (seq, uid, raw)
+        return "OK", [b" ".join(seq for seq, _, _ in matches)]
+
+    def fetch(self, msg_id, parts):
+        self.backend.delay("imap")
+        seq, uid, raw = self._fetchable[msg_id]
+        return "OK", [(seq + b" (RFC822 {%d}" % len(raw), raw), b")"]
+
+    def uid(self, command, *args):
+        """UID SEARCH and UID FETCH; a UID that was never searched for fetches nothing, like a deleted email."""
+        self.backend.delay("imap")
+        if command.upper() == "SEARCH":
+            charset, query = args
+            matches = self._matching(query)
+            for seq, uid, raw in matches:
+                self._fetchable_uids[uid] = (seq, uid, raw)
+            return "OK", [b" ".join(uid for _, uid, _ in matches)]
+        if command.upper() == "FETCH":
+            uid, parts = args
+            if uid not in self._fetchable_uids:
+                return "OK", [None]
+            seq, uid, raw = self._fetchable_uids[uid]
+            return "OK", [(seq + b" (UID %s RFC822 {%d}" % (uid, len(raw)), raw), b")"]
+        raise ValueError(f"FakeIMAP doesn't support UID {command}")
+
+    def logout(self):
+        return "BYE", [b"LOGOUT completed"]
+
+
+class FakeResponse:
+    """The parts of requests.Response that utils.http_get_json reads."""
+
+    def __init__(self, document):
+        self._document = document
+        self.content = json.dumps(document).encode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeChromeDriver:
+    """A Chrome stand-in whose printToPDF returns <fixture dir>/pdfs/rendered.pdf (or a stub PDF)."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        path = os.path.join(backend.fixture_dir, "pdfs", "rendered.pdf")
+        data = b"%PDF-1.4\n%%EOF\n"
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+        self._pdf = base64.b64encode(data).decode("ascii")
+
+    def get(self, url):
+        pass
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.backend.delay("chrome")
+        return {"data": self._pdf}
+
+    def quit(self):
+        pass
+
+
+@contextmanager
+def use(backend):
+    """Plugs in a backend for the current context (and stages started from it)."""
+    token = _current.set(backend)
+    try:
+        yield backend
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """
+    The backend plugged in with use(), or else the one config.SERVICE_BACKEND
+    names. Fake backends built from config are shared per fixture directory
+    and latency, so every stage sees the same mailbox.
+    """
+    backend = _current.get()
+    if backend is not None:
+        return backend
+    if getattr(config, "SERVICE_BACKEND", "live") != "fake":
+        return _LIVE
+    fixture_dir = getattr(config, "FAKE_BACKEND_DIR", os.path.join("benchmarks", "fixtures"))
+    latency_ms = getattr(config, "FAKE_BACKEND_LATENCY_MS", 0)
+    key = (os.path.abspath(fixture_dir), json.dumps(latency_ms, sort_keys=True))
+    with _fake_backends_lock:
+        if key not in _fake_backends:
+            _fake_backends[key] = FakeBackend(fixture_dir, latency_ms)
+        return _fake_backends[key]
+
+
+_LIVE = LiveBackend()
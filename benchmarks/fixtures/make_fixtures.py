@@ -0,0 +1,134 @@
+# make_fixtures.py
+# Regenerates the synthetic travel and receipt PDFs used by the benchmarks and
+# the fake service backend, and the canned Gmail responses that carry the
+# travel PDFs as attachments.
+# Run from the repository root: python benchmarks/fixtures/make_fixtures.py
+#
+# The PDFs are written by hand (one Helvetica text stream per page) so no PDF
+# library is needed; pdfplumber reads them like the travel agency's documents.
+
+import base64
+import json
+import os
+
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FLIGHT_LINES = [
+    "E-Ticket Itinerary",
+    "Booking Reference: ABC123",
+    "03-Feb-2025-Bangalore to Mumbai- by Air",
+    "Flight 6E 5321",
+    "Departs 07:15 09:05 Arrives",
+    "06-Feb-2025-Mumbai to Colombo- by Air",
+    "Flight UL 142",
+    "Departs 13:40 16:05 Arrives",
+    "09-Feb-2025-Colombo to Bangalore- by Air",
+    "Flight UL 171",
+    "Departs 18:20 19:50 Arrives",
+]
+
+RECEIPT_LINES = [
+    "Uber",
+    "Thanks for riding",
+    "Total 1,122.23",
+]
+
+HOTEL_LINES = [
+    "Hotel Reservation Voucher",
+    "Hotel Name Taj Samudra",
+    "Address 25 Galle Face Centre Road, , Colombo 03, Sri Lanka",
+    "Checkin Date 06 Feb 2025",
+    "CheckOut Date 09 Feb 2025",
+    "Guests 1",
+]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_text_pdf(path, pages):
+    """Writes a PDF with one page per list of text lines."""
+    objects = []
+    page_ids = []
+    font_id = 3
+    objects.append(None)  # 1: catalog, filled in below
+    objects.append(None)  # 2: pages
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    for lines in pages:
+        text_ops = " ".join(f"({_escape(line)}) '" for line in lines)
+        stream = f"BT /F1 11 Tf 14 TL 50 800 Td {text_ops} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>".encode("latin-1")
+        )
+        page_ids.append(len(objects))
+
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("latin-1")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_at)
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_gmail_responses(path, attachments):
+    """
+    Writes canned Gmail API responses: one travel email per (message id, PDF path),
+    with the PDF inlined as the attachment body.
+    """
+    listing = {"messages": [{"id": msg_id, "threadId": msg_id} for msg_id, _ in attachments]}
+    messages = []
+    for msg_id, pdf_path in attachments:
+        with open(pdf_path, "rb") as f:
+            data = base64.urlsafe_b64encode(f.read()).decode("ascii")
+        messages.append({
+            "match": {"id": msg_id},
+            "response": {
+                "id": msg_id,
+                "payload": {
+                    "mimeType": "multipart/mixed",
+                    "parts": [
+                        {"partId": "0", "mimeType": "text/plain", "filename": "", "body": {"size": 0}},
+                        {
+                            "partId": "1",
+                            "mimeType": "application/pdf",
+                            "filename": os.path.basename(pdf_path),
+                            "body": {"size": len(data), "data": data},
+                        },
+                    ],
+                },
+            },
+        })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"users.messages.list": [{"response": listing}], "users.messages.get": messages}, f, indent=2)
+
+
+if __name__ == "__main__":
+    pdf_dir = os.path.join(FIXTURES_DIR, "pdfs")
+    os.makedirs(pdf_dir, exist_ok=True)
+    flight_pdf = os.path.join(pdf_dir, "flight_itinerary.pdf")
+    hotel_pdf = os.path.join(pdf_dir, "hotel_reservation.pdf")
+    write_text_pdf(flight_pdf, [FLIGHT_LINES[:5], FLIGHT_LINES[5:]])
+    write_text_pdf(hotel_pdf, [HOTEL_LINES])
+    # What the fake Chrome returns for every receipt it "prints"
+    write_text_pdf(os.path.join(pdf_dir, "rendered.pdf"), [RECEIPT_LINES])
+    print(f"Wrote fixture PDFs to {pdf_dir}")
+
+    gmail_path = os.path.join(FIXTURES_DIR, "google", "gmail.json")
+    write_gmail_responses(gmail_path, [("msg-flight", flight_pdf), ("msg-hotel", hotel_pdf)])
+    print(f"Wrote canned Gmail responses to {gmail_path}")
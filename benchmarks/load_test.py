@@ -0,0 +1,94 @@
+# load_test.py
+# Runs main() end to end against the fake service backend with a large
+# generated mailbox and injected latency, to measure throughput and the effect
+# of concurrency changes without touching the network.
+#
+# Run from the repository root:
+#   python benchmarks/load_test.py --receipts-per-day 10 --latency-ms 20
+#   python benchmarks/load_test.py --latency imap=40 --latency drive=120 --serial
+#
+# The fixtures are copied to a temporary directory, the mailbox is written
+# there as .eml files and the run selects the backend through config
+# (SERVICE_BACKEND, FAKE_BACKEND_DIR, FAKE_BACKEND_LATENCY_MS), exactly as a
+# user would.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import offline
+from offline import FIXTURES_DIR, REPORT_MONTH
+
+import account_config
+import instrumentation
+import main
+
+
+def parse_latency(values, default_ms):
+    """Turns ["imap=40", "drive=120"] into {"imap": 40, "drive": 120, "default": default_ms}."""
+    latency = {"default": default_ms}
+    for value in values or []:
+        kind, _, ms = value.partition("=")
+        if not ms:
+            raise argparse.ArgumentTypeError(f"Expected KIND=MS, got '{value}'")
+        latency[kind.strip()] = float(ms)
+    return latency
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test main() against the fake service backend.")
+    parser.add_argument("--receipts-per-day", type=int, default=10,
+                        help="Uber receipts per day of the month (default: 10, about 290 emails)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latency added to every fake call")
+    parser.add_argument("--latency", action="append", metavar="KIND=MS",
+                        help="latency for one kind of call: gmail, drive, sheets, calendar, imap, http, chrome")
+    parser.add_argument("--serial", action="store_true", help="run the stages one after another")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    args = parser.parse_args(argv)
+
+    fixture_dir = tempfile.mkdtemp(prefix="expense-load-")
+    try:
+        shutil.copytree(FIXTURES_DIR, fixture_dir, dirs_exist_ok=True)
+        messages = offline.build_mailbox(receipts_per_day=args.receipts_per_day)
+        offline.write_mailbox(messages, os.path.join(fixture_dir, "imap"))
+
+        overrides = offline.fixture_config()
+        overrides.update({
+            "SERVICE_BACKEND": "fake",
+            "FAKE_BACKEND_DIR": fixture_dir,
+            "FAKE_BACKEND_LATENCY_MS": parse_latency(args.latency, args.latency_ms),
+            "DOWNLOAD_DIR": os.path.join(fixture_dir, "downloads"),
+            "CALENDAR_CACHE_DIR": os.path.join(fixture_dir, "calendar_cache"),
+            "TRAVEL_STATE_DIR": os.path.join(fixture_dir, "travel_state"),
+            "LEDGER_PATH": os.path.join(fixture_dir, "ledger.sqlite3"),
+            "RUN_MANIFEST_DIR": os.path.join(fixture_dir, "run_manifest"),
+        })
+        argv = ["--year", str(REPORT_MONTH.year), "--month", str(REPORT_MONTH.month), "--start-day", "1",
+                "--metrics", os.path.join(fixture_dir, "run_metrics.json")]
+        if args.serial:
+            argv.append("--serial")
+
+        print(f"Running February 2025 against {len(messages)} emails...")
+        instrumentation.reset()
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with account_config.overrides(overrides), output:
+            started = time.perf_counter()
+            main.main(argv)
+            elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(fixture_dir, ignore_errors=True)
+
+    summary = instrumentation.summary()
+    print(f"Wall time {elapsed:.2f}s, {len(messages) / elapsed:.0f} emails/s")
+    print(json.dumps(summary["counters"], indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
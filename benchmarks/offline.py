@@ -0,0 +1,175 @@
+# offline.py
+# Runs the report pipeline against recorded fixtures instead of live services,
+# so the benchmarks measure our own code and give the same answer every run.
+#
+# Services come from backends.FakeBackend, seeded from fixtures/ (canned Google
+# API responses, saved per diem pages and exchange rates) plus a generated
+# mailbox of Uber receipts. Everything else (parsing, classification, the stage
+# pipeline, row building, the Sheets batch writer) is the real code.
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+from string import Template
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import account_config  # noqa: E402
+import backends  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FLIGHT_PDF = os.path.join(FIXTURES_DIR, "pdfs", "flight_itinerary.pdf")
+HOTEL_PDF = os.path.join(FIXTURES_DIR, "pdfs", "hotel_reservation.pdf")
+UBER_HTML = os.path.join(REPO_ROOT, "uber.html")
+
+# The fixtures describe February 2025: Bangalore -> Mumbai on the 3rd,
+# Mumbai -> Colombo on the 6th and back to Bangalore on the 9th.
+REPORT_MONTH = date(2025, 2, 1)
+
+PER_DIEM_PAGES = {
+    "India": os.path.join(FIXTURES_DIR, "per_diem", "india.html"),
+    "Sri Lanka": os.path.join(FIXTURES_DIR, "per_diem", "sri_lanka.html"),
+}
+
+HOME = "1, Dr Rajkumar Rd, opp. Vivekananda College, Rajajinagar, Bengaluru, Karnataka 560010, India"
+BLR_AIRPORT = "Kempegowda International Airport, Devanahalli, Bengaluru, Karnataka 560300, India"
+BANGALORE_PLACES = [
+    "Globex Tower, 12 Residency Road, Shanthala Nagar, Bengaluru, Karnataka 560025, India",
+    "Initech Campus, Outer Ring Road, Bellandur, Bengaluru, Karnataka 560103, India",
+    "Hooli House, 80 Feet Road, Koramangala, Bengaluru, Karnataka 560034, India",
+    "Toit Restaurant, 298 100 Feet Road, Indiranagar, Bengaluru, Karnataka 560038, India",
+]
+MUMBAI_PLACES = [
+    "Chhatrapati Shivaji Maharaj International Airport Terminal 2, Andheri East, Mumbai, Maharashtra 400099, India",
+    "Trident Hotel, Nariman Point, Mumbai, Maharashtra 400021, India",
+    "Acme Widgets, 5 Bandra Kurla Complex, Bandra East, Mumbai, Maharashtra 400051, India",
+    "Cafe Mondegar, Colaba Causeway, Colaba, Mumbai, Maharashtra 400001, India",
+]
+COLOMBO_PLACES = [
+    "Bandaranaike International Airport, Canada Friendship Road, Katunayake, Sri Lanka",
+    "Taj Samudra, 25 Galle Face Centre Road, Colombo 03, Sri Lanka",
+    "Lanka Tea Co, 42 Dharmapala Mawatha, Colombo 07, Sri Lanka",
+    "Ministry of Crab Restaurant, Old Dutch Hospital, Colombo 01, Sri Lanka",
+]
+
+
+def load_json(name):
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def fixture_config():
+    """config.py values the fixtures were recorded against (MIE_BREAKDOWN keys are ints, as in config.py)."""
+    values = load_json("config.json")
+    values["MIE_BREAKDOWN"] = {int(k): v for k, v in values["MIE_BREAKDOWN"].items()}
+    return values
+
+
+def render_receipt(trip_date, fare, pickup, dropoff, currency="INR"):
+    """Fills the new-format Uber receipt template."""
+    with open(os.path.join(FIXTURES_DIR, "uber", "new_format.html"), "r", encoding="utf-8") as f:
+        template = Template(f.read())
+    return template.safe_substitute(
+        trip_date=trip_date.strftime("%b %d, %Y"),
+        fare=f"{fare:,.2f}",
+        currency_symbol="₹" if currency == "INR" else "LKR ",
+        pickup=pickup,
+        dropoff=dropoff,
+    )
+
+
+def uber_corpus(count=40, seed=7):
+    """The recorded old-format receipt (uber.html) plus count generated new-format receipts."""
+    with open(UBER_HTML, "r", encoding="utf-8") as f:
+        corpus = [f.read()]
+    rng = random.Random(seed)
+    places = BANGALORE_PLACES + MUMBAI_PLACES + COLOMBO_PLACES + [HOME, BLR_AIRPORT]
+    for i in range(count):
+        pickup, dropoff = rng.sample(places, 2)
+        currency = "LKR" if "Sri Lanka" in pickup else "INR"
+        corpus.append(render_receipt(REPORT_MONTH + timedelta(days=i % 28), rng.uniform(150, 4000), pickup, dropoff, currency))
+    return corpus
+
+
+def _email(html, sent):
+    msg = MIMEMultipart("alternative")
+    msg["From"] = "Uber Receipts <noreply@uber.com>"
+    msg["Subject"] = "Your trip with Uber"
+    msg["Date"] = format_datetime(sent)
+    msg.attach(MIMEText("Thanks for riding with Uber.", "plain", "utf-8"))
+    msg.attach(MIMEText(html, "html", "utf-8"))
+    return msg.as_bytes()
+
+
+def build_mailbox(report_month_date=REPORT_MONTH, receipts_per_day=2, seed=11):
+    """
+    Raw Uber receipt emails for every day of the month. Rides follow the
+    fixture itinerary (Mumbai on the 3rd-5th, Colombo in LKR on the 6th-8th),
+    and one day carries a duplicate receipt to exercise de-duplication.
+    """
+    rng = random.Random(seed)
+    with open(UBER_HTML, "r", encoding="utf-8") as f:
+        recorded = f.read()
+
+    mailbox = []
+    day = report_month_date
+    while day.month == report_month_date.month:
+        if date(2025, 2, 3) <= day <= date(2025, 2, 5):
+            places, currency = MUMBAI_PLACES, "INR"
+        elif date(2025, 2, 6) <= day <= date(2025, 2, 8):
+            places, currency = COLOMBO_PLACES, "LKR"
+        else:
+            places, currency = [HOME, BLR_AIRPORT] + BANGALORE_PLACES, "INR"
+
+        for ride in range(receipts_per_day):
+            pickup, dropoff = rng.sample(places, 2)
+            low, high = (900, 6000) if currency == "LKR" else (120, 2500)
+            html = render_receipt(day, rng.uniform(low, high), pickup, dropoff, currency)
+            mailbox.append(_email(html, datetime.combine(day, time(8 + ride % 12, 30))))
+            if day == date(2025, 2, 19) and ride == 0:
+                mailbox.append(mailbox[-1])
+        if day == date(2025, 2, 12):
+            mailbox.append(_email(recorded, datetime.combine(day, time(21, 0))))
+        day += timedelta(days=1)
+    return mailbox
+
+
+def write_mailbox(messages, imap_dir):
+    """Saves raw emails as .eml files, the layout FakeBackend reads from <fixture dir>/imap."""
+    os.makedirs(imap_dir, exist_ok=True)
+    for index, raw in enumerate(messages):
+        with open(os.path.join(imap_dir, f"{index:05d}.eml"), "wb") as f:
+            f.write(raw)
+
+
+@contextmanager
+def offline_environment(mailbox=None, latency_ms=0):
+    """
+    Plugs in a FakeBackend seeded from the fixtures and applies the fixture
+    config, so main.main() runs end to end without a network. Downloads and the
+    calendar cache and travel state go to a temporary directory. Yields the backend.
+    """
+    backend = backends.FakeBackend(FIXTURES_DIR, latency_ms,
+                                   mailbox=mailbox if mailbox is not None else build_mailbox())
+    work_dir = tempfile.mkdtemp(prefix="expense-bench-")
+    overrides = fixture_config()
+    overrides["DOWNLOAD_DIR"] = os.path.join(work_dir, "downloads")
+    overrides["CALENDAR_CACHE_DIR"] = os.path.join(work_dir, "calendar_cache")
+    overrides["TRAVEL_STATE_DIR"] = os.path.join(work_dir, "travel_state")
+    overrides["LEDGER_PATH"] = os.path.join(work_dir, "ledger.sqlite3")
+    overrides["RUN_MANIFEST_DIR"] = os.path.join(work_dir, "run_manifest")
+    try:
+        with account_config.overrides(overrides), backends.use(backend):
+            yield backend
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
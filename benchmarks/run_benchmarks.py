@@ -0,0 +1,253 @@
+# run_benchmarks.py
+# Times the parsers, location classification, row building and a full offline
+# main() run against recorded fixtures, and flags regressions against a stored
+# baseline.
+#
+# Run from the repository root (config.py must be importable; the fixture
+# config is applied on top of it, so your own settings don't change results):
+#   python benchmarks/run_benchmarks.py                    # compare with baseline.json
+#   python benchmarks/run_benchmarks.py --update-baseline  # record a new baseline
+#   python benchmarks/run_benchmarks.py --only parse_flight_pdf offline_main
+#
+# Timings are machine-dependent: record the baseline on the machine you compare on.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import offline
+from offline import REPORT_MONTH
+
+import account_config
+import instrumentation
+import main
+import utils
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def _parsed_fixtures():
+    """Inputs for the row-building benchmarks, produced by the real parsers from the fixtures."""
+    flights = utils.parse_flight_pdf(offline.FLIGHT_PDF)
+    hotel = utils.parse_hotel_reservation_pdf(offline.HOTEL_PDF)
+    per_diem_rates = {}
+    for country, page in offline.PER_DIEM_PAGES.items():
+        with open(page, "r", encoding="utf-8") as f:
+            for city, rates in utils.parse_per_diem_table(f.read()).items():
+                per_diem_rates.setdefault(city, {**rates, "country": country})
+    meetings = {}
+    for day, company in [(4, "Globex Corporation"), (12, "Initech"), (17, "Hooli"), (19, "Globex Corporation"),
+                         (24, "Initech"), (26, "Hooli")]:
+        meetings[REPORT_MONTH.replace(day=day)] = company
+    travel = main.build_travel_calendar(flights, meetings, REPORT_MONTH, 1)
+
+    uber_data = []
+    for html in offline.uber_corpus():
+        details = utils.parse_uber_receipt_email(html)
+        if details.date is None or details.date.month != REPORT_MONTH.month:
+            details.date = REPORT_MONTH.replace(day=12)
+        details.filepath = f"uber_receipt_{details.date:%Y%m%d}.pdf"
+        uber_data.append(details)
+
+    return {
+        "flights": flights,
+        "hotel_reservations": [hotel],
+        "per_diem_rates": per_diem_rates,
+        "bangalore_meetings": meetings,
+        "uber_data": uber_data,
+        **travel,
+    }
+
+
+def build_cases():
+    """Returns {name: (func, calls per timing)}; each func runs the measured work once."""
+    corpus = offline.uber_corpus()
+    addresses = []
+    for html in corpus:
+        details = utils.parse_uber_receipt_email(html)
+        addresses += [details.pickup, details.dropoff]
+    fixtures = _parsed_fixtures()
+    mailbox = offline.build_mailbox()
+    metrics_path = os.path.join(tempfile.gettempdir(), "benchmark_run_metrics.json")
+
+    def parse_flight_pdf():
+        utils.parse_flight_pdf(offline.FLIGHT_PDF)
+
+    def parse_hotel_reservation_pdf():
+        utils.parse_hotel_reservation_pdf(offline.HOTEL_PDF)
+
+    def parse_uber_receipt_email():
+        for html in corpus:
+            utils.parse_uber_receipt_email(html)
+
+    def parse_per_diem_table():
+        with open(offline.PER_DIEM_PAGES["India"], "r", encoding="utf-8") as f:
+            utils.parse_per_diem_table(f.read())
+
+    def classify_location():
+        for address in addresses:
+            utils.classify_location(address, "Bangalore", fixtures["hotel_reservations"])
+
+    def location_classifier():
+        classifier = utils.LocationClassifier(fixtures["hotel_reservations"])
+        for address in addresses:
+            classifier.classify(address)
+
+    def per_diem_rows():
+        main.build_per_diem_rows(fixtures["per_diem_rates"], utils.get_mie_breakdown(), fixtures["travel_calendar"],
+                                 REPORT_MONTH, 1)
+
+    def reimbursement_rows():
+        main.build_reimbursement_rows(fixtures["uber_data"], fixtures["travel_calendar"],
+                                      fixtures["bangalore_meetings"], fixtures["hotel_reservations"], 86.62, 297.85)
+
+    def offline_main():
+        with offline.offline_environment(mailbox):
+            main.main(["--year", str(REPORT_MONTH.year), "--month", str(REPORT_MONTH.month),
+                       "--start-day", "1", "--metrics", metrics_path])
+
+    return {
+        "parse_flight_pdf": (parse_flight_pdf, 5),
+        "parse_hotel_reservation_pdf": (parse_hotel_reservation_pdf, 5),
+        "parse_uber_receipt_email": (parse_uber_receipt_email, 1),
+        "parse_per_diem_table": (parse_per_diem_table, 10),
+        "classify_location": (classify_location, 5),
+        "location_classifier": (location_classifier, 50),
+        "per_diem_rows": (per_diem_rows, 500),
+        "reimbursement_rows": (reimbursement_rows, 50),
+        "offline_main": (offline_main, 1),
+    }
+
+
+def _reference_workload():
+    """
+    Fixed pure-Python work (string formatting, dict and list churn, sorting).
+    Timings are compared relative to it, so a machine that is busier (or just
+    faster) than when the baseline was recorded doesn't read as a regression.
+    """
+    rows = {}
+    for i in range(20000):
+        key = f"{i % 997:04d}-{i * 7919 % 10007}"
+        rows.setdefault(key[:4], []).append(int(key[5:]))
+    return sorted((k, sum(v)) for k, v in rows.items())
+
+
+def time_case(func, number, repeat):
+    """
+    Best and median time per call (seconds) over repeat timings of number calls
+    each, plus the best time of the reference workload run before each timing.
+    """
+    samples = []
+    reference = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        _reference_workload()
+        reference.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) / number)
+    return {
+        "median_s": statistics.median(samples),
+        "min_s": min(samples),
+        "reference_s": min(reference),
+        "calls": number * repeat,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the names of cases more than threshold slower than the baseline,
+    after scaling each best time by the reference workload timed alongside it.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<30}{'best':>12}{'median':>12}{'baseline':>12}{'change':>10}")
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        line = f"{name:<30}{result['min_s'] * 1000:>10.3f}ms{result['median_s'] * 1000:>10.3f}ms"
+        if base:
+            change = (result["min_s"] / result["reference_s"]) / (base["min_s"] / base["reference_s"]) - 1
+            flag = "  REGRESSION" if change > threshold else ""
+            line += f"{base['min_s'] * 1000:>10.3f}ms{change:>+10.1%}{flag}"
+            if flag:
+                regressions.append(name)
+        else:
+            line += f"{'-':>12}{'new':>10}"
+        print(line)
+    return regressions
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks and compare with the stored baseline.")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these benchmarks")
+    parser.add_argument("--repeat", type=int, default=10, help="timings per benchmark (default: 10)")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="calibrated slowdown over the baseline that counts as a regression (default: 0.25)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file (default: benchmarks/baseline.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="save these results as the new baseline")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    # Parsers read keyword lists etc. from config, so pin them to the fixture values
+    with account_config.overrides(offline.fixture_config()):
+        cases = build_cases()
+        unknown = set(args.only or []) - set(cases)
+        if unknown:
+            parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+        results = {}
+        for name, (func, number) in cases.items():
+            if args.only and name not in args.only:
+                continue
+            print(f"Running {name}...", flush=True)
+            # The pipeline prints progress; keep it out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                func()  # warm-up: imports, regex compilation, file cache
+                instrumentation.reset()
+                results[name] = time_case(func, number, max(1, args.repeat))
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                previous = json.load(f).get("results", {})
+            report["results"] = {**previous, **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        compare(results, {}, args.threshold)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("platform") != report["platform"]:
+            print(f"Note: baseline was recorded on {baseline.get('platform')}, not this machine.")
+    else:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one.")
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,93 @@
+# startup.py
+# Measures how long `python main.py --help` spends importing modules, using
+# Python's -X importtime, and fails if the CLI starts pulling in the heavy
+# client libraries (Selenium, googleapiclient, pdfplumber, ...) again before
+# they're needed.
+#
+# Run from the repository root:
+#   python benchmarks/startup.py
+#   python benchmarks/startup.py --budget-ms 150 --top 20
+#   python benchmarks/startup.py -- --months 2025-01..2025-03 --help
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded inside the functions that use them; importing any of these for --help is a regression
+HEAVY_MODULES = [
+    "selenium",
+    "webdriver_manager",
+    "pdfplumber",
+    "bs4",
+    "requests",
+    "googleapiclient.discovery",
+    "google_auth_oauthlib",
+    "google.oauth2.credentials",
+]
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(cli_args):
+    """
+    Runs main.py under -X importtime and returns {module: (self_us, cumulative_us)}
+    for every module it imported, plus the total import time in microseconds.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "main.py", *cli_args],
+                            cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"main.py {' '.join(cli_args)} exited with {result.returncode}:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules[name] = (int(self_us), int(cumulative_us))
+        if len(indent) == 1:  # top-level imports; their cumulative times cover everything below
+            total_us += int(cumulative_us)
+    return modules, total_us
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time of the main.py command line.")
+    parser.add_argument("--repeat", type=int, default=5, help="runs to take the best of (default: 5)")
+    parser.add_argument("--budget-ms", type=float, default=200,
+                        help="fail if importing takes longer than this (default: 200)")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list (default: 10)")
+    parser.add_argument("cli_args", nargs="*", default=["--help"],
+                        help="arguments for main.py (default: --help); put them after --")
+    args = parser.parse_args(argv)
+
+    runs = [import_times(args.cli_args) for _ in range(max(1, args.repeat))]
+    modules, _ = min(runs, key=lambda run: run[1])
+    totals_ms = [total_us / 1000 for _, total_us in runs]
+    best_ms = min(totals_ms)
+
+    print(f"main.py {' '.join(args.cli_args)}: imports took {best_ms:.1f}ms "
+          f"(best of {len(runs)}, median {statistics.median(totals_ms):.1f}ms)")
+    print(f"\n{'module':<45}{'self':>10}{'cumulative':>14}")
+    slowest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"{name:<45}{self_us / 1000:>8.1f}ms{cumulative_us / 1000:>12.1f}ms")
+
+    failures = []
+    heavy = [name for name in HEAVY_MODULES if name in modules]
+    if heavy:
+        failures.append(f"heavy modules imported at startup: {', '.join(heavy)}")
+    if best_ms > args.budget_ms:
+        failures.append(f"imports took {best_ms:.1f}ms, over the {args.budget_ms:.0f}ms budget")
+    for failure in failures:
+        print(f"\nFAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
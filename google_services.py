@@ -1,15 +1,20 @@
 # google_services.py
 # This module handles all interactions with Google APIs: Authentication, Gmail, Drive, and Sheets.
+# The google-auth and googleapiclient client libraries are imported where
+# they're used; only HttpError is needed up front, for the except clauses.
 
 import os
+import re
+import json
 import base64
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import config as Config
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import instrumentation
+import resilience
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload
 
 # Scopes define the permissions the script will request from the user.
 SCOPES = [
@@ -20,29 +25,184 @@ SCOPES = [
 ]
 
 
-def authenticate():
+def execute(request, api, operation, idempotent=True):
+    """
+    Executes a googleapiclient request, counting it under "<api>.requests"
+    and timing it as "<api>.<operation>" (e.g. "gmail", "messages.get").
+    Goes through resilience.call, so it is rate limited per account and
+    retried on 429s, 5xx errors and timeouts. A request that isn't idempotent
+    (one that creates a file or appends rows) is only retried when it was
+    rate limited, since after a 5xx or timeout it may have been carried out.
+    """
+    def attempt():
+        instrumentation.count(f"{api}.requests")
+        with instrumentation.timer(f"{api}.{operation}", api):
+            return request.execute()
+
+    retryable = resilience.is_transient if idempotent else resilience.is_rate_limited
+    return resilience.call(api, attempt, key=getattr(Config, "TOKEN_PATH", None), retryable=retryable)
+
+
+# Discovery documents as shipped with googleapiclient, read from disk once per process
+_discovery_texts = {}
+_discovery_lock = threading.Lock()
+# Per thread: parsed discovery documents and one keep-alive AuthorizedHttp per
+# credentials. httplib2 connections aren't thread-safe, and googleapiclient
+# fills in a parsed document while building methods, so neither is shared.
+_thread_state = threading.local()
+_refresh_lock = threading.Lock()
+
+
+def _discovery_document(api, version):
+    """The bundled discovery document for api/version, parsed once per thread (None if not bundled)."""
+    from googleapiclient.discovery_cache import get_static_doc
+
+    key = (api, version)
+    with _discovery_lock:
+        if key not in _discovery_texts:
+            _discovery_texts[key] = get_static_doc(api, version)
+    documents = _thread_state.__dict__.setdefault("documents", {})
+    if key not in documents and _discovery_texts[key] is not None:
+        documents[key] = json.loads(_discovery_texts[key])
+    return documents.get(key)
+
+
+def _expires_soon(creds):
+    margin = timedelta(seconds=getattr(Config, "TOKEN_REFRESH_MARGIN", 600))
+    expiry = getattr(creds, "expiry", None)
+    return bool(expiry and getattr(creds, "refresh_token", None) and expiry - datetime.now(timezone.utc).replace(tzinfo=None) < margin)
+
+
+def refresh_if_expiring(creds):
+    """
+    Refreshes creds ahead of time if the access token expires within
+    config.TOKEN_REFRESH_MARGIN seconds (default 600), so a long run doesn't
+    stall on a 401 and a refresh halfway through.
+    """
+    if not _expires_soon(creds):
+        return False
+    from google.auth.transport.requests import Request
+
+    with _refresh_lock:
+        if _expires_soon(creds):  # another thread may have refreshed it meanwhile
+            if Config.DEBUG_MODE: print("Refreshing Google access token before it expires...")
+            creds.refresh(Request())
+            return True
+    return False
+
+
+def authorized_http(creds):
+    """This thread's keep-alive AuthorizedHttp for creds, created on first use."""
+    import google_auth_httplib2
+    import httplib2
+
+    pool = _thread_state.__dict__.setdefault("http", {})
+    entry = pool.get(id(creds))
+    if entry is None or entry[0] is not creds:
+        http = httplib2.Http(timeout=getattr(Config, "GOOGLE_HTTP_TIMEOUT", 60))
+        entry = (creds, google_auth_httplib2.AuthorizedHttp(creds, http=http))
+        pool[id(creds)] = entry
+    return entry[1]
+
+
+def build_service(api, version, creds):
+    """
+    Builds a Google API client from the discovery document bundled with
+    googleapiclient (no discovery request, no re-reading the JSON), on the
+    thread's shared keep-alive connection.
+    """
+    from googleapiclient.discovery import build, build_from_document
+
+    refresh_if_expiring(creds)
+    http = authorized_http(creds)
+    document = _discovery_document(api, version)
+    if document is None:
+        return build(api, version, http=http, static_discovery=False)
+    return build_from_document(document, http=http)
+
+
+class ServicePool:
+    """
+    One Google API client per thread. A client wraps an httplib2.Http, which
+    isn't thread-safe, so code that makes API calls from several threads takes
+    its client from a pool instead of sharing one:
+
+        drive = ServicePool(lambda: build_service("drive", "v3", creds))
+        run_concurrently(lambda path: upload_file_to_drive(drive.get(), path, folder_id), paths)
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+
+    def get(self):
+        """This thread's client, built with factory() on first use."""
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self._factory()
+        return service
+
+
+def run_concurrently(func, items, max_workers=None):
+    """
+    Calls func(item) for every item on a thread pool of up to
+    config.GOOGLE_API_WORKERS threads (default 4) and returns the results in
+    order; the first exception is re-raised. Each call runs in a copy of the
+    caller's context, so per-account config overrides and the service backend
+    carry over. Pair it with a ServicePool for the clients.
+    items may be a generator: each item is submitted as soon as it is produced,
+    so the calls overlap whatever is producing them, and a call that fails
+    stops the generator and cancels the calls not started yet as soon as it
+    is noticed, instead of after the last item.
+    """
+    max_workers = max_workers or getattr(Config, "GOOGLE_API_WORKERS", 4)
+    if max_workers <= 1 or (isinstance(items, (list, tuple)) and len(items) <= 1):
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="google-api") as executor:
+        futures = []
+        running = set()
+        try:
+            for item in items:
+                future = executor.submit(contextvars.copy_context().run, func, item)
+                futures.append(future)
+                running.add(future)
+                for finished in [f for f in running if f.done()]:
+                    running.discard(finished)
+                    finished.result()   # raises the call's exception
+            return [future.result() for future in futures]
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def authenticate(token_path=None):
     """
     Handles user authentication for Google APIs.
-    Creates a 'token.json' file to store access and refresh tokens.
+    Creates a 'token.json' file (or config.TOKEN_PATH) to store access and refresh tokens.
     Automatically re-prompts if refresh token is expired, revoked, or invalid.
-    Deletes token.json if it's no longer usable.
+    Deletes the token file if it's no longer usable.
     """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
+    token_path = token_path or getattr(Config, "TOKEN_PATH", "token.json")
 
     # Load existing credentials if they exist
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
 
-    # If no valid credentials, try refresh or full login
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+    # If no valid credentials (or they are about to expire), try refresh or full login
+    if not creds or not creds.valid or _expires_soon(creds):
+        if creds and creds.refresh_token:
             try:
                 creds.refresh(Request())
             except Exception as e:
                 print(f"⚠ Refresh token failed: {e}")
                 # Delete bad token file
-                if os.path.exists("token.json"):
-                    os.remove("token.json")
+                if os.path.exists(token_path):
+                    os.remove(token_path)
                 creds = None  # Force full re-authentication
 
         if not creds or not creds.valid:
@@ -50,7 +210,7 @@ def authenticate():
             creds = flow.run_local_server(port=0)
 
         # Save new credentials
-        with open("token.json", "w") as token:
+        with open(token_path, "w") as token:
             token.write(creds.to_json())
 
     return creds
@@ -59,7 +219,7 @@ def authenticate():
 def search_gmail(service, query):
     """Searches Gmail for emails matching the given query."""
     try:
-        response = service.users().messages().list(userId="me", q=query).execute()
+        response = execute(service.users().messages().list(userId="me", q=query), "gmail", "messages.list")
         messages = response.get("messages", [])
         return messages
     except HttpError as error:
@@ -67,9 +227,14 @@ def search_gmail(service, query):
         return []
 
 def get_gmail_attachment(service, msg_id, attachment_filename):
-    """Downloads a specific attachment from a Gmail message."""
+    """
+    Downloads a specific attachment from a Gmail message into config.DOWNLOAD_DIR
+    (the current directory by default) and returns the saved path. The file is
+    named "<msg_id>_<attachment_filename>", so attachments of the same name in
+    different emails, downloaded at the same time, don't overwrite each other.
+    """
     try:
-        message = service.users().messages().get(userId="me", id=msg_id).execute()
+        message = execute(service.users().messages().get(userId="me", id=msg_id), "gmail", "messages.get")
         parts_to_search = message["payload"].get("parts", [])
         
         queue = list(parts_to_search)
@@ -83,28 +248,40 @@ def get_gmail_attachment(service, msg_id, attachment_filename):
                     data = part["body"]["data"]
                 else:
                     att_id = part["body"]["attachmentId"]
-                    att = service.users().messages().attachments().get(userId="me", messageId=msg_id, id=att_id).execute()
+                    att = execute(service.users().messages().attachments().get(userId="me", messageId=msg_id, id=att_id), "gmail", "attachments.get")
                     data = att["data"]
 
                 file_data = base64.urlsafe_b64decode(data.encode("UTF-8"))
-                with open(attachment_filename, "wb") as f:
+                instrumentation.count("bytes.gmail", len(file_data))
+                download_dir = getattr(Config, "DOWNLOAD_DIR", ".")
+                os.makedirs(download_dir, exist_ok=True)
+                file_path = os.path.join(download_dir, f"{msg_id}_{attachment_filename}")
+                with open(file_path, "wb") as f:
                     f.write(file_data)
-                return attachment_filename
+                return file_path
     except HttpError as error:
         print(f"An error occurred while downloading attachment: {error}")
     return None
 
-def create_drive_folder(service, folder_name):
-    """Creates a folder in Google Drive if it doesn't already exist."""
+def create_drive_folder(service, folder_name, parent_id=None):
+    """
+    Creates a folder in Google Drive if it doesn't already exist.
+    The folder goes under parent_id, or config.DRIVE_PARENT_FOLDER_ID if set.
+    """
+    parent_id = parent_id or getattr(Config, "DRIVE_PARENT_FOLDER_ID", None)
     try:
         query = f"mimeType='application/vnd.google-apps.folder' and name='{folder_name}' and trashed=false"
-        response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
+        if parent_id:
+            query += f" and '{parent_id}' in parents"
+        response = execute(service.files().list(q=query, spaces='drive', fields='files(id, name)'), "drive", "files.list")
         if response.get('files'):
             print(f"Folder '{folder_name}' already exists.")
             return response.get('files')[0].get('id')
 
         file_metadata = {"name": folder_name, "mimeType": "application/vnd.google-apps.folder"}
-        folder = service.files().create(body=file_metadata, fields="id").execute()
+        if parent_id:
+            file_metadata["parents"] = [parent_id]
+        folder = execute(service.files().create(body=file_metadata, fields="id"), "drive", "files.create", idempotent=False)
         if Config.DEBUG_MODE: print(f"Created Google Drive folder: '{folder_name}'")
         return folder.get("id")
     except HttpError as error:
@@ -113,10 +290,13 @@ def create_drive_folder(service, folder_name):
 
 def upload_file_to_drive(service, file_path, folder_id):
     """Uploads a local file to a specified Google Drive folder."""
+    from googleapiclient.http import MediaFileUpload
+
     try:
         file_metadata = {"name": os.path.basename(file_path), "parents": [folder_id]}
         media = MediaFileUpload(file_path, resumable=True)
-        file = service.files().create(body=file_metadata, media_body=media, fields="id").execute()
+        instrumentation.count("bytes.drive_upload", os.path.getsize(file_path))
+        file = execute(service.files().create(body=file_metadata, media_body=media, fields="id"), "drive", "files.create", idempotent=False)
         if Config.DEBUG_MODE: print(f"Uploaded file '{os.path.basename(file_path)}' to Drive.")
         return file.get("id")
     except HttpError as error:
@@ -132,7 +312,7 @@ def create_google_sheet(drive_service, sheet_name, folder_id):
             "parents": [folder_id],
             "mimeType": "application/vnd.google-apps.spreadsheet",
         }
-        sheet = drive_service.files().create(body=file_metadata, fields="id").execute()
+        sheet = execute(drive_service.files().create(body=file_metadata, fields="id"), "drive", "files.create", idempotent=False)
         if Config.DEBUG_MODE: print(f"Created Google Sheet: '{sheet_name}'")
         return sheet.get("id")
     except HttpError as error:
@@ -158,9 +338,9 @@ def setup_spreadsheet_tabs(sheets_service, spreadsheet_id, tab_configs):
         requests.append({"addSheet": {"properties": {"title": config["name"]}}})
 
     try:
-        sheets_service.spreadsheets().batchUpdate(
+        execute(sheets_service.spreadsheets().batchUpdate(
             spreadsheetId=spreadsheet_id, body={"requests": requests}
-        ).execute()
+        ), "sheets", "spreadsheets.batchUpdate", idempotent=False)
 
         if Config.DEBUG_MODE: print(f"Successfully created tabs: {[c['name'] for c in tab_configs]}")
         
@@ -177,12 +357,12 @@ def append_values(sheets_service, spreadsheet_id, range_name, values):
         body = {"values": values}
         # CORRECTED: The range for an append operation should just be the sheet name.
         # This makes the request less ambiguous and prevents the API from duplicating rows.
-        sheets_service.spreadsheets().values().append(
+        execute(sheets_service.spreadsheets().values().append(
             spreadsheetId=spreadsheet_id,
             range=range_name,
             valueInputOption="USER_ENTERED",
             body=body,
-        ).execute()
+        ), "sheets", "values.append", idempotent=False)
         print(f"Successfully wrote {len(values)} row(s) to tab '{range_name}'.")
     except HttpError as error:
         print(f"An error occurred appending values to sheet: {error}")
@@ -194,10 +374,10 @@ def copy_google_sheet(drive_service, template_file_id: str, name: str, folder_id
         "name": name,
         "parents": [folder_id]
     }
-    copied = drive_service.files().copy(
+    copied = execute(drive_service.files().copy(
         fileId=template_file_id,
         body=body
-    ).execute()
+    ), "drive", "files.copy", idempotent=False)
     return copied["id"]
 
 def copy_and_convert_to_sheet(drive_service, template_file_id: str, name: str, folder_id: str) -> str:
@@ -220,31 +400,325 @@ def copy_and_convert_to_sheet(drive_service, template_file_id: str, name: str, f
         "mimeType": "application/vnd.google-apps.spreadsheet"
     }
     
-    copied_sheet = drive_service.files().copy(
+    copied_sheet = execute(drive_service.files().copy(
         fileId=template_file_id,
         body=body
-    ).execute()
+    ), "drive", "files.copy", idempotent=False)
     
     print(f"Successfully created Google Sheet '{name}' with ID: {copied_sheet['id']}")
     return copied_sheet["id"]
 
 def clear_values(sheets_service, spreadsheet_id: str, a1_range: str):
-    sheets_service.spreadsheets().values().clear(
+    execute(sheets_service.spreadsheets().values().clear(
         spreadsheetId=spreadsheet_id,
         range=a1_range,
         body={}
-    ).execute()
+    ), "sheets", "values.clear")
 
 def update_values(sheets_service, spreadsheet_id: str, a1_range: str, values: list[list[str | float]]):
-    sheets_service.spreadsheets().values().update(
+    execute(sheets_service.spreadsheets().values().update(
         spreadsheetId=spreadsheet_id,
         range=a1_range,
         valueInputOption="USER_ENTERED",   # keep formulas working
         body={"values": values}
-    ).execute()
+    ), "sheets", "values.update")
+
+
+class SheetWriter:
+    """
+    Collects value writes for several tabs of one spreadsheet and sends them in bulk.
+
+    Instead of a clear + update pair per tab (with clear ranges reaching row 9999),
+    flush() reads the currently used rows of every queued range in one batchGet,
+    pads the new rows with blanks so stale rows left over from the template are
+    overwritten, and writes everything in a single values().batchUpdate.
+
+    A range queued with the rows it held before (previous) needs no batchGet,
+    and only the rows that differ from them are written.
+    """
+
+    def __init__(self, sheets_service, spreadsheet_id: str):
+        self.sheets_service = sheets_service
+        self.spreadsheet_id = spreadsheet_id
+        self.api_calls = 0
+        self._writes = []
+
+    def add(self, tab_name: str, start_row: int, last_col: str, values: list[list[str | float]], previous=None):
+        """
+        Queues rows to be written to tab_name from column A of start_row through last_col.
+        previous: the rows written there last time, if known; only changed rows are then written.
+        """
+        self._writes.append({
+            "tab": tab_name,
+            "start_row": start_row,
+            "last_col": last_col,
+            "values": values,
+            "previous": previous,
+        })
+
+    @property
+    def pending(self) -> int:
+        """Number of queued ranges not yet written (flush() failed or wasn't called)."""
+        return len(self._writes)
+
+    def _used_row_counts(self, writes):
+        """Returns the number of rows currently in use from each of the writes' start row."""
+        ranges = [f"{w['tab']}!A{w['start_row']}:{w['last_col']}" for w in writes]
+        response = execute(self.sheets_service.spreadsheets().values().batchGet(
+            spreadsheetId=self.spreadsheet_id,
+            ranges=ranges,
+            fields="valueRanges(values)"
+        ), "sheets", "values.batchGet")
+        self.api_calls += 1
+        value_ranges = response.get("valueRanges", [])
+        return [len(vr.get("values", [])) for vr in value_ranges] + [0] * (len(ranges) - len(value_ranges))
+
+    def flush(self) -> int:
+        """Writes all queued tabs and returns the number of Sheets API calls made."""
+        if not self._writes:
+            return self.api_calls
+
+        try:
+            unknown = [w for w in self._writes if w["previous"] is None]
+            used_rows = dict(zip(map(id, unknown), self._used_row_counts(unknown))) if unknown else {}
+
+            data = []
+            for write in self._writes:
+                width = _column_number(write["last_col"])
+                values = _padded(write["values"], width)
+                previous = write["previous"]
+                used = len(previous) if previous is not None else used_rows[id(write)]
+                # Blank out rows the template (or a previous run) left below the new data
+                values.extend([[""] * width for _ in range(used - len(values))])
+                if previous is None:
+                    data.append(self._range_data(write, 0, values))
+                    continue
+
+                previous = _padded(previous, width)
+                changed = [i for i, row in enumerate(values) if i >= len(previous) or row != previous[i]]
+                # One range per run of consecutive changed rows
+                run_start = None
+                for i, index in enumerate(changed):
+                    if run_start is None:
+                        run_start = index
+                    if i + 1 == len(changed) or changed[i + 1] != index + 1:
+                        data.append(self._range_data(write, run_start, values[run_start:index + 1]))
+                        run_start = None
+
+            if data:
+                execute(self.sheets_service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={"valueInputOption": "USER_ENTERED", "data": data}   # keep formulas working
+                ), "sheets", "values.batchUpdate")   # fixed ranges, so safe to send twice
+                self.api_calls += 1
+            self._writes = []
+            if Config.DEBUG_MODE: print(f"Wrote {len(data)} range(s) with {self.api_calls} Sheets API call(s).")
+        except HttpError as error:
+            print(f"An error occurred writing values to sheet: {error}")
+
+        return self.api_calls
+
+
+    @staticmethod
+    def _range_data(write, offset, values):
+        """The batchUpdate entry for values written offset rows below the write's start row."""
+        first_row = write["start_row"] + offset
+        return {
+            "range": f"{write['tab']}!A{first_row}:{write['last_col']}{first_row + len(values) - 1}",
+            "values": values,
+        }
+
+
+def _padded(rows, width):
+    """Copies of rows, each filled out with blanks to width cells."""
+    return [list(row) + [""] * (width - len(row)) for row in rows]
+
+
+def _column_number(column_letters: str) -> int:
+    """Converts an A1 column label ('A', 'K', 'AA') to its 1-based index."""
+    number = 0
+    for ch in column_letters.upper():
+        number = number * 26 + (ord(ch) - ord("A") + 1)
+    return number
+
+
+def column_letters(number: int) -> str:
+    """Converts a 1-based column index to its A1 label (1 -> 'A', 27 -> 'AA')."""
+    letters = ""
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+# Only the fields the company matching needs; keeps each page small.
+CALENDAR_EVENT_FIELDS = "nextPageToken,items(id,summary,start)"
+CALENDAR_SYNC_FIELDS = "nextPageToken,nextSyncToken,items(id,status,summary,start)"
+
+
+def compile_company_matcher(company_names: list):
+    """
+    Builds one case-insensitive matcher over all company names (see
+    utils.KeywordMatcher), which finds every name in a text, including one
+    inside a longer name ("Acme" in "Acme Labs").
+    Returns (matcher, lookup) where lookup maps a lowercased name to its company name.
+    """
+    import utils
+
+    names = [name for name in company_names if name]
+    if not names:
+        return None, {}
+    lookup = {}
+    for name in names:
+        lookup.setdefault(name.lower(), name)
+    return utils.KeywordMatcher((name, name) for name in lookup.values()), lookup
+
+
+def match_company(matcher, text: str):
+    """
+    Returns the company named in text, or None.
+    When several companies appear, the one listed first in company_names wins.
+    """
+    if not matcher or not text:
+        return None
+    return matcher.first(text.lower())
 
 
-def search_calendar_events(calendar_service, company_names: list, start_date, end_date):
+def list_calendar_events(calendar_service, time_min: str, time_max: str, query=None, calendar_id='primary'):
+    """
+    Yields every event between time_min and time_max, following nextPageToken
+    so results past the first page are not dropped.
+    """
+    page_token = None
+    while True:
+        params = {
+            "calendarId": calendar_id,
+            "timeMin": time_min,
+            "timeMax": time_max,
+            "singleEvents": True,
+            "orderBy": 'startTime',
+            "maxResults": 2500,
+            "fields": CALENDAR_EVENT_FIELDS,
+        }
+        if query:
+            params["q"] = query
+        if page_token:
+            params["pageToken"] = page_token
+
+        events_result = execute(calendar_service.events().list(**params), "calendar", "events.list")
+        yield from events_result.get('items', [])
+
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            break
+
+
+def _calendar_cache_path(calendar_id):
+    safe_id = re.sub(r'[^A-Za-z0-9._-]', '_', calendar_id)
+    return os.path.join(_calendar_cache_dir(), f"{safe_id}.json")
+
+
+def _calendar_cache_dir():
+    # Local event cache and sync token per calendar, used by incremental sync.
+    # Read on each call so per-account overrides apply.
+    return getattr(Config, "CALENDAR_CACHE_DIR", ".calendar_cache")
+
+
+def load_calendar_cache(calendar_id='primary'):
+    """Loads the cached events and sync token for a calendar, or an empty cache."""
+    path = _calendar_cache_path(calendar_id)
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠ Ignoring unreadable calendar cache {path}: {e}")
+    return {"sync_token": None, "events": {}, "time_min": None}
+
+
+def save_calendar_cache(cache, calendar_id='primary'):
+    """Writes the event cache atomically so an interrupted run can't corrupt it."""
+    os.makedirs(_calendar_cache_dir(), exist_ok=True)
+    path = _calendar_cache_path(calendar_id)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+
+def sync_calendar_events(calendar_service, calendar_id='primary', time_min=None):
+    """
+    Brings the local event cache for a calendar up to date and returns its events.
+
+    The first run does a full sync of the events from time_min (an RFC3339
+    timestamp; the whole calendar history if None) and stores the
+    nextSyncToken. Later runs send that token and only receive events that
+    changed or were deleted since (the Calendar API does not allow
+    timeMin/timeMax/orderBy/q together with sync tokens). If the token has
+    expired (410 Gone), or the cache starts after time_min, the cache is
+    dropped and a full sync runs again.
+    """
+    cache = load_calendar_cache(calendar_id)
+    cached_min = cache.get("time_min")
+    if not cache["sync_token"] or (cached_min and (time_min is None or time_min < cached_min)):
+        cache = {"sync_token": None, "events": {}, "time_min": time_min}
+    events = cache["events"]
+
+    while True:
+        page_token = None
+        try:
+            while True:
+                params = {
+                    "calendarId": calendar_id,
+                    "singleEvents": True,
+                    "showDeleted": bool(cache["sync_token"]),
+                    "maxResults": 2500,
+                    "fields": CALENDAR_SYNC_FIELDS,
+                }
+                if cache["sync_token"]:
+                    params["syncToken"] = cache["sync_token"]
+                elif cache["time_min"]:
+                    params["timeMin"] = cache["time_min"]
+                if page_token:
+                    params["pageToken"] = page_token
+
+                events_result = execute(calendar_service.events().list(**params), "calendar", "events.list")
+                for event in events_result.get('items', []):
+                    if event.get('status') == 'cancelled':
+                        events.pop(event['id'], None)
+                    elif event.get('start'):
+                        events[event['id']] = {"summary": event.get('summary', ''), "start": event['start']}
+
+                page_token = events_result.get('nextPageToken')
+                if not page_token:
+                    cache["sync_token"] = events_result.get('nextSyncToken')
+                    break
+            break
+        except HttpError as error:
+            if error.resp.status == 410 and cache["sync_token"]:
+                print("Calendar sync token expired, running a full resync.")
+                cache = {"sync_token": None, "events": {}, "time_min": time_min}
+                events = cache["events"]
+                continue
+            raise
+
+    save_calendar_cache(cache, calendar_id)
+    if Config.DEBUG_MODE: print(f"Calendar cache for '{calendar_id}' holds {len(events)} event(s).")
+    return list(events.values())
+
+
+def _event_date(event):
+    """Returns the start date of a Calendar event as a datetime.date."""
+    start = event['start'].get('dateTime', event['start'].get('date'))
+    if 'T' in start:
+        # DateTime format: 2026-01-15T10:00:00+05:30
+        return datetime.fromisoformat(start.replace('Z', '+00:00')).date()
+    # All-day event: 2026-01-15
+    return datetime.strptime(start, '%Y-%m-%d').date()
+
+
+def search_calendar_events(calendar_service, company_names: list, start_date, end_date, server_filter=False,
+                           incremental=False):
     """
     Searches Google Calendar for events matching any of the company names.
     Returns a dict mapping dates to company names found.
@@ -254,51 +728,59 @@ def search_calendar_events(calendar_service, company_names: list, start_date, en
         company_names: List of company names to search for in event titles.
         start_date: Start date for the search range (datetime.date).
         end_date: End date for the search range (datetime.date).
+        server_filter: If True, send one q= query per company so the server only
+            returns candidate events, instead of downloading the whole month.
+        incremental: If True, keep a local event cache updated with sync tokens
+            (see sync_calendar_events) and match against it; only changed or
+            deleted events are fetched on re-runs. Takes precedence over server_filter.
 
     Returns:
         Dict mapping datetime.date to company name string.
     """
-    from datetime import datetime, timedelta
-
     # Convert dates to RFC3339 format for Calendar API
     time_min = datetime.combine(start_date, datetime.min.time()).isoformat() + 'Z'
     time_max = datetime.combine(end_date + timedelta(days=1), datetime.min.time()).isoformat() + 'Z'
 
     date_to_company = {}
+    matcher, lookup = compile_company_matcher(company_names)
+    if not matcher:
+        return date_to_company
 
     try:
-        events_result = calendar_service.events().list(
-            calendarId='primary',
-            timeMin=time_min,
-            timeMax=time_max,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-
-        events = events_result.get('items', [])
+        if incremental:
+            # Synced from a while before the report month, so re-running earlier months doesn't resync
+            lookback = timedelta(days=getattr(Config, "CALENDAR_SYNC_LOOKBACK_DAYS", 365))
+            sync_min = datetime.combine(start_date - lookback, datetime.min.time()).isoformat() + 'Z'
+            events = sorted(
+                (e for e in sync_calendar_events(calendar_service, time_min=sync_min)
+                 if start_date <= _event_date(e) <= end_date),
+                key=lambda e: e['start'].get('dateTime', e['start'].get('date', ''))
+            )
+        elif server_filter:
+            # q= also matches descriptions/locations, so titles are still checked below
+            events_by_id = {}
+            for company in lookup.values():
+                for event in list_calendar_events(calendar_service, time_min, time_max, query=company):
+                    events_by_id.setdefault(event.get('id'), event)
+            events = sorted(
+                events_by_id.values(),
+                key=lambda e: e['start'].get('dateTime', e['start'].get('date', ''))
+            )
+        else:
+            events = list_calendar_events(calendar_service, time_min, time_max)
 
         for event in events:
-            event_summary = event.get('summary', '').lower()
-
-            # Check if any company name matches the event title
-            for company in company_names:
-                if company.lower() in event_summary:
-                    # Extract the date from the event
-                    start = event['start'].get('dateTime', event['start'].get('date'))
-                    if 'T' in start:
-                        # DateTime format: 2026-01-15T10:00:00+05:30
-                        event_date = datetime.fromisoformat(start.replace('Z', '+00:00')).date()
-                    else:
-                        # All-day event: 2026-01-15
-                        event_date = datetime.strptime(start, '%Y-%m-%d').date()
-
-                    if event_date not in date_to_company:
-                        # Use display name mapping if available, otherwise use matched name
-                        display_name = Config.COMPANY_DISPLAY_NAMES.get(company.lower(), company)
-                        date_to_company[event_date] = display_name
-                        if Config.DEBUG_MODE:
-                            print(f"  -> Found calendar event: '{event.get('summary')}' on {event_date} -> {display_name}")
-                    break
+            company = match_company(matcher, event.get('summary', ''))
+            if not company:
+                continue
+
+            event_date = _event_date(event)
+            if event_date not in date_to_company:
+                # Use display name mapping if available, otherwise use matched name
+                display_name = Config.COMPANY_DISPLAY_NAMES.get(company.lower(), company)
+                date_to_company[event_date] = display_name
+                if Config.DEBUG_MODE:
+                    print(f"  -> Found calendar event: '{event.get('summary')}' on {event_date} -> {display_name}")
 
         return date_to_company
 
@@ -312,8 +794,8 @@ if __name__ == "__main__":
         print("Failed to authenticate with Google. Exiting.")
         exit(1)
         
-    drive_service = build("drive", "v3", credentials=creds)
-    sheets_service = build("sheets", "v4", credentials=creds)
+    drive_service = build_service("drive", "v3", creds)
+    sheets_service = build_service("sheets", "v4", creds)
     sheet_name = "HiHiHiHi"
 
     # 👉 Copy the March template (keeps tabs/formatting/header row positions)
@@ -0,0 +1,97 @@
+# instrumentation.py
+# Timers and counters for diagnosing slow runs without reading logs.
+#
+# Stages and external calls are wrapped in timer(); request counts, IMAP
+# commands, Chrome launches, PDF pages and bytes transferred go through count().
+# At the end of a run, write_summary() saves a JSON summary and, optionally,
+# a Chrome trace-event file (open it in chrome://tracing or ui.perfetto.dev).
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_run_start = time.perf_counter()
+_counters = defaultdict(int)
+_timers = {}
+_events = []
+
+# Keep the trace bounded on very large back-fills
+MAX_TRACE_EVENTS = 100000
+
+
+def reset():
+    """Clears all counters, timers and trace events and restarts the run clock."""
+    global _run_start
+    with _lock:
+        _run_start = time.perf_counter()
+        _counters.clear()
+        _timers.clear()
+        _events.clear()
+
+
+def count(name, amount=1):
+    """Adds amount to the named counter (e.g. "gmail.requests", "bytes.imap")."""
+    with _lock:
+        _counters[name] += amount
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def record(name, category, started, duration):
+    """Records a finished timed span; started is a time.perf_counter() value."""
+    with _lock:
+        stats = _timers.setdefault(name, {"category": category, "count": 0, "total_s": 0.0, "max_s": 0.0})
+        stats["count"] += 1
+        stats["total_s"] += duration
+        stats["max_s"] = max(stats["max_s"], duration)
+        if len(_events) < MAX_TRACE_EVENTS:
+            _events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (started - _run_start) * 1e6,
+                "dur": duration * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+            })
+
+
+@contextmanager
+def timer(name, category="call"):
+    """Times the with-block under name, e.g. with timer("stage.gmail_travel", "stage")."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, category, started, time.perf_counter() - started)
+
+
+def summary():
+    """Returns the run's counters and per-name timer statistics as a dict."""
+    with _lock:
+        return {
+            "wall_time_s": round(time.perf_counter() - _run_start, 3),
+            "counters": dict(sorted(_counters.items())),
+            "timers": {
+                name: {**stats, "total_s": round(stats["total_s"], 3), "max_s": round(stats["max_s"], 3)}
+                for name, stats in sorted(_timers.items())
+            },
+        }
+
+
+def write_summary(path, trace_path=None):
+    """Writes the JSON summary to path and, if trace_path is given, a Chrome trace-event file."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary(), f, indent=2)
+    if trace_path:
+        with _lock:
+            events = list(_events)
+        with open(trace_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,261 @@
+# ledger.py
+# A local SQLite copy of every report's rows, for roll-ups across months.
+#
+# Each run stores the month's per diem and reimbursement rows in
+# config.LEDGER_PATH (expense_ledger.sqlite3 by default), replacing whatever
+# an earlier run stored for that month. Sheet formulas are stored as their
+# values: the day's M&IE total and each receipt's US dollar amount.
+#
+#   python main.py summary --from 2025-07 --to 2025-09
+#   python main.py summary --from 2025-01 --to 2025-12 --by quarter,company
+#   python main.py summary --from 2025-07 --to 2025-09 --sheet <spreadsheet id>
+#
+# The summary needs no network access unless --sheet is given, in which case
+# the roll-up is written to one tab of that spreadsheet in a single batch write.
+
+import argparse
+import os
+import sqlite3
+import time
+from contextlib import closing
+from datetime import date, datetime
+
+import config
+import instrumentation
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS per_diem (
+    report_month TEXT NOT NULL,
+    date TEXT NOT NULL,
+    location TEXT,
+    country TEXT,
+    mie_rate REAL,
+    breakfast REAL,
+    lunch REAL,
+    dinner REAL,
+    incidentals REAL,
+    total_usd REAL
+);
+CREATE TABLE IF NOT EXISTS reimbursements (
+    report_month TEXT NOT NULL,
+    date TEXT NOT NULL,
+    receipt TEXT,
+    city TEXT,
+    currency TEXT,
+    description TEXT,
+    amount REAL,
+    exchange_rate REAL,
+    usd REAL,
+    company TEXT
+);
+CREATE INDEX IF NOT EXISTS per_diem_month ON per_diem (report_month);
+CREATE INDEX IF NOT EXISTS per_diem_date ON per_diem (date);
+CREATE INDEX IF NOT EXISTS reimbursements_month ON reimbursements (report_month);
+CREATE INDEX IF NOT EXISTS reimbursements_date ON reimbursements (date);
+CREATE INDEX IF NOT EXISTS reimbursements_company ON reimbursements (company);
+CREATE INDEX IF NOT EXISTS reimbursements_currency ON reimbursements (currency);
+"""
+
+# --by keys: (reimbursements column, per_diem column or None if it doesn't apply)
+_QUARTER = "substr(date, 1, 4) || '-Q' || ((CAST(substr(date, 6, 2) AS INTEGER) + 2) / 3)"
+GROUPS = {
+    "month": ("substr(date, 1, 7)", "substr(date, 1, 7)"),
+    "quarter": (_QUARTER, _QUARTER),
+    "company": ("company", None),
+    "currency": ("currency", None),
+    "city": ("city", "location"),
+}
+
+
+def ledger_path():
+    return getattr(config, "LEDGER_PATH", "expense_ledger.sqlite3")
+
+
+def connect(path=None):
+    """Opens the ledger, creating it and its tables if needed."""
+    path = path or ledger_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _number(value):
+    """A sheet cell as a float, or None for blanks, "N/A" and formulas."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _per_diem_record(month, row):
+    location, _, country = row[1].rpartition(", ")
+    meals = [_number(cell) for cell in row[3:7]]
+    return (month, row[0], location or row[1], country, _number(row[2]), *meals,
+            sum(meal for meal in meals if meal is not None))
+
+
+def _reimbursement_record(month, row):
+    amount, exchange_rate = _number(row[5]), _number(row[6])
+    usd = amount / exchange_rate if amount is not None and exchange_rate else None
+    return (month, row[0], row[1], row[2], row[3], row[4], amount, exchange_rate, usd, row[8])
+
+
+def save_month(report_month_date, per_diem_rows, reimbursement_rows, path=None):
+    """
+    Replaces report_month_date's month in the ledger with the rows built for
+    the sheet (as returned by build_per_diem_rows/build_reimbursement_rows).
+    Total rows are skipped. Returns the number of rows stored.
+    """
+    month = report_month_date.strftime("%Y-%m")
+    per_diem = [_per_diem_record(month, row) for row in per_diem_rows or [] if row[0]]
+    reimbursements = [_reimbursement_record(month, row) for row in reimbursement_rows or [] if row[0]]
+
+    with closing(connect(path)) as conn, conn:
+        conn.execute("DELETE FROM per_diem WHERE report_month = ?", (month,))
+        conn.execute("DELETE FROM reimbursements WHERE report_month = ?", (month,))
+        conn.executemany("INSERT INTO per_diem VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", per_diem)
+        conn.executemany("INSERT INTO reimbursements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", reimbursements)
+
+    instrumentation.count("ledger.rows", len(per_diem) + len(reimbursements))
+    if config.DEBUG_MODE:
+        print(f"Stored {len(per_diem)} per diem and {len(reimbursements)} reimbursement rows "
+              f"for {month} in {path or ledger_path()}")
+    return len(per_diem) + len(reimbursements)
+
+
+def summary(start, end, by=("company", "currency"), path=None):
+    """
+    Totals between two dates (inclusive), grouped by the GROUPS keys in by.
+    Returns {"reimbursements": [(*keys, receipts, amount, usd)], "per_diem": [(*keys, days, usd)],
+    "per_diem_keys": [...]}; per diem rows are grouped only by the keys that apply to them.
+    """
+    for key in by:
+        if key not in GROUPS:
+            raise ValueError(f"Unknown summary grouping '{key}'; expected one of {', '.join(GROUPS)}")
+    bounds = (start.isoformat(), end.isoformat())
+
+    def grouped(table, columns, aggregates):
+        select = ", ".join(list(columns) + aggregates)
+        query = f"SELECT {select} FROM {table} WHERE date BETWEEN ? AND ?"
+        if columns:
+            order = ", ".join(str(i + 1) for i in range(len(columns)))
+            query += f" GROUP BY {order} ORDER BY {order}"
+        return conn.execute(query, bounds).fetchall()
+
+    with closing(connect(path)) as conn:
+        reimbursements = grouped("reimbursements", [GROUPS[key][0] for key in by],
+                                 ["COUNT(*)", "SUM(amount)", "SUM(usd)"])
+        per_diem_keys = [key for key in by if GROUPS[key][1]]
+        per_diem = grouped("per_diem", [GROUPS[key][1] for key in per_diem_keys],
+                           ["COUNT(*)", "SUM(total_usd)"])
+    return {"reimbursements": reimbursements, "per_diem": per_diem, "per_diem_keys": per_diem_keys}
+
+
+def summary_tables(result, by):
+    """
+    The summary as two tables of rows (reimbursements, per diem), each with a
+    header. Receipt amounts are only shown when grouped by currency, since
+    INR and LKR amounts can't be added up.
+    """
+    def money(value):
+        return round(value, 2) if value is not None else ""
+
+    def key_cells(keys):
+        return [key if key is not None else "" for key in keys]
+
+    with_amount = "currency" in by
+    reimbursements = [[*[key.title() for key in by], "Receipts", *(["Amount"] if with_amount else []), "USD"]]
+    for row in result["reimbursements"]:
+        *keys, receipts, amount, usd = row
+        reimbursements.append([*key_cells(keys), receipts, *([money(amount)] if with_amount else []), money(usd)])
+
+    per_diem = [[*[key.title() for key in result["per_diem_keys"]], "Per diem days", "Per diem USD"]]
+    for row in result["per_diem"]:
+        *keys, days, usd = row
+        per_diem.append([*key_cells(keys), days, money(usd)])
+    return reimbursements, per_diem
+
+
+def _print_table(rows):
+    def text(cell):
+        return f"{cell:.2f}" if isinstance(cell, float) else str(cell)
+
+    widths = [max(len(text(row[i])) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(text(cell).ljust(width) if isinstance(cell, str) else text(cell).rjust(width)
+                        for cell, width in zip(row, widths)))
+
+
+def write_summary_sheet(spreadsheet_id, tab_name, rows):
+    """Writes the roll-up to tab_name (which must exist) with one batch write. Returns True if it was written."""
+    import backends
+    import google_services
+
+    backend = backends.current()
+    sheets_service = backend.google_service("sheets", "v4", backend.authenticate())
+    sheet_writer = google_services.SheetWriter(sheets_service, spreadsheet_id)
+    width = max(len(row) for row in rows)
+    sheet_writer.add(tab_name, 1, google_services.column_letters(width), rows)
+    sheet_writer.flush()
+    if sheet_writer.pending:
+        print(f"Could not write the summary to spreadsheet {spreadsheet_id}.")
+        return False
+    print(f"Wrote the summary to the '{tab_name}' tab of spreadsheet {spreadsheet_id}.")
+    return True
+
+
+def parse_bound(value, end=False):
+    """'YYYY-MM-DD', or 'YYYY-MM' meaning the first (or with end=True, last) day of that month."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        pass
+    try:
+        first = datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM or YYYY-MM-DD, got '{value}'")
+    if not end:
+        return first
+    next_month = date(first.year + first.month // 12, first.month % 12 + 1, 1)
+    return date.fromordinal(next_month.toordinal() - 1)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py summary",
+                                     description="Total the stored report rows over a period, without any API calls.")
+    parser.add_argument("--from", dest="start", required=True, metavar="YYYY-MM[-DD]", help="first month or day")
+    parser.add_argument("--to", dest="end", metavar="YYYY-MM[-DD]", help="last month or day (default: --from)")
+    parser.add_argument("--by", default="company,currency",
+                        help=f"comma-separated groupings: {', '.join(GROUPS)} (default: company,currency)")
+    parser.add_argument("--ledger", metavar="PATH", help="ledger file (default: LEDGER_PATH or expense_ledger.sqlite3)")
+    parser.add_argument("--sheet", metavar="SPREADSHEET_ID", help="also write the roll-up to this spreadsheet")
+    parser.add_argument("--tab", default="Summary", help="tab to write with --sheet (default: Summary)")
+    args = parser.parse_args(argv)
+
+    try:
+        start = parse_bound(args.start)
+        end = parse_bound(args.end or args.start, end=True)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    by = [key.strip() for key in args.by.split(",") if key.strip()]
+    unknown = [key for key in by if key not in GROUPS]
+    if unknown:
+        parser.error(f"unknown --by grouping(s): {', '.join(unknown)}")
+
+    started = time.perf_counter()
+    result = summary(start, end, by, path=args.ledger)
+    reimbursements, per_diem = summary_tables(result, by)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    print(f"Expenses from {start} to {end} (from {args.ledger or ledger_path()}, {elapsed_ms:.1f}ms):\n")
+    _print_table(reimbursements)
+    print()
+    _print_table(per_diem)
+    if args.sheet and not write_summary_sheet(args.sheet, args.tab, reimbursements + [[]] + per_diem):
+        return 1
+    return 0
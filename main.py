@@ -4,22 +4,42 @@
 import os
 from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
-from googleapiclient.discovery import build
 from collections import defaultdict
+import argparse
 import calendar
+import copy
+import hashlib
+import sys
+import threading
 import time
 
 # Import project modules
+import backends
 import config
 import google_services
+import instrumentation
+import ledger
+import replay
 import yahoo_service
 import utils
+from pipeline import Pipeline, PipelineError, Reuse, Stage
+from records import Currency
+from run_manifest import RunManifest
+from travel_timeline import TravelTimeline, load_travel_state, save_travel_state
+
+# First data rows of the two tabs in the March template
+PER_DIEM_START_ROW = 12
+REIMBURSEMENT_START_ROW = 13
+
+def default_report_month():
+    """Returns (month, year) of the previous month, the usual report period."""
+    last_month = date.today().replace(day=1) - relativedelta(days=1)
+    return last_month.month, last_month.year
+
 
 def get_report_month_year():
     """Prompts the user to select the month and year for the expense report."""
-    today = date.today()
-    default_month = (today.replace(day=1) - relativedelta(days=1)).month
-    default_year = (today.replace(day=1) - relativedelta(days=1)).year
+    default_month, default_year = default_report_month()
 
     print("\n--- Select Report Period ---")
     print(f"Default: {calendar.month_name[default_month]} {default_year} (previous month)")
@@ -70,74 +90,120 @@ def get_report_month_year():
     return report_month, report_year, start_day
 
 
-def main():
-    """Main function to run the expense automation."""
-    print("--- Starting Expense Report Automation ---")
+def parse_month(value):
+    """Parses 'YYYY-MM' into the first day of that month."""
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got '{value}'")
 
-    # 1. Determine the date range for the report (user prompted)
-    report_month, report_year, per_diem_start_day = get_report_month_year()
-    report_month_date = date(report_year, report_month, 1)
 
-    # Scrape Per Diem and Currency Rates
-    if config.DEBUG_MODE: print("\n--- Scraping Per Diem & Currency Rates ---")
-    # Scrape rates for India
-    per_diem_rates = utils.get_per_diem_rates_with_selenium(report_year, report_month, "India")
-    # Also scrape rates for Sri Lanka (for Colombo trips)
-    sri_lanka_rates = utils.get_per_diem_rates_with_selenium(report_year, report_month, "Sri Lanka")
-    if sri_lanka_rates:
-        # Mark Sri Lanka cities and merge into per_diem_rates
-        for city, rates in sri_lanka_rates.items():
-            rates["country"] = "Sri Lanka"
-            per_diem_rates[city] = rates
-    # Mark India cities
-    for city in per_diem_rates:
-        if "country" not in per_diem_rates[city]:
-            per_diem_rates[city]["country"] = "India"
+def parse_month_range(value):
+    """Parses 'YYYY-MM..YYYY-MM' (or a single 'YYYY-MM') into a list of month start dates."""
+    first, _, last = value.partition("..")
+    first_month = parse_month(first)
+    last_month = parse_month(last) if last else first_month
+    if last_month < first_month:
+        raise argparse.ArgumentTypeError(f"range '{value}' ends before it starts")
 
-    mie_breakdown = utils.get_mie_breakdown()
-    exchange_rates = utils.get_exchange_rates(report_month_date)
-    usd_to_inr_rate = exchange_rates.get("INR")
-    usd_to_lkr_rate = exchange_rates.get("LKR")
+    months = []
+    current = first_month
+    while current <= last_month:
+        months.append(current)
+        current += relativedelta(months=1)
+    return months
 
-    if not per_diem_rates or not mie_breakdown or not usd_to_inr_rate:
-        print("Could not retrieve per diem or currency rates. Exiting.")
-        return
 
-    if config.DEBUG_MODE:
-        print(f"Exchange rates: USD to INR = {usd_to_inr_rate}, USD to LKR = {usd_to_lkr_rate}")
+def build_arg_parser(description="Build the monthly expense report. Prompts for the period unless one is given."):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--year", type=int, help="report year (default: year of the previous month)")
+    parser.add_argument("--month", type=int, choices=range(1, 13), metavar="1-12",
+                        help="report month (default: the previous month)")
+    parser.add_argument("--start-day", type=int,
+                        help="per diem start day for partial months (default: 1; first month only with --months)")
+    parser.add_argument("--months", type=parse_month_range, metavar="YYYY-MM..YYYY-MM",
+                        help="build reports for every month in this range, sharing logins and caches")
+    parser.add_argument("--serial", action="store_true",
+                        help="run stages one at a time on the main thread (for debugging)")
+    parser.add_argument("--full", action="store_true",
+                        help="rebuild everything, ignoring what the last run of the month recorded "
+                             "(copies the template again and rewrites the whole sheet)")
+    parser.add_argument("--resume", action="store_true",
+                        help="carry on a run that failed: skip the steps and uploads it finished")
+    parser.add_argument("--metrics", default="run_metrics.json", metavar="PATH",
+                        help="where to write the JSON timing/counter summary (default: run_metrics.json)")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="also write a Chrome trace-event file (chrome://tracing, ui.perfetto.dev)")
+    replay.add_arguments(parser)
+    return parser
 
-    # 2. Authenticate with Google Services
-    creds = google_services.authenticate()
-    if not creds:
-        print("Failed to authenticate with Google. Exiting.")
-        return
-        
-    gmail_service = build("gmail", "v1", credentials=creds)
-    drive_service = build("drive", "v3", credentials=creds)
-    sheets_service = build("sheets", "v4", credentials=creds)
-    calendar_service = build("calendar", "v3", credentials=creds)
-
-    # 3. Search Gmail for travel confirmation emails
-    # Look back 2 months for early bookings
-    all_flights = []
-    hotel_reservations = []
-    travel_pdf_paths = []
 
-    search_start_date = report_month_date - relativedelta(months=2)
-    search_end_date = report_month_date + relativedelta(months=1)
+def parse_args(argv=None, parser=None):
+    parser = parser or build_arg_parser()
+    args = parser.parse_args(argv)
+
+    if args.months and (args.year or args.month):
+        parser.error("--months cannot be combined with --year/--month")
+    if args.full and args.resume:
+        parser.error("--full cannot be combined with --resume")
+    return args
+
+
+def report_periods(args):
+    """
+    Returns the list of (report_month_date, per_diem_start_day) to build.
+    Falls back to the interactive prompt when no period is given on the command line.
+    """
+    if args.months:
+        months = args.months
+    elif args.year or args.month or args.start_day:
+        default_month, default_year = default_report_month()
+        months = [date(args.year or default_year, args.month or default_month, 1)]
+    else:
+        report_month, report_year, start_day = get_report_month_year()
+        return [(date(report_year, report_month, 1), start_day)]
+
+    start_day = args.start_day or 1
+    _, max_day = calendar.monthrange(months[0].year, months[0].month)
+    if start_day < 1 or start_day > max_day:
+        raise SystemExit(f"Invalid start day {start_day} for {months[0].strftime('%B %Y')}.")
+
+    for report_month_date in months:
+        print(f"Generating report for: {report_month_date.strftime('%B %Y')}")
+    return [(months[0], start_day)] + [(m, 1) for m in months[1:]]
+
+
+def search_travel_emails(gmail, search_start_date, search_end_date):
+    """Lists the travel emails with attachments between the two dates."""
     gmail_search_after = search_start_date.strftime('%Y/%m/%d')
     gmail_search_before = search_end_date.strftime('%Y/%m/%d')
     
     query = f'from:"{config.TRAVEL_EMAIL_SENDER}" has:attachment after:{gmail_search_after} before:{gmail_search_before}'
     if config.DEBUG_MODE: print(f"\nSearching Gmail for travel emails from {gmail_search_after} to {gmail_search_before}...")
-    messages = google_services.search_gmail(gmail_service, query)
+    messages = google_services.search_gmail(gmail.get(), query)
     
     if config.DEBUG_MODE: print(f"\nFound {len(messages)} potential travel emails in Gmail.")
+    return messages
+
 
-    for msg in messages:
+def download_travel_documents(gmail, search_start_date, search_end_date, parse_pdf=None, messages=None):
+    """
+    Lists travel emails between the two dates (unless the listing is passed
+    in messages), downloads every PDF attachment and parses it once as a
+    flight itinerary and as a hotel reservation.
+    Emails are fetched concurrently, with clients from the gmail ServicePool.
+    parse_pdf(path) -> (flights, hotel) can be passed to reuse cached results.
+    Returns a list of {"pdf_path", "flights", "hotel"} dicts.
+    """
+    if messages is None:
+        messages = search_travel_emails(gmail, search_start_date, search_end_date)
+
+    def message_documents(msg):
+        gmail_service = gmail.get()
         msg_id = msg['id']
-        message_details = gmail_service.users().messages().get(userId='me', id=msg_id).execute()
+        message_details = google_services.execute(gmail_service.users().messages().get(userId='me', id=msg_id), "gmail", "messages.get")
 
+        documents = []
         parts_to_search = list(message_details['payload'].get('parts', []))
         while parts_to_search:
             part = parts_to_search.pop(0)
@@ -148,39 +214,343 @@ def main():
             if filename and filename.endswith('.pdf'):
                 pdf_path = google_services.get_gmail_attachment(gmail_service, msg_id, filename)
                 if pdf_path:
-                    # Try parsing as flight PDF
-                    flights_in_pdf = utils.parse_flight_pdf(pdf_path)
-                    has_relevant_flights = any(
-                        f['departure'].month == report_month and f['departure'].year == report_year
-                        for f in flights_in_pdf
-                    )
-
-                    # Try parsing as hotel reservation PDF
-                    hotel_info = utils.parse_hotel_reservation_pdf(pdf_path)
-                    has_relevant_hotel = False
-                    if hotel_info and hotel_info.get("checkin_date"):
-                        checkin = hotel_info["checkin_date"]
-                        has_relevant_hotel = checkin.month == report_month and checkin.year == report_year
-
-                    if has_relevant_flights:
-                        all_flights.extend(flights_in_pdf)
-                        if pdf_path not in travel_pdf_paths:
-                            travel_pdf_paths.append(pdf_path)
-                    elif has_relevant_hotel:
-                        hotel_reservations.append(hotel_info)
-                        if pdf_path not in travel_pdf_paths:
-                            travel_pdf_paths.append(pdf_path)
+                    if parse_pdf:
+                        flights, hotel = parse_pdf(pdf_path)
                     else:
-                        # Delete PDF that's not for the report month
+                        # Try parsing as flight PDF and as hotel reservation PDF
+                        flights = utils.parse_flight_pdf(pdf_path)
+                        hotel = utils.parse_hotel_reservation_pdf(pdf_path)
+                    documents.append({"pdf_path": pdf_path, "flights": flights, "hotel": hotel})
+        return documents
+
+    return [document for documents in google_services.run_concurrently(message_documents, messages)
+            for document in documents]
+
+
+def document_months(document):
+    """Returns the (year, month) pairs a travel document is relevant to."""
+    months = {(f.departure.year, f.departure.month) for f in document["flights"]}
+    hotel = document["hotel"]
+    if hotel and hotel.checkin_date:
+        months.add((hotel.checkin_date.year, hotel.checkin_date.month))
+    return months
+
+
+class ProcessResources:
+    """
+    Browsers and caches that hold no account data and are safe to share between
+    every report built in this process, including reports for different people:
+    scraped per diem rates, exchange rates, the Chrome render pool and parsed
+    travel PDFs (keyed by file content, so the same itinerary sent to several
+    people is parsed once).
+    """
+
+    def __init__(self, render_pool_size=1):
+        self._locks = defaultdict(threading.Lock)
+        self._scraper_driver = None
+        self._per_diem_rates = {}      # (year, month, country) -> scraped rates
+        self._exchange_rates = {}      # date -> {"INR": ..., "LKR": ...}
+        self._parsed_pdfs = {}         # sha256 of file -> (flights, hotel)
+        self.render_pool = utils.DriverPool(utils.create_pdf_driver, render_pool_size)
+
+    def per_diem_rates(self, year, month, country_name):
+        """Scraped rates for one country and month; callers get their own copy to modify."""
+        key = (year, month, country_name)
+        with self._locks["per_diem"]:
+            if key not in self._per_diem_rates:
+                page = backends.current().per_diem_page(year, month, country_name, self._scrape_per_diem_page)
+                self._per_diem_rates[key] = utils.rates_from_per_diem_page(page, country_name) if page else None
+            return copy.deepcopy(self._per_diem_rates[key])
+
+    def _scrape_per_diem_page(self, year, month, country_name):
+        """Fetches a results page with the shared scraper browser (called under the per_diem lock)."""
+        if self._scraper_driver is None:
+            self._scraper_driver = utils.create_scraper_driver()
+        return utils.fetch_per_diem_page(year, month, country_name, driver=self._scraper_driver)
+
+    def exchange_rates(self, report_month_date):
+        with self._locks["exchange_rates"]:
+            if report_month_date not in self._exchange_rates:
+                self._exchange_rates[report_month_date] = utils.get_exchange_rates(report_month_date)
+            return dict(self._exchange_rates[report_month_date])
+
+    def parse_travel_pdf(self, pdf_path):
+        """Returns (flights, hotel) for a travel PDF, parsing each distinct file only once."""
+        with open(pdf_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with self._locks["parsed_pdfs"]:
+            cached = self._parsed_pdfs.get(digest)
+        if cached is None:
+            # Try parsing as flight PDF and as hotel reservation PDF
+            cached = (utils.parse_flight_pdf(pdf_path), utils.parse_hotel_reservation_pdf(pdf_path))
+            with self._locks["parsed_pdfs"]:
+                self._parsed_pdfs[digest] = cached
+        return copy.deepcopy(cached)
+
+    def close(self):
+        if self._scraper_driver:
+            self._scraper_driver.quit()
+            self._scraper_driver = None
+        self.render_pool.close()
+
+
+class SharedResources:
+    """
+    Logins, connections and caches shared by every report month of one run for
+    one account: Google credentials, the Yahoo IMAP session and the travel PDFs
+    from a single Gmail listing covering all months. Browsers, rates and parsed
+    PDFs come from a ProcessResources, which may be shared with other accounts.
+
+    Stages of one month run concurrently, so each resource is created under its
+    own lock; a slow scrape doesn't hold up the exchange rates or Gmail.
+    """
+
+    def __init__(self, report_month_dates, process_resources=None):
+        self.report_month_dates = sorted(report_month_dates)
+        self._owns_process_resources = process_resources is None
+        self.process = process_resources or ProcessResources()
+        self._locks = defaultdict(threading.Lock)
+        self._creds = None
+        self._yahoo_mail = None
+        self._travel_messages = None
+        self._travel_documents = None
+        self._travel_timeline = None
+        self._downloads = set()   # travel PDFs of reports whose Gmail stage was resumed
+
+    def creds(self):
+        with self._locks["creds"]:
+            if self._creds is None:
+                self._creds = backends.current().authenticate()
+            return self._creds
+
+    def per_diem_rates(self, year, month, country_name):
+        return self.process.per_diem_rates(year, month, country_name)
+
+    def exchange_rates(self, report_month_date):
+        return self.process.exchange_rates(report_month_date)
+
+    def render_driver(self):
+        """Context manager lending a Chrome driver for rendering receipts to PDF."""
+        return self.process.render_pool.driver()
+
+    def yahoo_mail(self):
+        with self._locks["yahoo"]:
+            self._yahoo_mail = yahoo_service.ensure_connection(
+                self._yahoo_mail, config.YAHOO_EMAIL, config.YAHOO_APP_PASSWORD
+            )
+            return self._yahoo_mail
+
+    def travel_messages(self, gmail):
+        """
+        The travel emails for the whole run. Gmail is listed once, looking back
+        2 months before the first report month (early bookings) and up to the
+        end of the last one.
+        """
+        with self._locks["travel_messages"]:
+            if self._travel_messages is None:
+                search_start_date = self.report_month_dates[0] - relativedelta(months=2)
+                search_end_date = self.report_month_dates[-1] + relativedelta(months=1)
+                self._travel_messages = search_travel_emails(gmail, search_start_date, search_end_date)
+            return self._travel_messages
+
+    def travel_documents(self, gmail):
+        """
+        Parsed travel PDFs for the whole run, from the emails travel_messages
+        lists; PDFs not relevant to any report month are deleted.
+        """
+        with self._locks["travel_documents"]:
+            if self._travel_documents is None:
+                wanted = {(d.year, d.month) for d in self.report_month_dates}
+
+                documents = download_travel_documents(
+                    gmail, None, None, parse_pdf=self.process.parse_travel_pdf, messages=self.travel_messages(gmail)
+                )
+                self._travel_documents = [d for d in documents if document_months(d) & wanted]
+                # The timeline uses every document in the window, so trips crossing a month boundary carry
+                # over, and starts from the state saved at the end of the month before the run
+                self._travel_timeline = TravelTimeline(
+                    [f for d in documents for f in d["flights"]],
+                    [d["hotel"] for d in documents if d["hotel"]],
+                    carry_in=load_travel_state(self.report_month_dates[0] - relativedelta(months=1)),
+                )
+
+                # Delete PDFs that aren't for any report month
+                kept_paths = {d["pdf_path"] for d in self._travel_documents}
+                for document in documents:
+                    pdf_path = document["pdf_path"]
+                    if pdf_path not in kept_paths and os.path.exists(pdf_path):
                         os.remove(pdf_path)
                         if config.DEBUG_MODE:
-                            print(f"  -> Skipped PDF (not for {calendar.month_name[report_month]} {report_year}): {pdf_path}")
+                            print(f"  -> Skipped PDF (not for a report month): {pdf_path}")
+            return self._travel_documents
+
+    def add_downloads(self, paths):
+        """Travel PDFs to remove on close besides those downloaded in this run (e.g. by a resumed run)."""
+        self._downloads.update(paths)
+
+    def travel_timeline(self, gmail):
+        """Where each night of the search window was spent (see travel_timeline.py)."""
+        self.travel_documents(gmail)
+        return self._travel_timeline
+
+    def close(self, keep_downloads=False):
+        """
+        Closes the IMAP session (and browsers, if owned) and removes downloaded
+        travel PDFs, unless keep_downloads is set (a failed run keeps them for --resume).
+        """
+        if self._owns_process_resources:
+            self.process.close()
+        if self._yahoo_mail:
+            yahoo_service.close_connection(self._yahoo_mail)
+            self._yahoo_mail = None
+        if keep_downloads:
+            return
+        for pdf_path in self._downloads | {document["pdf_path"] for document in self._travel_documents or []}:
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
+
+
+def authenticate_google(resources):
+    """Stage: authenticate with Google Services (once per run)."""
+    creds = resources.creds()
+    if not creds:
+        raise PipelineError("Failed to authenticate with Google. Exiting.")
+    return {"creds": creds}
+
+
+def prepare_report_folder(creds, report_month_date):
+    """
+    Stage: finds or creates the month's Drive folder. A stage of its own so
+    that receipt uploads only wait for the folder, not for the template copy.
+    """
+    if not config.SAVE_TO_DRIVE:
+        return {"folder_id": None}
+
+    drive_service = backends.current().google_service("drive", "v3", creds)
+    drive_folder_name = report_month_date.strftime("%m-%Y")
+    return {"folder_id": google_services.create_drive_folder(drive_service, drive_folder_name)}
+
+
+def prepare_report_sheet(creds, folder_id, report_month_date):
+    """
+    Stage: copies the template into the month's Drive folder. Nothing but the
+    sheet write needs the copy, so the slow server-side copy overlaps data
+    collection. Builds its own Drive client since stages run on worker
+    threads and googleapiclient service objects are not thread-safe.
+    """
+    if not (config.SAVE_TO_DRIVE and folder_id):
+        return {"spreadsheet_id": None}
+
+    drive_service = backends.current().google_service("drive", "v3", creds)
+    sheet_name = config.DRIVE_SHEET_NAME.format(month_name=report_month_date.strftime('%B'), year=report_month_date.year)
+    # 👉 Copy the March template (keeps tabs/formatting/header row positions)
+    spreadsheet_id = google_services.copy_and_convert_to_sheet(
+        drive_service,
+        config.TEMPLATE_SPREADSHEET_ID,
+        sheet_name,
+        folder_id
+    )
+    return {"spreadsheet_id": spreadsheet_id}
+
+
+def scrape_per_diem_rates(report_year, report_month, resources):
+    """Stage: scrape State Dept per diem rates for India and Sri Lanka."""
+    if config.DEBUG_MODE: print("\n--- Scraping Per Diem Rates ---")
+    # Scrape rates for India
+    per_diem_rates = resources.per_diem_rates(report_year, report_month, "India")
+    # Also scrape rates for Sri Lanka (for Colombo trips)
+    sri_lanka_rates = resources.per_diem_rates(report_year, report_month, "Sri Lanka")
+    if not per_diem_rates:
+        raise PipelineError("Could not retrieve per diem rates. Exiting.")
+    if sri_lanka_rates:
+        # Mark Sri Lanka cities and merge into per_diem_rates
+        for city, rates in sri_lanka_rates.items():
+            rates["country"] = "Sri Lanka"
+            per_diem_rates[city] = rates
+    # Mark India cities
+    for city in per_diem_rates:
+        if "country" not in per_diem_rates[city]:
+            per_diem_rates[city]["country"] = "India"
+
+    mie_breakdown = utils.get_mie_breakdown()
+    if not mie_breakdown:
+        raise PipelineError("Could not retrieve M&IE breakdown. Exiting.")
+    return {"per_diem_rates": per_diem_rates, "mie_breakdown": mie_breakdown}
+
+
+def fetch_exchange_rates(report_month_date, resources):
+    """Stage: USD to INR and USD to LKR conversion rates."""
+    exchange_rates = resources.exchange_rates(report_month_date)
+    usd_to_inr_rate = exchange_rates.get("INR")
+    usd_to_lkr_rate = exchange_rates.get("LKR")
+    if not usd_to_inr_rate:
+        raise PipelineError("Could not retrieve currency rates. Exiting.")
+
+    if config.DEBUG_MODE:
+        print(f"Exchange rates: USD to INR = {usd_to_inr_rate}, USD to LKR = {usd_to_lkr_rate}")
+    return {"usd_to_inr_rate": usd_to_inr_rate, "usd_to_lkr_rate": usd_to_lkr_rate}
+
+
+def collect_travel_documents(creds, report_month_date, resources):
+    """Stage: pick the flights and hotel reservations for the report month from the travel PDFs."""
+    gmail = google_services.ServicePool(lambda: backends.current().google_service("gmail", "v1", creds))
+    report_month, report_year = report_month_date.month, report_month_date.year
+
+    all_flights = []
+    hotel_reservations = []
+    travel_pdf_paths = []
+
+    for document in resources.travel_documents(gmail):
+        pdf_path = document["pdf_path"]
+        flights_in_pdf = document["flights"]
+        has_relevant_flights = any(
+            f.departure.month == report_month and f.departure.year == report_year
+            for f in flights_in_pdf
+        )
+
+        hotel_info = document["hotel"]
+        has_relevant_hotel = False
+        if hotel_info and hotel_info.checkin_date:
+            checkin = hotel_info.checkin_date
+            has_relevant_hotel = checkin.month == report_month and checkin.year == report_year
+
+        if has_relevant_flights:
+            all_flights.extend(flights_in_pdf)
+            if pdf_path not in travel_pdf_paths:
+                travel_pdf_paths.append(pdf_path)
+        elif has_relevant_hotel:
+            hotel_reservations.append(hotel_info)
+            if pdf_path not in travel_pdf_paths:
+                travel_pdf_paths.append(pdf_path)
 
     # Filter for flights within the report month and sort them
-    relevant_flights = sorted([f for f in all_flights if f['departure'].month == report_month and f['departure'].year == report_year], key=lambda x: x['departure'])
+    relevant_flights = sorted([f for f in all_flights if f.departure.month == report_month and f.departure.year == report_year], key=lambda x: x.departure)
+    return {
+        "relevant_flights": relevant_flights,
+        "hotel_reservations": hotel_reservations,
+        "travel_pdf_paths": travel_pdf_paths,
+        "travel_timeline": resources.travel_timeline(gmail),
+    }
+
+
+def travel_emails_seen(creds, report_month_date, resources):
+    """
+    Reuse probe for collect_travel_documents: the travel emails in the run's
+    Gmail listing and the travel state carried into the run.
+    """
+    gmail = google_services.ServicePool(lambda: backends.current().google_service("gmail", "v1", creds))
+    return {
+        "messages": sorted(message["id"] for message in resources.travel_messages(gmail)),
+        "report_months": resources.report_month_dates,
+        "carry_in": load_travel_state(resources.report_month_dates[0] - relativedelta(months=1)),
+    }
 
-    # 3b. Search Google Calendar for Bangalore company meetings
+
+def find_bangalore_meetings(creds, report_month_date):
+    """Stage: search Google Calendar for Bangalore company meetings."""
     if config.DEBUG_MODE: print("\n--- Searching Calendar for Bangalore Company Meetings ---")
+    calendar_service = backends.current().google_service("calendar", "v3", creds)
+    report_month, report_year = report_month_date.month, report_month_date.year
     _, num_days_in_month = calendar.monthrange(report_year, report_month)
     month_start = date(report_year, report_month, 1)
     month_end = date(report_year, report_month, num_days_in_month)
@@ -190,130 +560,206 @@ def main():
         calendar_service,
         config.BANGALORE_COMPANIES,
         month_start,
-        month_end
+        month_end,
+        server_filter=getattr(config, "CALENDAR_SERVER_FILTER", False),
+        incremental=getattr(config, "CALENDAR_INCREMENTAL_SYNC", False)
     )
     if config.DEBUG_MODE: print(f"Found {len(bangalore_meetings)} Bangalore company meeting dates.")
+    return {"bangalore_meetings": bangalore_meetings}
+
 
+def build_travel_calendar(relevant_flights, bangalore_meetings, report_month_date, per_diem_start_day,
+                          travel_timeline=None):
+    """
+    Stage: work out the nightly location for each day of the report month.
+    travel_timeline covers the whole Gmail search window; without one, the
+    month's own flights are used.
+    """
     # Continue even if no flights or meetings - still generate per diem report
     if not relevant_flights and not bangalore_meetings:
         print("No travel bookings or Bangalore meetings found - generating per diem only report.")
 
-    # 4. Create Travel Calendar to determine nightly location
     if config.DEBUG_MODE: print("\n--- Building Travel Calendar ---")
-    travel_calendar = {}
-    current_location = "Bangalore"
-
-    flights_by_date = defaultdict(list)
-
-    for f in relevant_flights:
-        if 'date' in f and isinstance(f['date'], date):  # ensure key exists and is a date object
-            flights_by_date[f['date']].append(f)
-
-    unique_travel_dates = []
-    for day_num in range(per_diem_start_day, num_days_in_month + 1):
-        current_date = date(report_year, report_month, day_num)
-        unique_travel_dates.append(current_date)
-        travel_calendar[current_date] = current_location
-        if current_date in flights_by_date:
-            flight = flights_by_date[current_date][-1]  # Get the last flight of the day
-            if "bangalore" in flight['to'].lower():
-                travel_calendar[current_date] = flight['from']
-                current_location = "Bangalore"
-            else:
-                travel_calendar[current_date] = flight['to']
-                current_location = flight['to']
+    report_month, report_year = report_month_date.month, report_month_date.year
+    _, num_days_in_month = calendar.monthrange(report_year, report_month)
+    if travel_timeline is None:
+        travel_timeline = TravelTimeline(relevant_flights)
+
+    travel_calendar = travel_timeline.calendar(date(report_year, report_month, per_diem_start_day),
+                                               date(report_year, report_month, num_days_in_month))
+    unique_travel_dates = list(travel_calendar)
+
+    return {"travel_calendar": travel_calendar, "unique_travel_dates": unique_travel_dates}
+
+
+def store_travel_state(travel_timeline, report_month_date):
+    """Stage: save where the month ended, so next month's run starts from there."""
+    last_day = report_month_date.replace(day=calendar.monthrange(report_month_date.year, report_month_date.month)[1])
+    save_travel_state(report_month_date, travel_timeline, last_day)
+    return None
 
-    # 5. Search Yahoo Mail for Uber receipts
+
+def stream_uber_receipts(yahoo_mail, search_dates, usd_to_inr_rate, pdf_driver=None, skip_render=None):
+    """Yields the Uber receipts for each date in turn, as yahoo_service parses them."""
+    for search_date in search_dates:
+        for receipt in yahoo_service.iter_uber_receipts(yahoo_mail, search_date, usd_to_inr_rate,
+                                                        pdf_driver=pdf_driver, skip_render=skip_render):
+            receipt.date = search_date
+            yield receipt
+
+
+def uber_search_dates(unique_travel_dates, bangalore_meetings):
+    """Travel dates and Bangalore company meeting dates, in order."""
+    return sorted(set(unique_travel_dates) | set(bangalore_meetings.keys()))
+
+
+def uber_receipts_seen(unique_travel_dates, bangalore_meetings, resources, **_):
+    """Reuse probe for collect_uber_receipts: the UIDs of the receipt emails found on each search date."""
+    yahoo_mail = resources.yahoo_mail()
+    if not yahoo_mail:
+        return None
+    return {search_date: yahoo_service.search_uber_receipt_ids(yahoo_mail, search_date)
+            for search_date in uber_search_dates(unique_travel_dates, bangalore_meetings)}
+
+
+def collect_uber_receipts(creds, folder_id, unique_travel_dates, bangalore_meetings, usd_to_inr_rate, resources,
+                          manifest):
+    """
+    Stage: search Yahoo Mail for Uber receipts on travel and meeting dates.
+    Receipts are streamed: each saved receipt PDF is uploaded to the month's
+    Drive folder (and deleted) while the next emails are still being fetched,
+    rather than after the whole search. Receipts the manifest lists as
+    uploaded to the folder are neither rendered nor uploaded again, so a
+    resumed run carries on after the last upload that finished.
+    """
     # Include both travel dates and Bangalore company meeting dates
-    uber_search_dates = set(unique_travel_dates)
-    for meeting_date in bangalore_meetings.keys():
-        uber_search_dates.add(meeting_date)
-    uber_search_dates = sorted(uber_search_dates)
+    search_dates = uber_search_dates(unique_travel_dates, bangalore_meetings)
 
     if config.DEBUG_MODE:
-        print(f"\n--- Searching Uber Receipts for {len(uber_search_dates)} dates ---")
+        print(f"\n--- Searching Uber Receipts for {len(search_dates)} dates ---")
         if bangalore_meetings:
             print(f"  (includes {len(bangalore_meetings)} Bangalore company meeting dates)")
 
     uber_data = []
-    uber_receipt_paths = []
-    yahoo_mail = yahoo_service.connect_to_yahoo(config.YAHOO_EMAIL, config.YAHOO_APP_PASSWORD)
+    uploaded_receipts = []
+    # The IMAP session stays open for later months; resources.close() ends it
+    yahoo_mail = resources.yahoo_mail()
     if yahoo_mail:
-        for search_date in uber_search_dates:
-            receipts = yahoo_service.search_uber_receipts(yahoo_mail, search_date, usd_to_inr_rate)
-            if receipts:
-                for receipt_details in receipts:
-                    receipt_details['date'] = search_date
-                    uber_data.append(receipt_details)
-                    if receipt_details.get("filepath"):
-                        uber_receipt_paths.append(receipt_details["filepath"])
-        yahoo_service.close_connection(yahoo_mail)
-
-    # 6. Create Google Drive folder and upload files
-    if config.SAVE_TO_DRIVE:
-        base_folder_name = "https://drive.google.com/drive/folders/1dGFeh28Bzb0jPnJ9VmMoRR3xR-Avkp9Y?usp=sharing"
-        drive_folder_name = report_month_date.strftime("%m-%Y")
-        folder_id = google_services.create_drive_folder(drive_service, drive_folder_name)    
-        if folder_id:
-            for path in travel_pdf_paths + uber_receipt_paths:
-                google_services.upload_file_to_drive(drive_service, path, folder_id)
-                os.remove(path)
-                time.sleep(1) 
-
-    # 7. Create and populate Google Sheet (MATCH MARCH TEMPLATE)
-    sheet_name = config.DRIVE_SHEET_NAME.format(month_name=report_month_date.strftime('%B'), year=report_year)
+        with resources.render_driver() as pdf_driver:
+            if config.SAVE_TO_DRIVE and folder_id:
+                drive = google_services.ServicePool(lambda: backends.current().google_service("drive", "v3", creds))
+                receipts = stream_uber_receipts(yahoo_mail, search_dates, usd_to_inr_rate, pdf_driver=pdf_driver,
+                                                skip_render=lambda path: manifest.uploaded(folder_id, path))
 
-    # 👉 Copy the March template (keeps tabs/formatting/header row positions)
-    spreadsheet_id = google_services.copy_and_convert_to_sheet(
-        drive_service,
-        config.TEMPLATE_SPREADSHEET_ID,
-        sheet_name,
-        folder_id
-    )
+                def receipt_files():
+                    for receipt in receipts:
+                        uber_data.append(receipt)
+                        if receipt.filepath and not manifest.uploaded(folder_id, receipt.filepath):
+                            yield receipt.filepath
 
-    # Prepare Per Diem data
-    per_diem_rows = []
-    start_row_pd = 12       # matches March template
-    row_counter = start_row_pd
-    running_total_formula = f"=H{row_counter}"   # Running Total (col J) starts off equal to Total M&IE (col H)
+                def upload(path):
+                    file_id = google_services.upload_file_to_drive(drive.get(), path, folder_id)
+                    if not file_id:
+                        raise PipelineError(f"Uploading {path} failed; run again with --resume to carry on.")
+                    manifest.record_upload(folder_id, path, file_id)
+                    os.remove(path)
+                    time.sleep(getattr(config, "DRIVE_UPLOAD_PAUSE", 1))
+                    return path
 
-    for day_num in range(per_diem_start_day, num_days_in_month + 1):
-        current_date = date(report_year, report_month, day_num)
-        location = travel_calendar.get(current_date, "Bangalore")
+                uploaded_receipts = google_services.run_concurrently(upload, receipt_files())
+            else:
+                uber_data.extend(stream_uber_receipts(yahoo_mail, search_dates, usd_to_inr_rate, pdf_driver=pdf_driver))
 
-        bfast, lunch, dinner, incidentals, total_mie_rate, lodging = [""] * 6
-        country = "India"  # Default country
+    return {"uber_data": uber_data, "uploaded_receipts": uploaded_receipts}
 
-        if "Bangalore" in location:
-            rates = config.PER_DIEM_RATES_USD["Bangalore"]
-            bfast, lunch, dinner, incidentals = rates["breakfast"], rates["lunch"], rates["dinner"], rates["incidentals"]
-            total_mie_rate = rates.get("total_mie", "")
-        else:
-            city_rates = per_diem_rates.get(location, per_diem_rates.get("Other"))
-            if city_rates:
-                lodging = city_rates["lodging"]
-                total_mie_rate = city_rates["total_mie"]
-                country = city_rates.get("country", "India")
-                breakdown = mie_breakdown.get(total_mie_rate, {})
-                bfast = config.PER_DIEM_RATES_USD["Bangalore"]["breakfast"]
-                lunch = breakdown.get("lunch", "")
-                dinner = breakdown.get("dinner", "")
-                incidentals = breakdown.get("incidentals", "")
-
-        total_formula = f"=SUM(D{row_counter}:G{row_counter})"   # H = D+E+F+G
-
-        per_diem_rows.append([
-            current_date.strftime('%Y-%m-%d'),   # A: Date(s) Claimed:
-            f"{location}, {country}",            # B
-            total_mie_rate,                      # C: State Dept M&IE (Per Diem Rate)*
-            bfast, lunch, dinner, incidentals,   # D-G
-            total_formula,                       # H: Total M&IE for Date
+
+def upload_documents(creds, folder_id, travel_pdf_paths, manifest):
+    """
+    Stage: upload flight/hotel PDFs to the month's Drive folder (Uber receipts
+    are uploaded as they're found, see collect_uber_receipts). Files are
+    uploaded concurrently (config.GOOGLE_API_WORKERS at a time); files the
+    manifest lists as uploaded to the folder are skipped.
+    Travel PDFs can belong to more than one report month, so they are kept
+    until the end of the run (see SharedResources.close).
+    """
+    uploaded_files = []
+    if config.SAVE_TO_DRIVE and folder_id:
+        drive = google_services.ServicePool(lambda: backends.current().google_service("drive", "v3", creds))
+        paths = []
+        for path in travel_pdf_paths:
+            if manifest.uploaded(folder_id, path):
+                continue
+            if not os.path.exists(path):
+                print(f"Not uploading {path}: it is no longer downloaded (run again with --full)")
+                continue
+            paths.append(path)
+
+        def upload(path):
+            file_id = google_services.upload_file_to_drive(drive.get(), path, folder_id)
+            if not file_id:
+                raise PipelineError(f"Uploading {path} failed; run again with --resume to carry on.")
+            manifest.record_upload(folder_id, path, file_id)
+            time.sleep(getattr(config, "DRIVE_UPLOAD_PAUSE", 1))
+            return path
+
+        uploaded_files = google_services.run_concurrently(upload, paths)
+    return {"uploaded_files": uploaded_files}
+
+
+def _per_diem_rate_cells(location, post_index, mie_breakdown):
+    """
+    The rate columns for a night in location: ("<location>, <country>", State
+    Dept M&IE, breakfast, lunch, dinner, incidentals), blank where unknown.
+    """
+    bfast, lunch, dinner, incidentals, total_mie_rate = [""] * 5
+    country = "India"  # Default country
+
+    if "Bangalore" in location:
+        rates = config.PER_DIEM_RATES_USD["Bangalore"]
+        bfast, lunch, dinner, incidentals = rates["breakfast"], rates["lunch"], rates["dinner"], rates["incidentals"]
+        total_mie_rate = rates.get("total_mie", "")
+    else:
+        city_rates = post_index.rates_for(location)
+        if city_rates:
+            total_mie_rate = city_rates["total_mie"]
+            country = city_rates.get("country", "India")
+            breakdown = mie_breakdown.get(total_mie_rate, {})
+            bfast = config.PER_DIEM_RATES_USD["Bangalore"]["breakfast"]
+            lunch = breakdown.get("lunch", "")
+            dinner = breakdown.get("dinner", "")
+            incidentals = breakdown.get("incidentals", "")
+
+    return (f"{location}, {country}", total_mie_rate, bfast, lunch, dinner, incidentals)
+
+
+def build_per_diem_rows(per_diem_rates, mie_breakdown, travel_calendar, report_month_date, per_diem_start_day):
+    """
+    Stage: rows for the 'Per Diem & Lodging' tab, including the total row.
+    A month only visits a few places, so the rate columns are worked out once
+    per location and the rows are built from that table in one pass.
+    """
+    report_month, report_year = report_month_date.month, report_month_date.year
+    _, num_days_in_month = calendar.monthrange(report_year, report_month)
+    days = [date(report_year, report_month, day_num) for day_num in range(per_diem_start_day, num_days_in_month + 1)]
+    locations = [travel_calendar.get(day, "Bangalore") for day in days]
+    post_index = utils.PerDiemPostIndex(per_diem_rates)
+    rate_table = {location: _per_diem_rate_cells(location, post_index, mie_breakdown)
+                  for location in set(locations)}
+
+    start_row_pd = PER_DIEM_START_ROW
+    end_row_pd = start_row_pd + len(days) - 1
+    per_diem_rows = [
+        [
+            day.isoformat(),                     # A: Date(s) Claimed:
+            *rate_table[location],               # B, C: State Dept M&IE (Per Diem Rate)*, D-G
+            f"=SUM(D{row}:G{row})",              # H: Total M&IE for Date (D+E+F+G)
             "",                                  # I: Lodging Cost For Night (left blank if N/A)
-            running_total_formula,               # J: Running Total
+            # J: Running Total, starting off equal to Total M&IE (col H)
+            f"=H{row}" if row == start_row_pd else f"=J{row - 1}+H{row}",
             ""                                   # K: Comments
-        ])
-        row_counter += 1
-        running_total_formula = f"=J{row_counter-1}+H{row_counter}"
+        ]
+        for row, day, location in zip(range(start_row_pd, end_row_pd + 1), days, locations)
+    ]
 
     # Add the total row - label in column G, formulas in H and J
     per_diem_rows.append([
@@ -324,27 +770,35 @@ def main():
         "",                                       # E
         "",                                       # F
         "TOTAL PER DIEM",                         # G: Label
-        f"=SUM(H{start_row_pd}:H{row_counter-1})", # H: Sum of all daily totals
+        f"=SUM(H{start_row_pd}:H{end_row_pd})",   # H: Sum of all daily totals
         "",                                       # I
-        f"=J{row_counter-1}",                     # J: Final running total
+        f"=J{end_row_pd}",                        # J: Final running total
         ""                                        # K
     ])
 
-    if config.SAVE_TO_DRIVE and per_diem_rows:
-        # Clear old data BELOW the first data row to avoid trailing junk (keep header row 11 and first data row 12 safe)
-        google_services.clear_values(sheets_service, spreadsheet_id, "Per Diem & Lodging!A12:K9999")
-        # Write from the first data row (A12)
-        google_services.update_values(sheets_service, spreadsheet_id, f"Per Diem & Lodging!A{start_row_pd}", per_diem_rows)
+    return {"per_diem_rows": per_diem_rows}
+
 
-    # Prepare Reimbursements data
+def build_reimbursement_rows(uber_data, travel_calendar, bangalore_meetings, hotel_reservations,
+                             usd_to_inr_rate, usd_to_lkr_rate):
+    """
+    Stage: rows for the 'Reimbursements' tab, including the total row.
+    Receipts arrive grouped by search date, so they are bucketed by date and
+    the buckets walked in order instead of sorting every receipt.
+    """
     reimbursement_rows = []
-    start_row_rb = 13   # matches March template
+    start_row_rb = REIMBURSEMENT_START_ROW
     row_counter = start_row_rb
+    location_classifier = utils.LocationClassifier(hotel_reservations)
+
+    receipts_by_date = defaultdict(list)
+    for item in uber_data:
+        receipts_by_date[item.date].append(item)
 
-    for item in sorted(uber_data, key=lambda x: x['date']):
+    for item in (item for day in sorted(receipts_by_date) for item in receipts_by_date[day]):
         # Get the travel city for this date to help with location classification
-        travel_city = travel_calendar.get(item['date'], "Bangalore")
-        expense_date = item['date']
+        travel_city = travel_calendar.get(item.date, "Bangalore")
+        expense_date = item.date
 
         # Determine the company being coached for this expense
         # For Bangalore: must have a calendar appointment with a coaching company
@@ -367,26 +821,27 @@ def main():
 
         # Generate descriptive ride description (e.g., "Home to Airport", "Taj Samudra to Airport")
         description = utils.generate_uber_description(
-            item.get('from', ''),
-            item.get('to', ''),
+            item.pickup,
+            item.dropoff,
             travel_city,
-            hotel_reservations
+            hotel_reservations,
+            classifier=location_classifier
         )
         # Use the correct currency and exchange rate based on what was detected in the receipt
-        currency = item.get('currency', 'INR')
-        if currency == 'LKR' and usd_to_lkr_rate:
+        currency = item.currency
+        if currency == Currency.LKR and usd_to_lkr_rate:
             exchange_rate = usd_to_lkr_rate
         else:
             exchange_rate = usd_to_inr_rate
-            currency = 'INR'  # Default to INR if LKR rate not available
+            currency = Currency.INR  # Default to INR if LKR rate not available
 
         reimbursement_rows.append([
-            item['date'].strftime('%Y-%m-%d'),   # A: Expenditure Date (When):
-            item['filepath'] or "",              # B: Receipt # *
-            item['fare-city'] or "N/A",          # C: Location (Where)
-            currency,                            # D: Currency (INR or LKR)
+            item.date.strftime('%Y-%m-%d'),      # A: Expenditure Date (When):
+            os.path.basename(item.filepath) if item.filepath else "",   # B: Receipt # * (file name, not the local path)
+            item.fare_city or "N/A",             # C: Location (Where)
+            currency.value,                      # D: Currency (INR or LKR)
             description,                         # E: Description
-            item.get('fare', 'N/A'),             # F: Receipt Amt in Receipt Currency
+            str(item.fare) if item.fare is not None else "N/A",   # F: Receipt Amt in Receipt Currency
             exchange_rate,                       # G: Rate of Exchange (USD to currency)
             f"=F{row_counter}/G{row_counter}",   # H: US Dollar Equivalent
             company_name                         # I: Company being coached
@@ -406,15 +861,170 @@ def main():
         ""                                         # I
     ])
 
-    if config.SAVE_TO_DRIVE and reimbursement_rows:
-        # Clear existing data below first data row (keep header at row 12, first data row 13 will be overwritten)
-        google_services.clear_values(sheets_service, spreadsheet_id, "Reimbursements!A13:I9999")
-        # Write starting at first data row (A13)
-        google_services.update_values(sheets_service, spreadsheet_id, f"Reimbursements!A{start_row_rb}", reimbursement_rows)
+    return {"reimbursement_rows": reimbursement_rows}
+
+
+def write_report_sheet(creds, spreadsheet_id, per_diem_rows, reimbursement_rows, manifest):
+    """
+    Stage: write both tabs of the copied template with a single batch request.
+    If the manifest has the rows last written to this spreadsheet, only the
+    rows that changed are written.
+    """
+    if not (config.SAVE_TO_DRIVE and spreadsheet_id):
+        return None
+
+    sheets_service = backends.current().google_service("sheets", "v4", creds)
+    sheet_writer = google_services.SheetWriter(sheets_service, spreadsheet_id)
+    tabs = []
+    if per_diem_rows:
+        # Write from the first data row (A12); rows left below it by the template are blanked
+        tabs.append(("Per Diem & Lodging", PER_DIEM_START_ROW, "K", per_diem_rows))
+    if reimbursement_rows:
+        # Write starting at first data row (A13); header at row 12 is left untouched
+        tabs.append(("Reimbursements", REIMBURSEMENT_START_ROW, "I", reimbursement_rows))
+    for tab_name, start_row, last_col, rows in tabs:
+        sheet_writer.add(tab_name, start_row, last_col, rows,
+                         previous=manifest.sheet_rows(spreadsheet_id, tab_name))
+
+    api_calls = sheet_writer.flush()
+    if sheet_writer.pending:
+        raise PipelineError("Could not write the report to the sheet. Exiting.")
+    for tab_name, _, _, rows in tabs:
+        manifest.record_sheet_rows(spreadsheet_id, tab_name, rows)
+    if config.DEBUG_MODE: print(f"Sheets API calls for report data: {api_calls}")
+    return None
+
+
+def store_in_ledger(report_month_date, per_diem_rows, reimbursement_rows):
+    """Stage: keep the month's rows in the local ledger for `main.py summary` roll-ups."""
+    ledger.save_month(report_month_date, per_diem_rows, reimbursement_rows)
+    return None
+
+
+# The report as a graph of stages. Each stage lists the values it needs and
+# produces; stages whose inputs are ready run at the same time, so scraping,
+# FX rates, Gmail, Calendar and the template copy all overlap. Stages with a
+# Reuse take their outputs from the month's run manifest when nothing they
+# depend on has changed since the last run (see run_manifest.py).
+REPORT_STAGES = [
+    Stage("authenticate", authenticate_google, inputs=["resources"], outputs=["creds"], checkpoint=False),
+    Stage("report_folder", prepare_report_folder,
+          inputs=["creds", "report_month_date"],
+          outputs=["folder_id"],
+          reuse=Reuse(config=["SAVE_TO_DRIVE", "DRIVE_PARENT_FOLDER_ID"], keep=lambda outputs: all(outputs.values()))),
+    Stage("report_sheet", prepare_report_sheet,
+          inputs=["creds", "folder_id", "report_month_date"],
+          outputs=["spreadsheet_id"],
+          reuse=Reuse(config=["SAVE_TO_DRIVE", "TEMPLATE_SPREADSHEET_ID", "DRIVE_SHEET_NAME"],
+                      keep=lambda outputs: all(outputs.values()))),
+    Stage("per_diem_rates", scrape_per_diem_rates,
+          inputs=["report_year", "report_month", "resources"],
+          outputs=["per_diem_rates", "mie_breakdown"],
+          # Not reused if the Sri Lanka scrape failed
+          reuse=Reuse(keep=lambda outputs: any(rates.get("country") == "Sri Lanka"
+                                               for rates in outputs["per_diem_rates"].values()))),
+    Stage("exchange_rates", fetch_exchange_rates,
+          inputs=["report_month_date", "resources"],
+          outputs=["usd_to_inr_rate", "usd_to_lkr_rate"],
+          # Not reused if the LKR lookup failed
+          reuse=Reuse(keep=lambda outputs: outputs["usd_to_lkr_rate"] is not None)),
+    Stage("gmail_travel", collect_travel_documents,
+          inputs=["creds", "report_month_date", "resources"],
+          outputs=["relevant_flights", "hotel_reservations", "travel_pdf_paths", "travel_timeline"],
+          reuse=Reuse(config=["TRAVEL_EMAIL_SENDER"], probe=travel_emails_seen)),
+    Stage("calendar_meetings", find_bangalore_meetings,
+          inputs=["creds", "report_month_date"],
+          outputs=["bangalore_meetings"]),
+    Stage("travel_calendar", build_travel_calendar,
+          inputs=["relevant_flights", "bangalore_meetings", "report_month_date", "per_diem_start_day",
+                  "travel_timeline"],
+          outputs=["travel_calendar", "unique_travel_dates"]),
+    Stage("travel_state", store_travel_state, inputs=["travel_timeline", "report_month_date"]),
+    Stage("uber_receipts", collect_uber_receipts,
+          inputs=["creds", "folder_id", "unique_travel_dates", "bangalore_meetings", "usd_to_inr_rate", "resources",
+                  "manifest"],
+          outputs=["uber_data", "uploaded_receipts"],
+          reuse=Reuse(config=["YAHOO_EMAIL", "SAVE_TO_DRIVE"], probe=uber_receipts_seen)),
+    Stage("drive_uploads", upload_documents,
+          inputs=["creds", "folder_id", "travel_pdf_paths", "manifest"],
+          outputs=["uploaded_files"]),
+    Stage("per_diem_rows", build_per_diem_rows,
+          inputs=["per_diem_rates", "mie_breakdown", "travel_calendar", "report_month_date", "per_diem_start_day"],
+          outputs=["per_diem_rows"]),
+    Stage("reimbursement_rows", build_reimbursement_rows,
+          inputs=["uber_data", "travel_calendar", "bangalore_meetings", "hotel_reservations",
+                  "usd_to_inr_rate", "usd_to_lkr_rate"],
+          outputs=["reimbursement_rows"]),
+    Stage("write_sheet", write_report_sheet,
+          inputs=["creds", "spreadsheet_id", "per_diem_rows", "reimbursement_rows", "manifest"]),
+    Stage("ledger", store_in_ledger, inputs=["report_month_date", "per_diem_rows", "reimbursement_rows"]),
+]
+
+
+def run_report(report_month_date, per_diem_start_day, resources, serial=False, full=False, resume=False):
+    """
+    Builds the report for one month. Returns True if it completed.
+    Unless full is set, stages whose inputs haven't changed since the last
+    run of the month are not run again (see run_manifest.py); with resume,
+    neither are the stages an interrupted run of the month finished.
+    """
+    print(f"\n--- Building report for {report_month_date.strftime('%B %Y')} ---")
+    pipeline = Pipeline(REPORT_STAGES)
+    manifest = RunManifest(report_month_date, fresh=full, resume=resume)
+    completed = False
+    try:
+        context = pipeline.run({
+            "report_month": report_month_date.month,
+            "report_year": report_month_date.year,
+            "report_month_date": report_month_date,
+            "per_diem_start_day": per_diem_start_day,
+            "resources": resources,
+            "manifest": manifest,
+        }, serial=serial, manifest=manifest)
+        resources.add_downloads(context["travel_pdf_paths"])
+        completed = True
+    except PipelineError as e:
+        print(e)
+        return False
+    finally:
+        pipeline.print_timing_report()
+        manifest.finish(completed)
 
-    print("\n--- Expense Report Automation Finished Successfully! ---")
     if config.SAVE_TO_DRIVE:
-        print(f"Your report has been saved to Google Drive in the folder '{drive_folder_name}'.")
+        print(f"Your report has been saved to Google Drive in the folder '{report_month_date.strftime('%m-%Y')}'.")
+    return True
+
+
+def main(argv=None):
+    """Main function to run the expense automation. Returns 0 if every report completed, else 1."""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["summary"]:
+        return ledger.main_cli(argv[1:])
+
+    args = parse_args(argv)
+    print("--- Starting Expense Report Automation ---")
+
+    # Determine the report period(s): command line, or prompt the user
+    periods = report_periods(args)
+
+    completed = 0
+    with replay.mode(record=args.record, replay=args.replay):
+        resources = SharedResources([report_month_date for report_month_date, _ in periods])
+        try:
+            for report_month_date, per_diem_start_day in periods:
+                if run_report(report_month_date, per_diem_start_day, resources, serial=args.serial, full=args.full,
+                              resume=args.resume):
+                    completed += 1
+        finally:
+            resources.close(keep_downloads=completed < len(periods))
+            instrumentation.write_summary(args.metrics, args.trace)
+            if config.DEBUG_MODE: print(f"Run metrics written to {args.metrics}")
+
+    if completed == len(periods):
+        print("\n--- Expense Report Automation Finished Successfully! ---")
+        return 0
+    print(f"\n--- Finished {completed} of {len(periods)} report(s); see errors above. ---")
+    return 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# pipeline.py
+# A small stage runner: stages declare the values they need and produce, and
+# independent stages run side by side on a thread pool.
+
+import time
+import threading
+import contextvars
+import instrumentation
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class PipelineError(Exception):
+    """Raised by a stage to stop the run, or by the runner when the stage graph is invalid."""
+
+
+class Reuse:
+    """
+    Marks a stage whose outputs can be reused from a run manifest (see
+    run_manifest.py) while its fingerprint is unchanged.
+
+    Args:
+        config: Names of the config settings the stage's result depends on.
+        probe: Called with the stage's inputs; returns a cheap description of
+            the outside state the stage reads (e.g. the IDs of the emails it
+            would download), so new or removed emails make it run again.
+        keep: Called with the stage's outputs; False means they describe a
+            failure and must not be reused.
+    """
+
+    def __init__(self, config=(), probe=None, keep=None):
+        self.config = tuple(config)
+        self.probe = probe
+        self.keep = keep
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Args:
+        name: Name used in the timing report.
+        func: Called with the declared inputs as keyword arguments. Must return a
+            dict containing exactly the declared outputs (or None if it has none).
+        inputs: Names of values the stage needs from the run context.
+        outputs: Names of values the stage adds to the run context.
+        reuse: A Reuse if the stage's outputs may come from the run manifest.
+        checkpoint: Keep the outputs in the run manifest once the stage
+            finishes, so a resumed run can skip it. Off for outputs that
+            mustn't be written to disk, such as credentials.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), reuse=None, checkpoint=True):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.reuse = reuse
+        self.checkpoint = checkpoint
+
+    def __repr__(self):
+        return f"Stage({self.name!r})"
+
+
+class Pipeline:
+    """Runs a set of stages in dependency order, overlapping those that are independent."""
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.timings = []
+        self.total_time = 0.0
+
+        producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise PipelineError(f"'{output}' is produced by both {producers[output].name} and {stage.name}")
+                producers[output] = stage
+        self._producers = producers
+
+    def _check_graph(self, context):
+        """Fails fast on inputs nobody provides and on dependency cycles."""
+        for stage in self.stages:
+            for name in stage.inputs:
+                if name not in context and name not in self._producers:
+                    raise PipelineError(f"Stage {stage.name} needs '{name}', which no stage produces")
+
+        visiting, done = set(), set()
+
+        def visit(stage):
+            if stage.name in done:
+                return
+            if stage.name in visiting:
+                raise PipelineError(f"Dependency cycle through stage {stage.name}")
+            visiting.add(stage.name)
+            for name in stage.inputs:
+                if name not in context:
+                    visit(self._producers[name])
+            visiting.discard(stage.name)
+            done.add(stage.name)
+
+        for stage in self.stages:
+            visit(stage)
+
+    def _run_stage(self, stage, context, run_start, manifest=None):
+        kwargs = {name: context[name] for name in stage.inputs}
+        started = time.perf_counter()
+        reused = False
+        try:
+            key = result = None
+            if manifest is not None and stage.checkpoint:
+                result = manifest.resumed_outputs(stage)
+            if result is None and manifest is not None and stage.reuse:
+                key = manifest.stage_fingerprint(stage, kwargs)
+                result = manifest.reused_outputs(stage, key)
+            reused = result is not None
+            if reused:
+                if stage.checkpoint:
+                    manifest.stage_finished(stage)
+            else:
+                result = stage.func(**kwargs) or {}
+                keep = not stage.reuse or stage.reuse.keep is None or stage.reuse.keep(result)
+                if manifest is not None and stage.checkpoint and keep:
+                    manifest.record_outputs(stage, key, result)
+        finally:
+            finished = time.perf_counter()
+            instrumentation.record(f"stage.{stage.name}", "stage", started, finished - started)
+            self.timings.append({
+                "stage": stage.name,
+                "start": started - run_start,
+                "duration": finished - started,
+                "thread": threading.current_thread().name,
+                "reused": reused,
+            })
+
+        missing = set(stage.outputs) - set(result)
+        extra = set(result) - set(stage.outputs)
+        if missing or extra:
+            raise PipelineError(
+                f"Stage {stage.name} returned wrong outputs (missing: {sorted(missing)}, unexpected: {sorted(extra)})"
+            )
+        return result
+
+    def run(self, context=None, serial=False, max_workers=6, manifest=None):
+        """
+        Runs every stage and returns the final context dict.
+
+        With serial=True stages run one at a time on the calling thread, in
+        declaration order as their inputs become available, which keeps
+        tracebacks and debug output easy to follow.
+
+        With a manifest (run_manifest.RunManifest), stages marked with Reuse
+        whose fingerprint hasn't changed take their outputs from it instead
+        of running, and every finished stage is checkpointed in it.
+        """
+        context = dict(context or {})
+        self._check_graph(context)
+        self.timings = []
+        run_start = time.perf_counter()
+        pending = list(self.stages)
+
+        def ready_stages():
+            return [s for s in pending if all(name in context for name in s.inputs)]
+
+        if serial:
+            while pending:
+                stage = ready_stages()[0]
+                pending.remove(stage)
+                context.update(self._run_stage(stage, context, run_start, manifest))
+            self.total_time = time.perf_counter() - run_start
+            return context
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as executor:
+            running = {}
+            try:
+                while pending or running:
+                    for stage in ready_stages():
+                        pending.remove(stage)
+                        # Each stage runs in a copy of the caller's context so context
+                        # variables (e.g. per-account config overrides) carry over.
+                        stage_context = contextvars.copy_context()
+                        future = executor.submit(stage_context.run, self._run_stage, stage, dict(context), run_start,
+                                                 manifest)
+                        running[future] = stage
+
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        running.pop(future)
+                        context.update(future.result())
+            except BaseException:
+                # Don't start anything new; let stages already in flight finish.
+                for future in running:
+                    future.cancel()
+                raise
+
+        self.total_time = time.perf_counter() - run_start
+        return context
+
+    def print_timing_report(self):
+        """Prints when each stage started and how long it took."""
+        if not self.timings:
+            return
+        width = max(len(t["stage"]) for t in self.timings)
+        print("\n--- Stage Timing ---")
+        for t in sorted(self.timings, key=lambda t: t["start"]):
+            reused = "  (reused)" if t.get("reused") else ""
+            print(f"  {t['stage']:<{width}}  start {t['start']:7.2f}s  took {t['duration']:7.2f}s  [{t['thread']}]{reused}")
+        busy = sum(t["duration"] for t in self.timings)
+        print(f"  Total wall time {self.total_time:.2f}s (sum of stage times {busy:.2f}s)")
@@ -0,0 +1,69 @@
+# records.py
+# Typed records for what the parsers extract: flight legs, hotel reservations
+# and Uber receipts. Slotted dataclasses keep large back-fills small in memory,
+# and fares are parsed once into Decimal instead of being kept as "1,234.56"
+# strings and re-parsed wherever they're compared or converted.
+
+import datetime
+import re
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from enum import Enum
+
+
+class Currency(str, Enum):
+    """Receipt currencies. A str subclass, so it goes into the sheet as "INR"/"LKR"."""
+    INR = "INR"
+    LKR = "LKR"
+
+    def __str__(self):
+        return self.value
+
+
+@dataclass(slots=True)
+class Flight:
+    """One flight leg from an itinerary PDF."""
+    origin: str
+    destination: str
+    date: datetime.date
+    departure: datetime.datetime
+    arrival: datetime.datetime
+
+
+@dataclass(slots=True)
+class HotelReservation:
+    """A hotel booking from a reservation PDF; dates are None when the PDF doesn't show them."""
+    hotel_name: str
+    address: str
+    checkin_date: datetime.date | None = None
+    checkout_date: datetime.date | None = None
+
+
+@dataclass(slots=True)
+class UberReceipt:
+    """
+    An Uber trip from a receipt email. Addresses and fare_city are "N/A" and
+    fare is None when the email doesn't show them; filepath is the saved PDF.
+    """
+    pickup: str = "N/A"
+    dropoff: str = "N/A"
+    fare: Decimal | None = None
+    currency: Currency = Currency.INR
+    date: datetime.date | None = None
+    fare_city: str = "N/A"
+    filepath: str | None = None
+
+    @property
+    def has_addresses(self):
+        return self.pickup != "N/A" and self.dropoff != "N/A"
+
+
+def parse_amount(text):
+    """The first amount like "1,234.56" in text as a Decimal, or None."""
+    match = re.search(r'[\d,]+\.\d{2}', text or "")
+    if not match:
+        return None
+    try:
+        return Decimal(match.group(0).replace(",", ""))
+    except InvalidOperation:
+        return None
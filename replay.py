@@ -0,0 +1,329 @@
+# replay.py
+# Record/replay of every external call, for fast deterministic re-runs.
+#
+#   python main.py --year 2025 --month 7 --record            # run live, save every response
+#   python main.py --year 2025 --month 7 --replay            # answer everything from the recording
+#   python main.py --year 2025 --month 7 --record --replay   # replay what's recorded, run and save the rest
+#
+# CachingBackend wraps the current service backend (see backends.py). Google
+# API requests, HTTP lookups, scraped per diem pages, IMAP search/fetch results
+# and Chrome's PDF output are stored under config.REPLAY_DIR (.replay_cache by
+# default), one JSON file per request, keyed by a fingerprint of the request.
+#
+# With --record --replay a changed request, such as a sheet write whose rows
+# changed, goes to the live service while everything else is replayed.
+
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import backends
+import config
+import instrumentation
+
+
+class ReplayMiss(Exception):
+    """Raised in replay-only mode when a request was never recorded."""
+
+
+def _encode(value):
+    """Makes IMAP results and response bodies (bytes, tuples) JSON-safe."""
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if set(value) == {"__bytes__"}:
+            return base64.b64decode(value["__bytes__"])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _stable(obj):
+    """Fingerprint stand-in for arguments JSON can't serialise (e.g. a MediaFileUpload)."""
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", "replace")
+    return getattr(obj, "_filename", None) or type(obj).__name__
+
+
+class ReplayStore:
+    """Recorded responses on disk: <directory>/<kind>/<fingerprint>.json."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def fingerprint(kind, request):
+        text = json.dumps([kind, request], sort_keys=True, default=_stable)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, kind, request):
+        return os.path.join(self.directory, kind, self.fingerprint(kind, request) + ".json")
+
+    def get(self, kind, request):
+        """Returns (True, response) if the request was recorded, else (False, None)."""
+        path = self._path(kind, request)
+        if not os.path.exists(path):
+            return False, None
+        with open(path, "r", encoding="utf-8") as f:
+            return True, _decode(json.load(f)["response"])
+
+    def put(self, kind, request, response):
+        path = self._path(kind, request)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename, so a crash never leaves half a recording
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"request": json.loads(json.dumps(request, default=_stable)), "response": _encode(response)}, f)
+        os.replace(tmp_path, path)
+
+
+class CachingBackend:
+    """
+    A service backend that answers from a ReplayStore and/or records into it.
+
+    Args:
+        store: Where responses are kept.
+        inner: The backend used for requests that aren't replayed; None means
+            replay only, and an unrecorded request raises ReplayMiss.
+        read: Answer from the store when the request is recorded.
+        write: Save the responses of requests sent to inner.
+    """
+
+    name = "replay"
+
+    def __init__(self, store, inner=None, read=True, write=False):
+        self.store = store
+        self.inner = inner
+        self.read = read
+        self.write = write
+
+    @property
+    def rate_limited(self):
+        """Only requests that go on to a live backend count against its limits."""
+        return self.inner is not None and getattr(self.inner, "rate_limited", True)
+
+    def call(self, kind, request, live):
+        """Returns the recorded response for request, or live() (recording it if writing)."""
+        if self.read:
+            found, response = self.store.get(kind, request)
+            if found:
+                instrumentation.count("replay.hits")
+                return response
+        if self.inner is None:
+            described = json.dumps(request, default=_stable)
+            if len(described) > 300:
+                described = described[:300] + "..."
+            raise ReplayMiss(f"No recorded {kind} response for {described}; run again with --record")
+        instrumentation.count("replay.misses")
+        response = live()
+        # A failed call (e.g. a scrape that returned None) isn't recorded, so it is retried next time
+        if self.write and response is not None:
+            self.store.put(kind, request, response)
+        return response
+
+    def authenticate(self):
+        if self.inner is None:
+            return "replay-credentials"
+        return self.inner.authenticate()
+
+    def google_service(self, api, version, credentials):
+        return _CachingGoogleService(self, api, version, credentials)
+
+    def imap_connect(self, host):
+        return _CachingIMAP(self, host)
+
+    def http_get(self, url, params=None):
+        content = self.call("http", {"url": url, "params": params},
+                            lambda: self.inner.http_get(url, params=params).content)
+        return _StoredResponse(content)
+
+    def chrome(self, options):
+        return _CachingChrome(self, options)
+
+    def per_diem_page(self, year, month, country_name, scrape):
+        return self.call("per_diem", {"year": year, "month": month, "country": country_name},
+                         lambda: self.inner.per_diem_page(year, month, country_name, scrape))
+
+
+class _StoredResponse:
+    """The parts of requests.Response that utils.http_get_json reads."""
+
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class _CachingGoogleService:
+    """
+    Follows a googleapiclient call chain (service.users().messages().get(...))
+    without building the real client; the client is built, and the chain
+    repeated on it, only when a request has to go to the live service.
+    """
+
+    def __init__(self, backend, api, version, credentials, steps=(), client=None):
+        self._backend = backend
+        self._api = (api, version, credentials)
+        self._steps = steps
+        self._client = client if client is not None else []   # the live client, once built
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(**params):
+            return _CachingGoogleService(self._backend, *self._api, steps=self._steps + ((name, params),),
+                                         client=self._client)
+
+        return call
+
+    def execute(self):
+        api, version, credentials = self._api
+        request = {
+            "api": api,
+            "version": version,
+            "method": ".".join(name for name, _ in self._steps),
+            "params": [params for _, params in self._steps],
+        }
+
+        def live():
+            if not self._client:
+                self._client.append(self._backend.inner.google_service(api, version, credentials))
+            target = self._client[0]
+            for name, params in self._steps:
+                target = getattr(target, name)(**params)
+            return target.execute()
+
+        return self._backend.call("google", request, live)
+
+
+class _CachingIMAP:
+    """
+    Replays search and fetch results. The live connection is opened (and the
+    login and mailbox selection repeated on it) only when a command misses.
+    """
+
+    def __init__(self, backend, host):
+        self._backend = backend
+        self._host = host
+        self._setup = []
+        self._live = None
+        self._lock = threading.Lock()
+
+    def _live_session(self):
+        with self._lock:
+            if self._live is None:
+                self._live = self._backend.inner.imap_connect(self._host)
+                for command, args in self._setup:
+                    getattr(self._live, command)(*args)
+            return self._live
+
+    def _session_command(self, command, *args):
+        if command in ("login", "select"):
+            self._setup.append((command, args))
+        if self._live is None:
+            return "OK", [b"replayed"]
+        return getattr(self._live, command)(*args)
+
+    def login(self, user, password):
+        return self._session_command("login", user, password)
+
+    def select(self, mailbox="INBOX"):
+        return self._session_command("select", mailbox)
+
+    def noop(self):
+        return self._session_command("noop")
+
+    def logout(self):
+        return self._session_command("logout")
+
+    def search(self, charset, query):
+        return self._backend.call("imap", {"command": "search", "query": query},
+                                  lambda: self._live_session().search(charset, query))
+
+    def fetch(self, msg_id, parts):
+        return self._backend.call("imap", {"command": "fetch", "id": msg_id, "parts": parts},
+                                  lambda: self._live_session().fetch(msg_id, parts))
+
+    def uid(self, command, *args):
+        return self._backend.call("imap", {"command": f"uid {command.lower()}", "args": args},
+                                  lambda: self._live_session().uid(command, *args))
+
+
+class _CachingChrome:
+    """
+    Replays printToPDF output per rendered file (its name and a hash of its
+    content, so a receipt whose IMAP ID moved to another email isn't served
+    the old PDF); Chrome starts only on a miss.
+    """
+
+    def __init__(self, backend, options):
+        self._backend = backend
+        self._options = options
+        self._live = None
+        self._url = None
+
+    def _driver(self):
+        if self._live is None:
+            self._live = self._backend.inner.chrome(self._options)
+        return self._live
+
+    def get(self, url):
+        self._url = url
+
+    def execute_cdp_cmd(self, cmd, params):
+        def live():
+            driver = self._driver()
+            driver.get(self._url)
+            return driver.execute_cdp_cmd(cmd, params)
+
+        request = {"file": os.path.basename(self._url or ""), "content": _file_hash(self._url),
+                   "cmd": cmd, "params": params}
+        return self._backend.call("chrome", request, live)
+
+    def quit(self):
+        if self._live is not None:
+            self._live.quit()
+            self._live = None
+
+
+def _file_hash(url):
+    """SHA-256 of the local file a file:// URL points to, or None."""
+    if not url or not url.startswith("file://"):
+        return None
+    try:
+        with open(url[len("file://"):], "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def add_arguments(parser):
+    """Adds --record and --replay to a command-line parser."""
+    parser.add_argument("--record", action="store_true",
+                        help="save every external response to REPLAY_DIR (default: .replay_cache)")
+    parser.add_argument("--replay", action="store_true",
+                        help="answer external calls from the recording; with --record, only unrecorded ones go live")
+
+
+def mode(record=False, replay=False):
+    """Context manager that plugs in the caching backend the flags ask for (or does nothing)."""
+    if not (record or replay):
+        return contextlib.nullcontext()
+    store = ReplayStore(getattr(config, "REPLAY_DIR", ".replay_cache"))
+    inner = backends.current() if record else None
+    return backends.use(CachingBackend(store, inner, read=replay, write=record))
@@ -0,0 +1,257 @@
+# resilience.py
+# Rate limiting, retries and circuit breaking for every outbound call.
+#
+# google_services.execute, yahoo_service.imap_command, utils.http_get_json and
+# the per diem scrape all go through call(), which
+#   - waits for a token from the service's token bucket, sized to stay under
+#     the service's per-user quota (one bucket per service and account, so
+#     team_runner's accounts don't share a budget);
+#   - retries transient failures (HTTP 429 and 5xx, Google's rate limit 403s,
+#     timeouts, dropped connections) with exponential backoff and full jitter,
+#     waiting at least as long as a Retry-After header asks. Requests that
+#     aren't safe to send twice (creating a Drive file, appending rows) pass
+#     retryable=is_rate_limited instead: after a timeout or 5xx the request
+#     may have gone through, so only a refused one is sent again;
+#   - stops calling a service that keeps failing: after
+#     CIRCUIT_BREAKER_THRESHOLD failures in a row, calls fail straight away
+#     with CircuitOpenError for CIRCUIT_BREAKER_COOLDOWN seconds, then one
+#     trial call is let through. CircuitOpenError stops the stage, so the run
+#     can be picked up later with `main.py --resume`.
+#
+# Settings (all optional): RETRY_ATTEMPTS (5), RETRY_BASE_DELAY (0.5s),
+# RETRY_MAX_DELAY (30s), CIRCUIT_BREAKER_THRESHOLD (5),
+# CIRCUIT_BREAKER_COOLDOWN (30s) and RATE_LIMITS, which overrides entries of
+# DEFAULT_RATE_LIMITS. The fake and replay-only backends aren't rate limited.
+
+import imaplib
+import random
+import threading
+import time
+
+import config
+import instrumentation
+from pipeline import PipelineError
+
+# Calls per second and burst size per service, under the per-user quotas:
+# Gmail 250 quota units/s (5 units per messages.get/list or attachments.get),
+# Drive 12,000 queries/min, Sheets 60 reads and 60 writes/min, Calendar
+# 600 requests/min. Yahoo and the exchange rate APIs publish no limits.
+DEFAULT_RATE_LIMITS = {
+    "gmail": (40, 40),
+    "drive": (10, 20),
+    "sheets": (1, 10),
+    "calendar": (10, 10),
+    "imap": (10, 10),
+    "http": (5, 5),
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+_lock = threading.Lock()
+_buckets = {}
+_breakers = {}
+
+
+class CircuitOpenError(PipelineError):
+    """Raised instead of calling a service whose circuit breaker is open."""
+
+
+class TokenBucket:
+    """Hands out rate tokens per second, up to burst at once; acquire() blocks until one is free."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, waiting if needed. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class CircuitBreaker:
+    """Counts failures in a row; opens at threshold and lets one trial call through after cooldown."""
+
+    def __init__(self, service, threshold, cooldown):
+        self.service = service
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if remaining <= 0 and not self._trial:
+                self._trial = True
+                return
+            message = (f"{self.service} failed {self._failures} times in a row; "
+                       f"not calling it again for {max(remaining, 0):.0f}s")
+        instrumentation.count(f"circuit_open.{self.service}")
+        raise CircuitOpenError(message)
+
+    def succeeded(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failed(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                if self._opened_at is None or self._trial:
+                    print(f"{self.service} is failing; pausing calls to it for {self.cooldown:.0f}s.")
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+def _rate_limit(service):
+    limit = {**DEFAULT_RATE_LIMITS, **getattr(config, "RATE_LIMITS", {})}.get(service)
+    if not limit:
+        return None
+    if isinstance(limit, (int, float)):
+        return limit, limit
+    return limit
+
+
+def _rate_limited():
+    import backends
+
+    return getattr(backends.current(), "rate_limited", True)
+
+
+def _guards(service, key):
+    """The token bucket (None if the service isn't limited) and breaker for service and key."""
+    with _lock:
+        if (service, key) not in _breakers:
+            limit = _rate_limit(service)
+            _buckets[(service, key)] = TokenBucket(*limit) if limit else None
+            _breakers[(service, key)] = CircuitBreaker(
+                service,
+                getattr(config, "CIRCUIT_BREAKER_THRESHOLD", 5),
+                getattr(config, "CIRCUIT_BREAKER_COOLDOWN", 30),
+            )
+        return _buckets[(service, key)], _breakers[(service, key)]
+
+
+def reset():
+    """Forgets every bucket and breaker (for tests and benchmarks)."""
+    with _lock:
+        _buckets.clear()
+        _breakers.clear()
+
+
+def _status(error):
+    """The HTTP status of a googleapiclient HttpError or requests.HTTPError, else None."""
+    resp = getattr(error, "resp", None)
+    if resp is not None and hasattr(resp, "status"):
+        return int(resp.status)
+    response = getattr(error, "response", None)
+    if response is not None and hasattr(response, "status_code"):
+        return int(response.status_code)
+    return None
+
+
+def _retry_after(error):
+    headers = getattr(error, "resp", None) or getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _is_rate_limit_403(error):
+    return any(reason in str(getattr(error, "content", b"")) for reason in RATE_LIMIT_REASONS)
+
+
+def is_rate_limited(error):
+    """True if error is a rate limit (429, or Google's rate limit 403): the request was refused, not carried out."""
+    status = _status(error)
+    return status == 429 or (status == 403 and _is_rate_limit_403(error))
+
+
+def is_transient(error):
+    """True if error is worth retrying: a rate limit, a server error, a timeout or a dropped connection."""
+    status = _status(error)
+    if status is not None:
+        if status == 403:
+            return _is_rate_limit_403(error)
+        return status in RETRY_STATUSES
+    if isinstance(error, (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError)):
+        return False
+    if isinstance(error, (OSError, imaplib.IMAP4.abort)):   # includes timeouts and requests' connection errors
+        return True
+    return type(error).__module__.startswith("httplib2")
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full jitter: a random wait up to RETRY_BASE_DELAY * 2**attempt, capped at RETRY_MAX_DELAY."""
+    max_delay = getattr(config, "RETRY_MAX_DELAY", 30)
+    delay = random.uniform(0, min(max_delay, getattr(config, "RETRY_BASE_DELAY", 0.5) * 2 ** attempt))
+    if retry_after:
+        delay = max(delay, min(retry_after, max_delay))
+    return delay
+
+
+def call(service, func, key=None, retryable=is_transient, before_retry=None, attempts=None):
+    """
+    Calls func() for service ("gmail", "drive", "sheets", "calendar", "imap",
+    "http", ...) under its rate limit and circuit breaker, retrying it while
+    retryable(error) says so.
+
+    Args:
+        key: What the limits are kept per, e.g. the account or host.
+        before_retry: Called before each retry, e.g. to reconnect; if it fails,
+            that counts as a failed attempt.
+        attempts: Tries in all (default RETRY_ATTEMPTS).
+    """
+    bucket, breaker = _guards(service, key)
+    if not _rate_limited():
+        bucket = None
+    attempts = max(1, attempts or getattr(config, "RETRY_ATTEMPTS", 5))
+
+    for attempt in range(attempts):
+        breaker.before_call()
+        if bucket:
+            waited = bucket.acquire()
+            if waited:
+                instrumentation.count(f"throttled_ms.{service}", int(waited * 1000))
+        try:
+            if attempt and before_retry:
+                before_retry()
+            result = func()
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            if not retryable(e):
+                breaker.succeeded()   # the service answered; the request itself was wrong
+                raise
+            breaker.failed()
+            if attempt + 1 == attempts:
+                raise
+            delay = backoff_delay(attempt, _retry_after(e))
+            instrumentation.count(f"retries.{service}")
+            if config.DEBUG_MODE: print(f"{service} call failed ({e}); retrying in {delay:.1f}s.")
+            time.sleep(delay)
+            continue
+        breaker.succeeded()
+        return result
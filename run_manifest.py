@@ -0,0 +1,260 @@
+# run_manifest.py
+# What the last run of a report month did, so a re-run only redoes what changed.
+#
+# For each stage marked with pipeline.Reuse the manifest records a fingerprint
+# of its inputs (the values it was given, the config settings it reads and
+# what its probe saw, e.g. the Gmail message IDs or the IMAP search results)
+# and keeps its outputs. When the fingerprint is the same next time, the
+# outputs are reused and the stage isn't run: no scraping, downloads, renders
+# or template copy. The cheap stages that build the rows always run, so a
+# change to COMPANIES or CITY_ALIASES shows up straight away.
+#
+# The manifest also lists the files uploaded to each Drive folder (with their
+# Drive file IDs), which are not uploaded again, and the rows last written to
+# the sheet, so only rows that changed are written.
+#
+# It doubles as the run's checkpoint: it is written after every stage and every
+# upload, with the outputs of each finished stage. If a run fails,
+# `main.py --resume` takes the outputs of the stages that finished instead of
+# running them again, and the stage that failed picks up after the last upload
+# that completed.
+#
+#   <RUN_MANIFEST_DIR>/<YYYY-MM>/manifest.json      fingerprints, checkpoint, uploads, sheet rows
+#   <RUN_MANIFEST_DIR>/<YYYY-MM>/<stage>-<fingerprint>.pickle   a stage's outputs
+#
+# RUN_MANIFEST_DIR defaults to .run_manifest; `main.py --full` ignores it.
+
+import dataclasses
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+
+import config
+import instrumentation
+
+VERSION = 2
+
+
+def canonical(value):
+    """
+    A JSON-safe form of value that is the same whenever the content is: dicts
+    and sets are sorted, records become dicts, and objects without content of
+    their own (credentials, shared resources) become their type name.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {field.name: canonical(getattr(value, field.name)) for field in dataclasses.fields(value)}
+    if isinstance(value, dict):
+        items = [[canonical(k), canonical(v)] for k, v in value.items()]
+        return sorted(items, key=lambda item: json.dumps(item, sort_keys=True))
+    if isinstance(value, (set, frozenset)):
+        return sorted((canonical(v) for v in value), key=lambda item: json.dumps(item, sort_keys=True))
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    return type(value).__name__
+
+
+def fingerprint(value):
+    return hashlib.sha256(json.dumps(canonical(value), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _write_atomically(path, data, mode="wb"):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class RunManifest:
+    """
+    The manifest of one report month.
+
+    Args:
+        report_month_date: The month it belongs to.
+        fresh: Start empty instead of loading what the last run recorded
+            (everything runs, and the new run's manifest replaces it).
+        resume: Reuse the outputs of every stage the last run finished, if
+            that run didn't complete.
+    """
+
+    def __init__(self, report_month_date, fresh=False, resume=False):
+        # Read once here, so overrides entered after the manifest is created don't move it
+        self.directory = os.path.join(getattr(config, "RUN_MANIFEST_DIR", ".run_manifest"),
+                                      report_month_date.strftime("%Y-%m"))
+        self._lock = threading.Lock()
+        self._data = {"version": VERSION, "run": {}, "stages": {}, "uploads": {}, "sheet": {}}
+        if not fresh:
+            self._load()
+
+        self.resumed_stages = set()
+        last_run = self._data["run"]
+        if resume:
+            if last_run.get("status") == "running":
+                self.resumed_stages = set(last_run.get("finished", []))
+                print(f"Resuming the run of {report_month_date:%B %Y} started {last_run.get('started')}: "
+                      f"{len(self.resumed_stages)} stage(s) already finished.")
+            else:
+                print(f"No unfinished run of {report_month_date:%B %Y} to resume; "
+                      f"unchanged steps are reused as usual.")
+        if not self.resumed_stages:
+            self._data["run"] = {"status": "running", "started": datetime.now().isoformat(timespec="seconds"),
+                                 "finished": []}
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable run manifest {self.path}: {e}")
+            return
+        if data.get("version") == VERSION:
+            self._data = data
+
+    def _outputs_path(self, stage_name, key):
+        return os.path.join(self.directory, f"{stage_name}-{(key or 'checkpoint')[:16]}.pickle")
+
+    def _read_outputs(self, stage_name, key):
+        try:
+            with open(self._outputs_path(stage_name, key), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            if config.DEBUG_MODE: print(f"Can't reuse {stage_name} outputs: {e}")
+            return None
+
+    # Stage outputs (used by pipeline.Pipeline)
+
+    def resumed_outputs(self, stage):
+        """With resume, the outputs of a stage the interrupted run finished, or None."""
+        if stage.name not in self.resumed_stages:
+            return None
+        with self._lock:
+            entry = self._data["stages"].get(stage.name)
+        outputs = self._read_outputs(stage.name, entry["fingerprint"]) if entry else None
+        if outputs is not None:
+            instrumentation.count("manifest.resumed")
+        return outputs
+
+    def stage_fingerprint(self, stage, kwargs):
+        """The fingerprint of a run of stage with these inputs (see pipeline.Reuse)."""
+        reuse = stage.reuse
+        probe = None
+        if reuse.probe:
+            probe = reuse.probe(**kwargs)
+        return fingerprint({
+            "inputs": kwargs,
+            "config": {name: getattr(config, name, None) for name in reuse.config},
+            "probe": probe,
+        })
+
+    def reused_outputs(self, stage, key):
+        """The outputs stage produced last time with this fingerprint, or None."""
+        with self._lock:
+            entry = self._data["stages"].get(stage.name)
+        if not entry or entry["fingerprint"] != key:
+            return None
+        outputs = self._read_outputs(stage.name, key)
+        if outputs is not None:
+            instrumentation.count("manifest.reused")
+        return outputs
+
+    def record_outputs(self, stage, key, outputs):
+        """
+        Keeps a finished stage's outputs (key is its fingerprint, or None for
+        a stage that is only checkpointed) and saves the manifest.
+        """
+        try:
+            data = pickle.dumps(outputs)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            if config.DEBUG_MODE: print(f"Not keeping {stage.name} outputs: {e}")
+            data = None
+        if data is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            _write_atomically(self._outputs_path(stage.name, key), data)
+        with self._lock:
+            if data is not None:
+                self._data["stages"][stage.name] = {"fingerprint": key}
+            else:
+                self._data["stages"].pop(stage.name, None)
+        self.stage_finished(stage)
+
+    def stage_finished(self, stage):
+        """Checkpoints the stage as finished in this run."""
+        with self._lock:
+            finished = self._data["run"].setdefault("finished", [])
+            if stage.name not in finished:
+                finished.append(stage.name)
+        self.save()
+
+    # Drive uploads
+
+    def uploaded(self, folder_id, path):
+        """True if a file with path's name was already uploaded to folder_id."""
+        with self._lock:
+            return os.path.basename(path) in self._data["uploads"].get(folder_id, {})
+
+    def record_upload(self, folder_id, path, file_id):
+        """Notes a finished upload (and saves the manifest, so a resumed run carries on after it)."""
+        with self._lock:
+            self._data["uploads"].setdefault(folder_id, {})[os.path.basename(path)] = file_id
+        self.save()
+
+    # Sheet rows
+
+    def sheet_rows(self, spreadsheet_id, tab_name):
+        """The rows last written to tab_name of spreadsheet_id, or None if unknown."""
+        with self._lock:
+            sheet = self._data["sheet"]
+            if sheet.get("spreadsheet_id") != spreadsheet_id:
+                return None
+            return sheet["tabs"].get(tab_name)
+
+    def record_sheet_rows(self, spreadsheet_id, tab_name, rows):
+        with self._lock:
+            sheet = self._data["sheet"]
+            if sheet.get("spreadsheet_id") != spreadsheet_id:
+                sheet.clear()
+                sheet.update({"spreadsheet_id": spreadsheet_id, "tabs": {}})
+            # Stored as JSON gives them, so they compare equal to next run's rows
+            sheet["tabs"][tab_name] = json.loads(json.dumps(rows, default=str))
+
+    def save(self):
+        """Writes the manifest."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            text = json.dumps(self._data, indent=1)
+            # Under the lock too, so concurrent saves can't write an older copy last
+            _write_atomically(self.path, text, mode="w")
+
+    def finish(self, completed):
+        """Marks the run complete (or failed, leaving it to --resume) and removes unused stage outputs."""
+        with self._lock:
+            self._data["run"]["status"] = "complete" if completed else "running"
+            kept = {os.path.basename(self._outputs_path(name, entry["fingerprint"]))
+                    for name, entry in self._data["stages"].items()}
+        self.save()
+        if completed:
+            for name in os.listdir(self.directory):
+                if name.endswith(".pickle") and name not in kept:
+                    os.remove(os.path.join(self.directory, name))
+        if config.DEBUG_MODE: print(f"Saved run manifest to {self.path}")
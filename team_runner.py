@@ -0,0 +1,140 @@
+# team_runner.py
+# Builds expense reports for several people in one process.
+#
+# Each account in the roster has its own Google token, Yahoo mailbox, Drive
+# folder and any other config.py overrides. Accounts run concurrently and only
+# share what holds no personal data (per diem rates, exchange rates, the Chrome
+# render pool and parsed travel PDFs).
+#
+# Roster file (JSON):
+#   [
+#     {
+#       "name": "alice",
+#       "token_path": "tokens/alice.json",
+#       "config": {
+#         "YAHOO_EMAIL": "alice@yahoo.com",
+#         "YAHOO_APP_PASSWORD": "...",
+#         "DRIVE_PARENT_FOLDER_ID": "..."
+#       }
+#     }
+#   ]
+
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import account_config
+import instrumentation
+import replay
+from main import ProcessResources, SharedResources, build_arg_parser, parse_args, report_periods, run_report
+
+
+def load_roster(path):
+    """
+    Reads the roster file and returns one profile dict per account, each with
+    the config overrides to apply while that account's reports run.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("accounts", []) if isinstance(data, dict) else data
+
+    profiles = []
+    seen = set()
+    for entry in entries:
+        name = entry.get("name")
+        if not name:
+            raise ValueError(f"Roster entry without a name: {entry}")
+        if name in seen:
+            raise ValueError(f"Duplicate account name in roster: {name}")
+        seen.add(name)
+
+        overrides = {
+            # Keep each account's downloads, caches, travel state, ledger and run manifests apart
+            "DOWNLOAD_DIR": os.path.join("downloads", name),
+            "CALENDAR_CACHE_DIR": os.path.join(".calendar_cache", name),
+            "TOKEN_PATH": entry.get("token_path") or f"token_{name}.json",
+            "REPLAY_DIR": os.path.join(".replay_cache", name),
+            "TRAVEL_STATE_DIR": os.path.join(".travel_state", name),
+            "LEDGER_PATH": os.path.join(".ledger", f"{name}.sqlite3"),
+            "RUN_MANIFEST_DIR": os.path.join(".run_manifest", name),
+        }
+        overrides.update(entry.get("config", {}))
+        profiles.append({"name": name, "overrides": overrides})
+    return profiles
+
+
+def run_account(profile, periods, process_resources, serial=False, record=False, replay_recorded=False, full=False,
+                resume=False):
+    """
+    Builds every report period for one account. Returns the number of reports completed.
+    record/replay_recorded are the --record/--replay flags (see replay.py), full and resume
+    are --full and --resume.
+    """
+    completed = 0
+    with account_config.overrides(profile["overrides"]), replay.mode(record=record, replay=replay_recorded):
+        resources = SharedResources([report_month_date for report_month_date, _ in periods], process_resources)
+        try:
+            for report_month_date, per_diem_start_day in periods:
+                print(f"\n=== {profile['name']}: {report_month_date.strftime('%B %Y')} ===")
+                if run_report(report_month_date, per_diem_start_day, resources, serial=serial, full=full,
+                              resume=resume):
+                    completed += 1
+        finally:
+            resources.close(keep_downloads=completed < len(periods))
+    return completed
+
+
+def run_team(profiles, periods, max_accounts=2, serial=False, record=False, replay_recorded=False, full=False,
+             resume=False):
+    """
+    Runs every account's reports, up to max_accounts at a time.
+    A failure in one account is reported and doesn't stop the others.
+    Returns a dict mapping account name to the number of reports completed.
+    """
+    process_resources = ProcessResources(render_pool_size=max_accounts)
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max_accounts, thread_name_prefix="account") as executor:
+            futures = {
+                profile["name"]: executor.submit(
+                    contextvars.copy_context().run, run_account, profile, periods, process_resources, serial,
+                    record, replay_recorded, full, resume
+                )
+                for profile in profiles
+            }
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"Account '{name}' failed: {e}")
+                    results[name] = 0
+    finally:
+        process_resources.close()
+
+    print("\n--- Team Summary ---")
+    for name, completed in results.items():
+        print(f"  {name}: {completed} of {len(periods)} report(s)")
+    return results
+
+
+def main(argv=None):
+    parser = build_arg_parser("Build expense reports for every account in a roster file.")
+    parser.add_argument("roster", help="JSON roster of account profiles")
+    parser.add_argument("--accounts", type=int, default=2,
+                        help="number of accounts to run at the same time (default: 2)")
+    args = parse_args(argv, parser)
+
+    profiles = load_roster(args.roster)
+    periods = report_periods(args)
+    try:
+        results = run_team(profiles, periods, max_accounts=max(1, args.accounts), serial=args.serial,
+                           record=args.record, replay_recorded=args.replay, full=args.full, resume=args.resume)
+    finally:
+        instrumentation.write_summary(args.metrics, args.trace)
+    if any(completed < len(periods) for completed in results.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
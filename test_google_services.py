@@ -0,0 +1,240 @@
+# test_google_services.py
+# Offline tests for the Google helpers that don't need an API call.
+# Run with: python -m pytest test_google_services.py -v
+
+import base64
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date
+from unittest import mock
+
+import account_config
+import backends
+import google_services
+
+
+class TestCompanyMatcher(unittest.TestCase):
+    """Calendar titles are matched to companies the way a name-by-name `in` check would."""
+
+    def match(self, company_names, text):
+        matcher, _ = google_services.compile_company_matcher(company_names)
+        return google_services.match_company(matcher, text)
+
+    def test_name_inside_a_longer_name(self):
+        """A listed name inside a longer one is still found, and the first listed wins."""
+        self.assertEqual(self.match(["Acme", "Acme Labs"], "Acme Labs kickoff"), "Acme")
+        self.assertEqual(self.match(["Acme Labs", "Acme"], "Acme Labs kickoff"), "Acme Labs")
+
+    def test_overlapping_names(self):
+        """Names that overlap in the text are both found."""
+        self.assertEqual(self.match(["Labs Inc", "Acme Labs"], "Acme Labs Inc review"), "Labs Inc")
+        self.assertEqual(self.match(["Acme Labs", "Labs Inc"], "Acme Labs Inc review"), "Acme Labs")
+
+    def test_case_insensitive(self):
+        self.assertEqual(self.match(["Globex"], "call with GLOBEX team"), "Globex")
+
+    def test_no_match(self):
+        self.assertIsNone(self.match(["Globex", "Initech"], "Dentist"))
+        self.assertIsNone(self.match(["Globex"], ""))
+        self.assertIsNone(self.match([], "Globex sync"))
+
+    def test_same_as_checking_each_name(self):
+        """Agrees with checking each name in turn on a table of titles."""
+        company_names = ["Acme", "Acme Labs", "Labs Inc", "Initech", "Tech"]
+        titles = ["Acme Labs Inc review", "Initech offsite", "Tech talk", "Labs Inc / Initech",
+                  "weekly sync", "ACME", "acmelabs"]
+        for title in titles:
+            expected = next((name for name in company_names if name.lower() in title.lower()), None)
+            self.assertEqual(self.match(company_names, title), expected, title)
+
+
+class TestRunConcurrently(unittest.TestCase):
+
+    def test_results_in_order(self):
+        def slow_square(n):
+            time.sleep(0.01 * (5 - n))
+            return n * n
+        self.assertEqual(google_services.run_concurrently(slow_square, (n for n in range(5)), max_workers=3),
+                         [0, 1, 4, 9, 16])
+        self.assertEqual(google_services.run_concurrently(slow_square, [3], max_workers=3), [9])
+
+    def test_failure_stops_the_generator(self):
+        """A failed call is raised while items are still being produced, and later items aren't run."""
+        produced, called = [], []
+        lock = threading.Lock()
+
+        def items():
+            for n in range(50):
+                produced.append(n)
+                time.sleep(0.01)
+                yield n
+
+        def upload(n):
+            with lock:
+                called.append(n)
+            if n == 2:
+                raise RuntimeError("upload failed")
+            return n
+
+        with self.assertRaisesRegex(RuntimeError, "upload failed"):
+            google_services.run_concurrently(upload, items(), max_workers=2)
+        self.assertLess(len(produced), 10)
+        self.assertLess(len(called), 10)
+
+
+class FakeGmail:
+    """Just enough of a Gmail service for get_gmail_attachment: messages().get() and attachments().get()."""
+
+    def __init__(self, attachments):
+        self.files = attachments   # msg_id -> (filename, bytes)
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def attachments(self):
+        return self
+
+    def get(self, userId, id, messageId=None):
+        if messageId is not None:
+            data = self.files[messageId][1]
+            return FakeRequest({"data": base64.urlsafe_b64encode(data).decode()})
+        filename = self.files[id][0]
+        return FakeRequest({"payload": {"parts": [{"filename": filename, "body": {"attachmentId": "a1"}}]}})
+
+
+class FakeRequest:
+
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class TestGetGmailAttachment(unittest.TestCase):
+
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp(prefix="gmail-attachments-test-")
+        self.addCleanup(shutil.rmtree, self.download_dir, ignore_errors=True)
+
+    def test_same_name_in_two_emails(self):
+        """Two emails' "Itinerary.pdf" are saved side by side, each with its own content."""
+        gmail = FakeGmail({"m1": ("Itinerary.pdf", b"first"), "m2": ("Itinerary.pdf", b"second")})
+        with account_config.overrides({"DOWNLOAD_DIR": self.download_dir}):
+            paths = google_services.run_concurrently(
+                lambda msg_id: google_services.get_gmail_attachment(gmail, msg_id, "Itinerary.pdf"), ["m1", "m2"])
+        self.assertEqual([os.path.basename(path) for path in paths], ["m1_Itinerary.pdf", "m2_Itinerary.pdf"])
+        contents = []
+        for path in paths:
+            with open(path, "rb") as f:
+                contents.append(f.read())
+        self.assertEqual(contents, [b"first", b"second"])
+
+
+def event(event_id, day, summary="", status="confirmed"):
+    return {"id": event_id, "status": status, "summary": summary, "start": {"date": day}}
+
+
+FULL_SYNC = {"syncToken": None}
+CALENDAR_RESPONSES = {"events.list": [
+    # Full sync, in two pages
+    {"match": {**FULL_SYNC, "pageToken": None},
+     "response": {"items": [event("e1", "2025-02-04", "Globex sync"), event("e2", "2025-02-05", "Dentist")],
+                  "nextPageToken": "page-2"}},
+    {"match": {**FULL_SYNC, "pageToken": "page-2"},
+     "response": {"items": [event("e3", "2025-02-11", "Initech review")], "nextSyncToken": "token-1"}},
+    # Changes since token-1: e1 cancelled, e2 renamed, e4 added
+    {"match": {"syncToken": "token-1"},
+     "response": {"items": [event("e1", "", status="cancelled"), event("e2", "2025-02-05", "Globex lunch"),
+                            event("e4", "2025-02-20", "Initech offsite")],
+                  "nextSyncToken": "token-2"}},
+    {"match": {"syncToken": "token-2"}, "response": {"items": [], "nextSyncToken": "token-2"}},
+    {"match": {"syncToken": "expired"}, "error": {"status": 410, "content": {"error": {"code": 410}}}},
+]}
+
+
+class TestCalendarSync(unittest.TestCase):
+    """Incremental calendar sync against canned events.list responses."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix="calendar-cache-test-")
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        overrides = account_config.overrides({"CALENDAR_CACHE_DIR": self.cache_dir})
+        overrides.__enter__()
+        self.addCleanup(overrides.__exit__, None, None, None)
+
+        backend = backends.FakeBackend("unused", mailbox=[])
+        self.calendar = backends.FakeGoogleService(backend, "calendar", CALENDAR_RESPONSES)
+        self.requests = []
+        execute = backends.FakeRequest.execute
+
+        def recording_execute(request):
+            self.requests.append(request.params)
+            return execute(request)
+
+        patcher = mock.patch.object(backends.FakeRequest, "execute", recording_execute)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sync(self, time_min="2025-01-01T00:00:00Z"):
+        self.requests = []
+        events = google_services.sync_calendar_events(self.calendar, time_min=time_min)
+        return sorted(e["summary"] for e in events)
+
+    def test_full_sync_is_bounded_and_stores_the_token(self):
+        self.assertEqual(self.sync(), ["Dentist", "Globex sync", "Initech review"])
+        self.assertEqual([r.get("pageToken") for r in self.requests], [None, "page-2"])
+        self.assertTrue(all(r["timeMin"] == "2025-01-01T00:00:00Z" for r in self.requests))
+        self.assertFalse(any(r["showDeleted"] or "syncToken" in r for r in self.requests))
+        cache = google_services.load_calendar_cache()
+        self.assertEqual((cache["sync_token"], cache["time_min"]), ("token-1", "2025-01-01T00:00:00Z"))
+
+    def test_resync_applies_changes_and_drops_cancelled_events(self):
+        self.sync()
+        self.assertEqual(self.sync(), ["Globex lunch", "Initech offsite", "Initech review"])
+        (request,) = self.requests
+        self.assertEqual(request["syncToken"], "token-1")
+        self.assertTrue(request["showDeleted"])
+        self.assertNotIn("timeMin", request)   # not allowed with a sync token
+        self.assertEqual(google_services.load_calendar_cache()["sync_token"], "token-2")
+
+        # Nothing changed: one request, same events
+        self.assertEqual(self.sync(), ["Globex lunch", "Initech offsite", "Initech review"])
+        self.assertEqual(len(self.requests), 1)
+
+    def test_expired_token_runs_a_full_resync(self):
+        google_services.save_calendar_cache({"sync_token": "expired", "time_min": "2025-01-01T00:00:00Z",
+                                             "events": {"old": event("old", "2025-02-01", "Stale meeting")}})
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(self.sync(), ["Dentist", "Globex sync", "Initech review"])
+        self.assertIn("full resync", out.getvalue())
+        self.assertEqual([r.get("syncToken") for r in self.requests], ["expired", None, None])
+        self.assertEqual(google_services.load_calendar_cache()["sync_token"], "token-1")
+
+    def test_earlier_start_than_the_cache_runs_a_full_sync(self):
+        self.sync(time_min="2025-01-01T00:00:00Z")
+        self.sync(time_min="2025-01-15T00:00:00Z")   # inside the cached window: incremental
+        self.assertEqual(self.requests[0].get("syncToken"), "token-1")
+        self.sync(time_min="2024-06-01T00:00:00Z")
+        self.assertEqual(self.requests[0].get("timeMin"), "2024-06-01T00:00:00Z")
+        self.assertNotIn("syncToken", self.requests[0])
+
+    def test_search_bounds_the_sync_by_the_lookback(self):
+        with account_config.overrides({"CALENDAR_SYNC_LOOKBACK_DAYS": 31, "COMPANY_DISPLAY_NAMES": {}}):
+            meetings = google_services.search_calendar_events(
+                self.calendar, ["Globex", "Initech"], date(2025, 2, 1), date(2025, 2, 10), incremental=True)
+        self.assertEqual(meetings, {date(2025, 2, 4): "Globex"})
+        self.assertEqual(self.requests[0]["timeMin"], "2025-01-01T00:00:00Z")
+
+
+if __name__ == "__main__":
+    unittest.main()
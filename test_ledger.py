@@ -0,0 +1,259 @@
+# test_ledger.py
+# Offline tests for the SQLite ledger and the `main.py summary` command.
+# Run with: python -m pytest test_ledger.py -v
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import account_config
+import backends
+import google_services
+import ledger
+import main
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures")
+
+FEBRUARY = date(2025, 2, 1)
+MARCH = date(2025, 3, 1)
+
+
+def per_diem_row(day, location, mie, meals):
+    return [day, location, mie, *meals, "=SUM(D12:G12)", "", "=H12", ""]
+
+
+def receipt_row(day, receipt, city, currency, amount, rate, company):
+    return [day, receipt, city, currency, "Airport to Hotel", amount, rate, "=F13/G13", company]
+
+
+PER_DIEM_ROWS = [
+    per_diem_row("2025-02-01", "Bangalore, India", 40, [9, 12, 14, 5]),
+    per_diem_row("2025-02-04", "Mumbai, India", 75, [9, 19, 33, "14"]),
+    per_diem_row("2025-02-07", "Colombo, Sri Lanka", 64, [9, 16, 28, 11]),
+    ["", "", "", "", "", "", "TOTAL PER DIEM", "=SUM(H12:H14)", "", "=J14", ""],
+]
+
+REIMBURSEMENT_ROWS = [
+    receipt_row("2025-02-04", "uber_receipt_1.pdf", "Mumbai", "INR", "1,250.00", 86.5, "Acme Widgets"),
+    receipt_row("2025-02-04", "uber_receipt_2.pdf", "Mumbai", "INR", "N/A", 86.5, "Acme Widgets"),
+    receipt_row("2025-02-07", "uber_receipt_3.pdf", "Colombo", "LKR", "3000.00", 300.0, "Globex"),
+    ["", "", "", "", "", "", "TOTAL REIMBURSEMENT", "=SUM(H13:H15)", ""],
+]
+
+MARCH_ROWS = [receipt_row("2025-03-10", "uber_receipt_4.pdf", "Bangalore", "INR", "865.00", 86.5, "Initech")]
+
+
+class LedgerTestCase(unittest.TestCase):
+    """Runs against a fresh ledger file in a temporary directory (set as LEDGER_PATH)."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ledger-test-")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = os.path.join(self.directory, "ledger.sqlite3")
+        overrides = account_config.overrides({"LEDGER_PATH": self.path})
+        overrides.__enter__()
+        self.addCleanup(overrides.__exit__, None, None, None)
+
+    def save_months(self):
+        ledger.save_month(FEBRUARY, PER_DIEM_ROWS, REIMBURSEMENT_ROWS)
+        ledger.save_month(MARCH, [], MARCH_ROWS)
+
+
+class TestSaveMonth(LedgerTestCase):
+
+    def rows(self, table):
+        with contextlib.closing(ledger.connect()) as conn:
+            return conn.execute(f"SELECT * FROM {table} ORDER BY date, rowid").fetchall()
+
+    def test_stores_rows_without_totals(self):
+        self.assertEqual(ledger.save_month(FEBRUARY, PER_DIEM_ROWS, REIMBURSEMENT_ROWS), 6)
+        per_diem = self.rows("per_diem")
+        self.assertEqual(per_diem[0], ("2025-02", "2025-02-01", "Bangalore", "India", 40.0, 9.0, 12.0, 14.0, 5.0, 40.0))
+        self.assertEqual(per_diem[2][2:4], ("Colombo", "Sri Lanka"))
+        self.assertEqual(per_diem[1][-1], 75.0)   # "14" counts as a number
+
+        reimbursements = self.rows("reimbursements")
+        self.assertEqual(len(reimbursements), 3)
+        month, day, receipt, city, currency, _, amount, rate, usd, company = reimbursements[0]
+        self.assertEqual((receipt, city, currency, company), ("uber_receipt_1.pdf", "Mumbai", "INR", "Acme Widgets"))
+        self.assertEqual((amount, rate), (1250.0, 86.5))
+        self.assertAlmostEqual(usd, 1250 / 86.5)
+        # "N/A" isn't a number, so it has no amount or dollar value
+        self.assertEqual(reimbursements[1][6:9], (None, 86.5, None))
+
+    def test_saving_a_month_again_replaces_it(self):
+        self.save_months()
+        ledger.save_month(FEBRUARY, PER_DIEM_ROWS[:1], REIMBURSEMENT_ROWS[2:])
+        self.assertEqual([row[1] for row in self.rows("per_diem")], ["2025-02-01"])
+        self.assertEqual([row[2] for row in self.rows("reimbursements")], ["uber_receipt_3.pdf", "uber_receipt_4.pdf"])
+
+    def test_empty_month(self):
+        self.assertEqual(ledger.save_month(FEBRUARY, None, None), 0)
+        self.assertEqual(self.rows("reimbursements"), [])
+
+
+class TestSummary(LedgerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.save_months()
+
+    def test_by_company_and_currency(self):
+        result = ledger.summary(date(2025, 2, 1), date(2025, 2, 28))
+        acme, globex = result["reimbursements"]
+        self.assertEqual(acme[:4], ("Acme Widgets", "INR", 2, 1250.0))
+        self.assertAlmostEqual(acme[4], 1250 / 86.5)
+        self.assertEqual(globex, ("Globex", "LKR", 1, 3000.0, 10.0))
+        # Neither grouping applies to per diem, so it's one total
+        self.assertEqual(result["per_diem_keys"], [])
+        self.assertEqual(result["per_diem"], [(3, 40.0 + 75.0 + 64.0)])
+
+    def test_by_month_quarter_and_city(self):
+        by_month = ledger.summary(date(2025, 1, 1), date(2025, 3, 31), by=["month"])
+        self.assertEqual([row[:2] for row in by_month["reimbursements"]], [("2025-02", 3), ("2025-03", 1)])
+        self.assertEqual(by_month["per_diem"], [("2025-02", 3, 179.0)])
+
+        by_quarter = ledger.summary(date(2025, 1, 1), date(2025, 12, 31), by=["quarter"])
+        self.assertEqual([row[:2] for row in by_quarter["reimbursements"]], [("2025-Q1", 4)])
+
+        by_city = ledger.summary(date(2025, 2, 1), date(2025, 3, 31), by=["city"])
+        self.assertEqual([row[:2] for row in by_city["reimbursements"]],
+                         [("Bangalore", 1), ("Colombo", 1), ("Mumbai", 2)])
+        self.assertEqual([row[:2] for row in by_city["per_diem"]], [("Bangalore", 1), ("Colombo", 1), ("Mumbai", 1)])
+
+    def test_bounds_are_inclusive(self):
+        result = ledger.summary(date(2025, 2, 4), date(2025, 2, 4), by=["company"])
+        self.assertEqual([row[:2] for row in result["reimbursements"]], [("Acme Widgets", 2)])
+        self.assertEqual(result["per_diem"], [(1, 75.0)])
+
+    def test_unknown_grouping(self):
+        with self.assertRaises(ValueError):
+            ledger.summary(FEBRUARY, MARCH, by=["weekday"])
+
+    def test_tables_show_amounts_only_by_currency(self):
+        reimbursements, per_diem = ledger.summary_tables(ledger.summary(FEBRUARY, date(2025, 3, 31)),
+                                                         ["company", "currency"])
+        self.assertEqual(reimbursements[0], ["Company", "Currency", "Receipts", "Amount", "USD"])
+        self.assertEqual(reimbursements[-1], ["Initech", "INR", 1, 865.0, 10.0])
+        self.assertEqual(per_diem, [["Per diem days", "Per diem USD"], [3, 179.0]])
+
+        by_company = ["company"]
+        reimbursements, _ = ledger.summary_tables(ledger.summary(FEBRUARY, date(2025, 3, 31), by_company), by_company)
+        self.assertEqual(reimbursements[0], ["Company", "Receipts", "USD"])
+
+
+class TestParseBound(unittest.TestCase):
+
+    def test_days_and_months(self):
+        self.assertEqual(ledger.parse_bound("2025-02-10"), date(2025, 2, 10))
+        self.assertEqual(ledger.parse_bound("2025-02-10", end=True), date(2025, 2, 10))
+        self.assertEqual(ledger.parse_bound("2025-02"), date(2025, 2, 1))
+        self.assertEqual(ledger.parse_bound("2025-02", end=True), date(2025, 2, 28))
+        self.assertEqual(ledger.parse_bound("2024-02", end=True), date(2024, 2, 29))
+        self.assertEqual(ledger.parse_bound("2025-12", end=True), date(2025, 12, 31))
+
+    def test_bad_values(self):
+        for value in ("2025", "02-2025", "2025-13", "2025-02-30", ""):
+            with self.subTest(value=value), self.assertRaises(argparse.ArgumentTypeError):
+                ledger.parse_bound(value)
+
+
+class TestSummaryCommand(LedgerTestCase):
+    """`python main.py summary ...`"""
+
+    def setUp(self):
+        super().setUp()
+        self.save_months()
+        self.requests = []
+        execute = google_services.execute
+
+        def recording_execute(request, api, operation, **kwargs):
+            self.requests.append((operation, request.params))
+            return execute(request, api, operation, **kwargs)
+
+        backend = backends.use(backends.FakeBackend(FIXTURES_DIR, mailbox=[]))
+        backend.__enter__()
+        self.addCleanup(backend.__exit__, None, None, None)
+        patcher = mock.patch("google_services.execute", recording_execute)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def summary(self, *args):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            exit_code = main.main(["summary", *args])
+        return exit_code, out.getvalue()
+
+    def test_prints_the_roll_up(self):
+        exit_code, output = self.summary("--from", "2025-02", "--to", "2025-03", "--by", "company")
+        self.assertEqual(exit_code, 0)
+        self.assertIn("Expenses from 2025-02-01 to 2025-03-31", output)
+        self.assertRegex(output, r"Acme Widgets\s+2\s+14\.45")
+        self.assertRegex(output, r"Initech\s+1\s+10\.00")
+        self.assertEqual(self.requests, [])   # no network without --sheet
+
+    def test_ledger_option(self):
+        other = os.path.join(self.directory, "other.sqlite3")
+        ledger.save_month(MARCH, [], MARCH_ROWS, path=other)
+        _, output = self.summary("--from", "2025-02", "--to", "2025-03", "--ledger", other)
+        self.assertIn(other, output)
+        self.assertIn("Initech", output)
+        self.assertNotIn("Acme Widgets", output)   # only in the LEDGER_PATH ledger
+
+    def test_bad_arguments(self):
+        for args in (["--from", "March"], ["--from", "2025-02", "--by", "weekday"], []):
+            with self.subTest(args=args), contextlib.redirect_stderr(io.StringIO()), \
+                    self.assertRaises(SystemExit) as exited:
+                self.summary(*args)
+            self.assertEqual(exited.exception.code, 2)
+
+    def test_sheet_is_written_in_one_batch(self):
+        exit_code, output = self.summary("--from", "2025-02", "--sheet", "report-sheet", "--tab", "Roll-up")
+        self.assertEqual(exit_code, 0)
+        self.assertIn("Wrote the summary to the 'Roll-up' tab", output)
+        updates = [params for operation, params in self.requests if operation == "values.batchUpdate"]
+        self.assertEqual(len(updates), 1)
+        (written,) = updates[0]["body"]["data"]
+        self.assertTrue(written["range"].startswith("Roll-up!A1:E"), written["range"])
+        self.assertEqual(written["values"][0], ["Company", "Currency", "Receipts", "Amount", "USD"])
+
+    def test_failed_sheet_write_returns_1(self):
+        execute = google_services.execute
+
+        def rejecting_execute(request, api, operation, **kwargs):
+            if operation == "values.batchUpdate":
+                raise HttpError(httplib2.Response({"status": 400}), b"bad range")
+            return execute(request, api, operation, **kwargs)
+
+        with mock.patch("google_services.execute", rejecting_execute):
+            exit_code, output = self.summary("--from", "2025-02", "--sheet", "report-sheet")
+        self.assertEqual(exit_code, 1)
+        self.assertNotIn("Wrote the summary", output)
+
+    def test_columns_past_z(self):
+        wide = [[f"c{i}" for i in range(28)]]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(ledger.write_summary_sheet("report-sheet", "Summary", wide))
+        (written,) = [params for operation, params in self.requests if operation == "values.batchUpdate"]
+        self.assertTrue(written["body"]["data"][0]["range"].startswith("Summary!A1:AB"))
+
+
+class TestColumnLetters(unittest.TestCase):
+
+    def test_round_trip(self):
+        for number, letters in [(1, "A"), (11, "K"), (26, "Z"), (27, "AA"), (28, "AB"), (52, "AZ"), (53, "BA"),
+                                (702, "ZZ"), (703, "AAA")]:
+            self.assertEqual(google_services.column_letters(number), letters)
+            self.assertEqual(google_services._column_number(letters), number)
+
+
+if __name__ == "__main__":
+    unittest.main()
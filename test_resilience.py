@@ -0,0 +1,270 @@
+# test_resilience.py
+# Offline tests for rate limiting, retries and circuit breaking.
+# Run with: python -m pytest test_resilience.py -v
+
+import contextlib
+import imaplib
+import io
+import os
+import time
+import unittest
+from unittest import mock
+
+import httplib2
+import requests
+from googleapiclient.errors import HttpError
+
+import account_config
+import backends
+import google_services
+import instrumentation
+import resilience
+
+
+def http_error(status, content=b"", **headers):
+    """A googleapiclient HttpError with this status, body and headers."""
+    return HttpError(httplib2.Response({"status": status, **headers}), content)
+
+
+def requests_error(status, **headers):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers)
+    return requests.HTTPError(response=response)
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures")
+RATE_LIMIT_403 = b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}'
+FORBIDDEN_403 = b'{"error": {"errors": [{"reason": "insufficientPermissions"}]}}'
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_waits(self):
+        bucket = resilience.TokenBucket(rate=50, burst=3)
+        self.assertEqual([bucket.acquire() for _ in range(3)], [0.0, 0.0, 0.0])
+        started = time.monotonic()
+        waited = bucket.acquire()
+        self.assertGreater(waited, 0)
+        self.assertGreaterEqual(time.monotonic() - started, waited * 0.9)
+        self.assertLess(waited, 0.1)
+
+    def test_refills_over_time(self):
+        bucket = resilience.TokenBucket(rate=100, burst=1)
+        self.assertEqual(bucket.acquire(), 0.0)
+        time.sleep(0.02)
+        self.assertEqual(bucket.acquire(), 0.0)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Closed until threshold failures in a row, open for the cooldown, then one trial call."""
+
+    def setUp(self):
+        self.breaker = resilience.CircuitBreaker("drive", threshold=2, cooldown=0.05)
+        stdout = contextlib.redirect_stdout(io.StringIO())
+        stdout.__enter__()
+        self.addCleanup(stdout.__exit__, None, None, None)
+
+    def open_breaker(self):
+        self.breaker.failed()
+        self.breaker.failed()
+        with self.assertRaises(resilience.CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_stays_closed_below_threshold(self):
+        self.breaker.failed()
+        self.breaker.before_call()
+        self.breaker.succeeded()
+        self.breaker.failed()
+        self.breaker.before_call()   # failures must be in a row
+
+    def test_opens_at_threshold(self):
+        instrumentation.reset()
+        self.open_breaker()
+        self.assertEqual(instrumentation.counters()["circuit_open.drive"], 1)
+
+    def test_trial_call_after_cooldown_closes_it(self):
+        self.open_breaker()
+        time.sleep(0.06)
+        self.breaker.before_call()   # the trial call
+        with self.assertRaises(resilience.CircuitOpenError):
+            self.breaker.before_call()   # only one at a time
+        self.breaker.succeeded()
+        self.breaker.before_call()
+        self.breaker.before_call()
+
+    def test_failed_trial_opens_it_again(self):
+        self.open_breaker()
+        time.sleep(0.06)
+        self.breaker.before_call()
+        self.breaker.failed()
+        with self.assertRaises(resilience.CircuitOpenError):
+            self.breaker.before_call()
+        time.sleep(0.06)
+        self.breaker.before_call()
+
+
+class TestErrorClassification(unittest.TestCase):
+
+    def test_is_transient(self):
+        cases = [
+            (http_error(429), True),
+            (http_error(500), True),
+            (http_error(503), True),
+            (http_error(403, RATE_LIMIT_403), True),
+            (http_error(403, FORBIDDEN_403), False),
+            (http_error(404), False),
+            (http_error(400), False),
+            (requests_error(502), True),
+            (requests_error(404), False),
+            (TimeoutError("timed out"), True),
+            (ConnectionResetError(), True),
+            (requests.ConnectionError("dropped"), True),
+            (imaplib.IMAP4.abort("socket error"), True),
+            (FileNotFoundError("credentials.json"), False),
+            (PermissionError(), False),
+            (ValueError("bad value"), False),
+        ]
+        for error, expected in cases:
+            with self.subTest(error=repr(error)):
+                self.assertEqual(resilience.is_transient(error), expected)
+
+    def test_is_rate_limited(self):
+        """Only refusals count: after a 5xx or a timeout the request may have gone through."""
+        cases = [
+            (http_error(429), True),
+            (http_error(403, RATE_LIMIT_403), True),
+            (requests_error(429), True),
+            (http_error(403, FORBIDDEN_403), False),
+            (http_error(500), False),
+            (http_error(503), False),
+            (TimeoutError("timed out"), False),
+            (ConnectionResetError(), False),
+        ]
+        for error, expected in cases:
+            with self.subTest(error=repr(error)):
+                self.assertEqual(resilience.is_rate_limited(error), expected)
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_retry_after_header(self):
+        self.assertEqual(resilience._retry_after(http_error(429, **{"retry-after": "7"})), 7.0)
+        self.assertEqual(resilience._retry_after(requests_error(429, **{"Retry-After": "2.5"})), 2.5)
+        self.assertIsNone(resilience._retry_after(http_error(429)))
+        self.assertIsNone(resilience._retry_after(http_error(429, **{"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})))
+        self.assertIsNone(resilience._retry_after(TimeoutError()))
+
+    def test_backoff_delay(self):
+        with account_config.overrides({"RETRY_BASE_DELAY": 0.01, "RETRY_MAX_DELAY": 5}):
+            for attempt in range(4):
+                self.assertTrue(0 <= resilience.backoff_delay(attempt) <= 0.01 * 2 ** attempt)
+            self.assertLessEqual(resilience.backoff_delay(30), 5)
+            # Waits at least as long as Retry-After asks, but no longer than the cap
+            self.assertEqual(resilience.backoff_delay(0, retry_after=3), 3)
+            self.assertEqual(resilience.backoff_delay(0, retry_after=100), 5)
+
+
+class FakeRequest:
+    """A googleapiclient request stand-in that raises the queued errors, then returns result."""
+
+    def __init__(self, *errors, result="ok"):
+        self.errors = list(errors)
+        self.result = result
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+class TestCall(unittest.TestCase):
+
+    def setUp(self):
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+        instrumentation.reset()
+        settings = account_config.overrides({"RETRY_BASE_DELAY": 0.001, "RETRY_ATTEMPTS": 3,
+                                             "CIRCUIT_BREAKER_THRESHOLD": 10})
+        settings.__enter__()
+        self.addCleanup(settings.__exit__, None, None, None)
+
+    def test_retries_transient_errors(self):
+        request = FakeRequest(http_error(503), TimeoutError())
+        self.assertEqual(resilience.call("test", request.execute), "ok")
+        self.assertEqual(request.calls, 3)
+        self.assertEqual(instrumentation.counters()["retries.test"], 2)
+
+    def test_gives_up_after_attempts(self):
+        request = FakeRequest(http_error(500), http_error(500), http_error(500), http_error(500))
+        with self.assertRaises(HttpError):
+            resilience.call("test", request.execute)
+        self.assertEqual(request.calls, 3)
+
+    def test_permanent_errors_are_not_retried(self):
+        request = FakeRequest(http_error(404))
+        with self.assertRaises(HttpError):
+            resilience.call("test", request.execute)
+        self.assertEqual(request.calls, 1)
+
+    def test_before_retry_runs_between_attempts(self):
+        reconnects = []
+        request = FakeRequest(imaplib.IMAP4.abort("socket error"))
+        resilience.call("test", request.execute, before_retry=lambda: reconnects.append(request.calls))
+        self.assertEqual(reconnects, [1])
+
+    def test_open_circuit_fails_fast(self):
+        """Once the breaker opens, retries stop and later calls aren't made at all."""
+        with account_config.overrides({"CIRCUIT_BREAKER_THRESHOLD": 2, "CIRCUIT_BREAKER_COOLDOWN": 60}), \
+                contextlib.redirect_stdout(io.StringIO()):
+            failing = FakeRequest(*[http_error(503)] * 3)
+            with self.assertRaises(resilience.CircuitOpenError):
+                resilience.call("flaky", failing.execute)
+            self.assertEqual(failing.calls, 2)
+            request = FakeRequest()
+            with self.assertRaises(resilience.CircuitOpenError):
+                resilience.call("flaky", request.execute)
+        self.assertEqual(request.calls, 0)
+
+    def test_non_idempotent_requests_retry_only_rate_limits(self):
+        """A file create that timed out or got a 5xx may have worked, so it isn't sent again."""
+        for error in (http_error(503), TimeoutError()):
+            request = FakeRequest(error)
+            with self.subTest(error=repr(error)), self.assertRaises(type(error)):
+                google_services.execute(request, "drive", "files.create", idempotent=False)
+            self.assertEqual(request.calls, 1)
+
+        request = FakeRequest(http_error(429), http_error(403, RATE_LIMIT_403))
+        self.assertEqual(google_services.execute(request, "drive", "files.create", idempotent=False), "ok")
+        self.assertEqual(request.calls, 3)
+
+        request = FakeRequest(http_error(503))
+        self.assertEqual(google_services.execute(request, "drive", "files.list"), "ok")
+        self.assertEqual(request.calls, 2)
+
+    def test_sheet_value_writes_are_retried(self):
+        """values.batchUpdate writes fixed ranges, so unlike a file create it is sent again after a 5xx."""
+        sheets = backends.FakeBackend(FIXTURES_DIR).google_service("sheets", "v4", None)
+        execute = backends.FakeRequest.execute
+        failures = [TimeoutError(), http_error(503)]
+        sent = []
+
+        def flaky_execute(request):
+            if request.method == "spreadsheets.values.batchUpdate":
+                sent.append(request.params["body"]["data"])
+                if failures:
+                    raise failures.pop()
+            return execute(request)
+
+        writer = google_services.SheetWriter(sheets, "report-sheet")
+        writer.add("Reimbursements", 13, "C", [["2025-02-04", "Mumbai", 30]], previous=[["2025-02-04", "Mumbai", 20]])
+        with mock.patch.object(backends.FakeRequest, "execute", flaky_execute):
+            writer.flush()
+        self.assertEqual(writer.pending, 0)
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(sent[0], sent[2])
+
+if __name__ == "__main__":
+    unittest.main()
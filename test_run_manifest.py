@@ -0,0 +1,414 @@
+# test_run_manifest.py
+# Offline tests for reusing unchanged stages and sheet rows between runs.
+# Run with: python -m pytest test_run_manifest.py -v
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+
+import account_config  # noqa: E402
+import backends  # noqa: E402
+import config  # noqa: E402
+import google_services  # noqa: E402
+import instrumentation  # noqa: E402
+import main  # noqa: E402
+import offline  # noqa: E402
+import resilience  # noqa: E402
+from pipeline import Pipeline, Reuse, Stage  # noqa: E402
+from run_manifest import RunManifest  # noqa: E402
+
+MONTH = date(2025, 2, 1)
+
+
+class TestPipelineReuse(unittest.TestCase):
+    """Stages marked with Reuse run again only when what they depend on changes."""
+
+    def setUp(self):
+        self.manifest_dir = tempfile.mkdtemp(prefix="run-manifest-test-")
+        self.overrides = account_config.overrides({"RUN_MANIFEST_DIR": self.manifest_dir, "RATE_SOURCE": "xe"})
+        self.overrides.__enter__()
+        self.calls = []
+        self.seen_emails = ["a", "b"]
+
+    def tearDown(self):
+        self.overrides.__exit__(None, None, None)
+        shutil.rmtree(self.manifest_dir, ignore_errors=True)
+
+    def stages(self):
+        def stage(name, func, **kwargs):
+            def counted(**inputs):
+                self.calls.append(name)
+                return func(**inputs)
+            return Stage(name, counted, **kwargs)
+
+        return [
+            stage("rates", lambda month: {"rate": f"{config.RATE_SOURCE}-{month}"},
+                  inputs=["month"], outputs=["rate"], reuse=Reuse(config=["RATE_SOURCE"])),
+            stage("emails", lambda month: {"emails": list(self.seen_emails)},
+                  inputs=["month"], outputs=["emails"],
+                  reuse=Reuse(probe=lambda month: self.seen_emails, keep=lambda outputs: bool(outputs["emails"]))),
+            stage("totals", lambda rate, emails: {"totals": f"{rate}:{len(emails)}"},
+                  inputs=["rate", "emails"], outputs=["totals"], reuse=Reuse()),
+            stage("rows", lambda totals: {"rows": [totals]}, inputs=["totals"], outputs=["rows"]),
+        ]
+
+    def run_pipeline(self, fresh=False):
+        self.calls = []
+        manifest = RunManifest(MONTH, fresh=fresh)
+        pipeline = Pipeline(self.stages())
+        context = pipeline.run({"month": "2025-02"}, serial=True, manifest=manifest)
+        manifest.finish(True)
+        return context, {t["stage"] for t in pipeline.timings if t["reused"]}
+
+    def test_unchanged_run_reuses_every_marked_stage(self):
+        first, _ = self.run_pipeline()
+        self.assertEqual(self.calls, ["rates", "emails", "totals", "rows"])
+        second, reused = self.run_pipeline()
+        self.assertEqual(reused, {"rates", "emails", "totals"})
+        self.assertEqual(self.calls, ["rows"])
+        self.assertEqual(second["rows"], first["rows"])
+
+    def test_config_change_reruns_dependent_stages(self):
+        self.run_pipeline()
+        with account_config.overrides({"RATE_SOURCE": "ecb"}):
+            context, reused = self.run_pipeline()
+        self.assertEqual(reused, {"emails"})
+        self.assertEqual(self.calls, ["rates", "totals", "rows"])
+        self.assertEqual(context["rows"], ["ecb-2025-02:2"])
+
+    def test_probe_change_reruns_the_stage(self):
+        """A new email reruns the stage that reads emails and the stage built on it, not the rates."""
+        self.run_pipeline()
+        self.seen_emails.append("c")
+        context, reused = self.run_pipeline()
+        self.assertEqual(reused, {"rates"})
+        self.assertEqual(self.calls, ["emails", "totals", "rows"])
+        self.assertEqual(context["rows"], ["xe-2025-02:3"])
+
+    def test_fresh_runs_everything(self):
+        self.run_pipeline()
+        _, reused = self.run_pipeline(fresh=True)
+        self.assertEqual(reused, set())
+        self.assertEqual(self.calls, ["rates", "emails", "totals", "rows"])
+        # ...and its manifest replaces the old one
+        _, reused = self.run_pipeline()
+        self.assertEqual(reused, {"rates", "emails", "totals"})
+
+    def test_outputs_not_kept_are_not_reused(self):
+        self.seen_emails = []
+        self.run_pipeline()
+        _, reused = self.run_pipeline()
+        self.assertNotIn("emails", reused)
+        self.assertIn("emails", self.calls)
+
+
+class TestSheetWriterPreviousRows(unittest.TestCase):
+    """Given the rows written last time, SheetWriter writes only the rows that changed."""
+
+    PREVIOUS = [["2025-02-01", "Bangalore", 10], ["2025-02-02", "Mumbai", 20], ["2025-02-03", "Mumbai", 20],
+                ["", "TOTAL", 50]]
+
+    def setUp(self):
+        backend = backends.FakeBackend(offline.FIXTURES_DIR)
+        self.sheets = backend.google_service("sheets", "v4", None)
+        self.requests = []
+        execute = google_services.execute
+
+        def recording_execute(request, api, operation, **kwargs):
+            self.requests.append((operation, request.params))
+            return execute(request, api, operation, **kwargs)
+
+        patcher = mock.patch("google_services.execute", recording_execute)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, values, previous):
+        writer = google_services.SheetWriter(self.sheets, "report-sheet")
+        writer.add("Reimbursements", 13, "C", values, previous=previous)
+        writer.flush()
+        self.assertEqual(writer.pending, 0)
+        return writer
+
+    def written_ranges(self):
+        return [{entry["range"]: entry["values"] for entry in params["body"]["data"]}
+                for operation, params in self.requests if operation == "values.batchUpdate"]
+
+    def test_unchanged_rows_are_not_written(self):
+        writer = self.write([list(row) for row in self.PREVIOUS], self.PREVIOUS)
+        self.assertEqual(self.requests, [])
+        self.assertEqual(writer.api_calls, 0)
+
+    def test_only_changed_rows_are_written(self):
+        values = [list(row) for row in self.PREVIOUS]
+        values[1][2] = 25
+        values[3][2] = 55
+        writer = self.write(values, self.PREVIOUS)
+        self.assertEqual(writer.api_calls, 1)
+        self.assertEqual(self.written_ranges(), [{
+            "Reimbursements!A14:C14": [["2025-02-02", "Mumbai", 25]],
+            "Reimbursements!A16:C16": [["", "TOTAL", 55]],
+        }])
+
+    def test_consecutive_changes_are_one_range_and_removed_rows_are_blanked(self):
+        values = [["2025-02-01", "Colombo", 10], ["", "TOTAL", 10]]
+        self.write(values, self.PREVIOUS)
+        self.assertEqual(self.written_ranges(), [{
+            "Reimbursements!A13:C16": [["2025-02-01", "Colombo", 10], ["", "TOTAL", 10], ["", "", ""], ["", "", ""]],
+        }])
+
+    def test_without_previous_rows_the_sheet_is_read_first(self):
+        """Unknown previous rows: one batchGet for the used rows, then the whole range, blank-padded."""
+        values = [["2025-02-04", "Mumbai", 30]]
+        writer = self.write(values, None)
+        self.assertEqual([operation for operation, _ in self.requests], ["values.batchGet", "values.batchUpdate"])
+        self.assertEqual(writer.api_calls, 2)
+        (name, written), = self.written_ranges()[0].items()
+        self.assertTrue(name.startswith("Reimbursements!A13:C"), name)
+        self.assertEqual(written[0], ["2025-02-04", "Mumbai", 30])
+        self.assertGreater(len(written), 1)
+        self.assertTrue(all(row == ["", "", ""] for row in written[1:]))
+
+
+class OfflineReportTestCase(unittest.TestCase):
+    """Runs main.main() against the benchmark fixtures, recording the Google API calls each run makes."""
+
+    def setUp(self):
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        stack.enter_context(offline.offline_environment())
+        resilience.reset()   # don't inherit breakers opened by earlier tests
+        self.metrics_path = os.path.join(config.RUN_MANIFEST_DIR, "run_metrics.json")
+
+        self.operations = []
+        execute = google_services.execute
+
+        def recording_execute(request, api, operation, **kwargs):
+            self.operations.append((operation, getattr(request, "params", {})))
+            return execute(request, api, operation, **kwargs)
+
+        stack.enter_context(mock.patch("google_services.execute", recording_execute))
+
+        self.pipelines = []
+        test = self
+
+        class RecordingPipeline(Pipeline):
+            def __init__(self, stages):
+                super().__init__(stages)
+                test.pipelines.append(self)
+
+        stack.enter_context(mock.patch("main.Pipeline", RecordingPipeline))
+
+    def run_report(self, *args, overrides=None):
+        """Runs the fixture month; returns main()'s exit code and the stages it reused."""
+        self.operations = []
+        self.pipelines = []
+        instrumentation.reset()
+        argv = ["--year", str(offline.REPORT_MONTH.year), "--month", str(offline.REPORT_MONTH.month),
+                "--metrics", self.metrics_path, *args]
+        with account_config.overrides(overrides or {}), contextlib.redirect_stdout(io.StringIO()) as output:
+            exit_code = main.main(argv)
+        self.output = output.getvalue()
+        reused = {t["stage"] for t in self.pipelines[-1].timings if t["reused"]}
+        return exit_code, reused
+
+    def count(self, operation):
+        return sum(1 for op, _ in self.operations if op == operation)
+
+    def written_ranges(self):
+        return {entry["range"]: entry["values"]
+                for op, params in self.operations if op == "values.batchUpdate"
+                for entry in params["body"]["data"]}
+
+
+REUSABLE_STAGES = {stage.name for stage in main.REPORT_STAGES if stage.reuse}
+
+
+def stages_waited_for(stage_name):
+    """The names of every REPORT_STAGES stage stage_name needs to have finished before it starts."""
+    producers = {output: stage for stage in main.REPORT_STAGES for output in stage.outputs}
+    stages = {stage.name: stage for stage in main.REPORT_STAGES}
+    waited, queue = set(), [stages[stage_name]]
+    while queue:
+        for name in queue.pop().inputs:
+            if name in producers and producers[name].name not in waited:
+                waited.add(producers[name].name)
+                queue.append(producers[name])
+    return waited
+
+
+class TestReportStages(unittest.TestCase):
+
+    def test_only_the_sheet_write_waits_for_the_template_copy(self):
+        """Receipts and uploads need the Drive folder, but not the slow template copy."""
+        for name in ("uber_receipts", "drive_uploads"):
+            self.assertIn("report_folder", stages_waited_for(name))
+            self.assertNotIn("report_sheet", stages_waited_for(name))
+        waiting = {stage.name for stage in main.REPORT_STAGES if "report_sheet" in stages_waited_for(stage.name)}
+        self.assertEqual(waiting, {"write_sheet"})
+
+
+class TestIncrementalReport(OfflineReportTestCase):
+    """A re-run of the same month reuses unchanged stages and rewrites only changed rows."""
+
+    def test_unchanged_rerun_writes_nothing(self):
+        self.assertEqual(self.run_report(), (0, set()))
+        self.assertEqual(self.count("values.batchUpdate"), 1)
+        self.assertGreater(self.count("files.create"), 0)
+
+        exit_code, reused = self.run_report()
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(reused, REUSABLE_STAGES)
+        self.assertEqual(instrumentation.counters()["manifest.reused"], len(REUSABLE_STAGES))
+        for operation in ("values.batchGet", "values.batchUpdate", "files.create", "files.copy"):
+            self.assertEqual(self.count(operation), 0, operation)
+
+    def test_changed_company_rewrites_only_affected_rows(self):
+        self.run_report()
+        full_write = self.written_ranges()
+
+        companies = {city: list(names) for city, names in config.COMPANIES.items()}
+        renamed = next(name for names in companies.values() for name in names if name.startswith("Acme"))
+        for names in companies.values():
+            names[:] = ["Acme Robotics" if name == renamed else name for name in names]
+        exit_code, reused = self.run_report(overrides={"COMPANIES": companies})
+
+        self.assertEqual(exit_code, 0)
+        # Companies only feed the row building, which always runs
+        self.assertEqual(reused, REUSABLE_STAGES)
+        self.assertEqual(self.count("values.batchUpdate"), 1)
+        self.assertEqual(self.count("files.create"), 0)
+        written = self.written_ranges()
+        self.assertTrue(written)
+        self.assertTrue(all(name.startswith("Reimbursements!") for name in written), written)
+        self.assertLess(sum(map(len, written.values())), sum(map(len, full_write.values())))
+        self.assertTrue(all(any("Acme Robotics" in str(cell) for cell in row)
+                            for rows in written.values() for row in rows), written)
+
+    def test_full_reruns_everything(self):
+        self.run_report()
+        exit_code, reused = self.run_report("--full")
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(reused, set())
+        self.assertNotIn("manifest.reused", instrumentation.counters())
+        self.assertEqual(self.count("files.copy"), 1)
+        self.assertGreater(self.count("files.create"), 0)
+        self.assertEqual(self.count("values.batchGet"), 1)
+
+    def test_partly_failed_rates_are_not_reused(self):
+        """Rates missing Sri Lanka or the LKR rate don't stop the run, but are fetched again next time."""
+        per_diem_rates = main.ProcessResources.per_diem_rates
+        exchange_rates = main.ProcessResources.exchange_rates
+
+        def without_sri_lanka(resources, year, month, country_name):
+            return None if country_name == "Sri Lanka" else per_diem_rates(resources, year, month, country_name)
+
+        def without_lkr(resources, report_month_date):
+            return {**exchange_rates(resources, report_month_date), "LKR": None}
+
+        with mock.patch("main.ProcessResources.per_diem_rates", without_sri_lanka), \
+                mock.patch("main.ProcessResources.exchange_rates", without_lkr):
+            self.assertEqual(self.run_report()[0], 0)
+
+        exit_code, reused = self.run_report()
+        self.assertEqual(exit_code, 0)
+        self.assertNotIn("per_diem_rates", reused)
+        self.assertNotIn("exchange_rates", reused)
+
+        _, reused = self.run_report()
+        self.assertIn("per_diem_rates", reused)
+        self.assertIn("exchange_rates", reused)
+
+
+class TestResume(OfflineReportTestCase):
+    """--resume carries on from the stages and uploads a failed run finished."""
+
+    FAILING_RECEIPT = "uber_receipt_20250210"
+
+    def setUp(self):
+        super().setUp()
+        self.uploads = []
+        self.failing = True
+        upload_file_to_drive = google_services.upload_file_to_drive
+
+        def flaky_upload(service, path, folder_id):
+            if self.failing and self.FAILING_RECEIPT in os.path.basename(path):
+                return None
+            self.uploads.append(os.path.basename(path))
+            return upload_file_to_drive(service, path, folder_id)
+
+        patcher = mock.patch("google_services.upload_file_to_drive", flaky_upload)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail_partway(self):
+        exit_code, _ = self.run_report()
+        self.assertEqual(exit_code, 1)
+        self.assertTrue(self.uploads)
+        self.assertFalse(any(self.FAILING_RECEIPT in name for name in self.uploads))
+        self.failing = False
+        uploaded_before = list(self.uploads)
+        self.uploads = []
+        return uploaded_before
+
+    def test_resume_skips_finished_stages_and_uploads(self):
+        uploaded_before = self.fail_partway()
+
+        exit_code, reused = self.run_report("--resume")
+        self.assertEqual(exit_code, 0)
+        self.assertGreater(instrumentation.counters().get("manifest.resumed", 0), 0)
+        # Stages without Reuse are skipped only because the failed run finished them
+        self.assertIn("calendar_meetings", reused)
+        self.assertIn("per_diem_rates", reused)
+        self.assertNotIn("uber_receipts", reused)
+        self.assertNotIn("authenticate", reused)
+        # Nothing is uploaded twice; the receipt that failed is uploaded now
+        self.assertFalse(set(uploaded_before) & set(self.uploads))
+        self.assertTrue(any(self.FAILING_RECEIPT in name for name in self.uploads))
+        self.assertEqual(self.count("files.copy"), 0)
+
+    def test_run_without_resume_ignores_checkpoints(self):
+        self.fail_partway()
+
+        exit_code, reused = self.run_report()
+        self.assertEqual(exit_code, 0)
+        self.assertNotIn("manifest.resumed", instrumentation.counters())
+        self.assertNotIn("calendar_meetings", reused)
+        self.assertNotIn("travel_calendar", reused)
+
+
+class TestFailedSheetWrite(OfflineReportTestCase):
+    """A report write the Sheets API rejects fails the run."""
+
+    def test_failed_write_returns_1(self):
+        execute = google_services.execute
+
+        def rejecting_execute(request, api, operation, **kwargs):
+            if operation == "values.batchUpdate":
+                raise HttpError(httplib2.Response({"status": 400}), b"bad range")
+            return execute(request, api, operation, **kwargs)
+
+        with mock.patch("google_services.execute", rejecting_execute):
+            exit_code, _ = self.run_report()
+        self.assertEqual(exit_code, 1)
+        self.assertIn("Could not write the report to the sheet", self.output)
+        self.assertNotIn("has been saved to Google Drive", self.output)
+
+        # The rows weren't recorded as written, so the next run writes them all
+        self.assertEqual(self.run_report()[0], 0)
+        self.assertEqual(self.count("values.batchGet"), 1)
+        self.assertEqual(self.count("values.batchUpdate"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+# test_travel_timeline.py
+# Offline tests for the nightly location timeline.
+# Run with: python -m pytest test_travel_timeline.py -v
+
+import calendar
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+
+import account_config
+import utils
+from records import Flight, HotelReservation
+from travel_timeline import TravelTimeline, load_travel_state, save_travel_state
+
+FIXTURE_PDFS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures", "pdfs")
+CITIES = ["Bangalore", "Mumbai", "Colombo", "New Delhi", "Chennai"]
+
+
+def flight(origin, destination, day, hour=9):
+    departure = datetime.combine(day, datetime.min.time()) + timedelta(hours=hour)
+    return Flight(origin, destination, day, departure, departure + timedelta(hours=2))
+
+
+def day_by_day_calendar(flights, month_date, start_day):
+    """
+    The month walk TravelTimeline replaced, kept as the reference: Bangalore
+    on start_day, then flight by flight. (Started mid-trip it forgot the
+    trip; the timeline doesn't, so compare from the 1st and slice.)
+    """
+    flights_by_date = {}
+    for f in sorted(flights, key=lambda f: f.departure):
+        flights_by_date.setdefault(f.date, []).append(f)
+
+    travel_calendar = {}
+    current_location = "Bangalore"
+    for day_num in range(start_day, calendar.monthrange(month_date.year, month_date.month)[1] + 1):
+        current_date = month_date.replace(day=day_num)
+        travel_calendar[current_date] = current_location
+        if current_date in flights_by_date:
+            last = flights_by_date[current_date][-1]
+            if "bangalore" in last.destination.lower():
+                travel_calendar[current_date] = last.origin
+                current_location = "Bangalore"
+            else:
+                travel_calendar[current_date] = last.destination
+                current_location = last.destination
+    return travel_calendar
+
+
+def month_range(month_date, start_day=1):
+    last = calendar.monthrange(month_date.year, month_date.month)[1]
+    return month_date.replace(day=start_day), month_date.replace(day=last)
+
+
+class TestTimelineMatchesDayByDay(unittest.TestCase):
+    """Within one month, the interval timeline gives the old day-by-day calendar."""
+
+    def test_benchmark_fixtures(self):
+        flights = utils.parse_flight_pdf(os.path.join(FIXTURE_PDFS, "flight_itinerary.pdf"))
+        hotel = utils.parse_hotel_reservation_pdf(os.path.join(FIXTURE_PDFS, "hotel_reservation.pdf"))
+        self.assertEqual(len(flights), 3)
+        month = date(2025, 2, 1)
+        whole_month = day_by_day_calendar(flights, month, 1)
+        for start_day in (1, 5, 10):
+            expected = {day: location for day, location in whole_month.items() if day.day >= start_day}
+            for timeline in (TravelTimeline(flights), TravelTimeline(flights, [hotel])):
+                self.assertEqual(timeline.calendar(*month_range(month, start_day)), expected)
+        # Starting on the 5th, mid-trip, the old walk had you in Bangalore
+        self.assertEqual(day_by_day_calendar(flights, month, 5)[date(2025, 2, 5)], "Bangalore")
+        self.assertEqual(TravelTimeline(flights).location_on(date(2025, 2, 5)), "Mumbai")
+
+    def test_generated_trips(self):
+        rng = random.Random(3)
+        month = date(2025, 3, 1)
+        for _ in range(200):
+            days = sorted(rng.sample(range(1, 32), rng.randint(0, 8)))
+            flights, location = [], "Bangalore"
+            for day in days:
+                destination = rng.choice([c for c in CITIES if c != location])
+                flights.append(flight(location, destination, month.replace(day=day), hour=rng.randint(0, 20)))
+                location = destination
+            with self.subTest(flights=[(f.origin, f.destination, f.date.day) for f in flights]):
+                self.assertEqual(TravelTimeline(flights).calendar(*month_range(month)),
+                                 day_by_day_calendar(flights, month, 1))
+
+
+class TestTravelTimeline(unittest.TestCase):
+
+    def test_intervals_and_bisect(self):
+        """One interval per stretch in a city; location_on finds it for any day, before or after."""
+        flights = [flight("Bangalore", "Mumbai", date(2025, 2, 3)),
+                   flight("Mumbai", "Colombo", date(2025, 2, 6)),
+                   flight("Colombo", "Bangalore", date(2025, 2, 9))]
+        timeline = TravelTimeline(flights)
+        self.assertEqual(timeline.intervals, [
+            ("Mumbai", date(2025, 2, 3), date(2025, 2, 6)),
+            ("Colombo", date(2025, 2, 6), date(2025, 2, 10)),
+            ("Bangalore", date(2025, 2, 10), None),
+        ])
+        self.assertEqual(timeline.location_on(date(2024, 12, 31)), "Bangalore")
+        self.assertEqual(timeline.location_on(date(2025, 2, 2)), "Bangalore")
+        self.assertEqual(timeline.location_on(date(2025, 2, 5)), "Mumbai")
+        self.assertEqual(timeline.location_on(date(2025, 2, 9)), "Colombo")   # flying home counts for the origin
+        self.assertEqual(timeline.location_on(date(2025, 2, 10)), "Bangalore")
+        self.assertEqual(timeline.location_on(date(2026, 1, 1)), "Bangalore")
+
+    def test_same_day_flights_and_duplicates(self):
+        """The day's last flight decides; an itinerary seen twice counts once."""
+        day = date(2025, 2, 3)
+        flights = [flight("Mumbai", "Colombo", day, hour=15), flight("Bangalore", "Mumbai", day, hour=6)]
+        timeline = TravelTimeline(flights + flights)
+        self.assertEqual(timeline.location_on(day), "Colombo")
+        self.assertEqual(timeline.location_on(day + timedelta(days=1)), "Colombo")
+
+    def test_hotel_only_nights(self):
+        """A stay without flights puts you in the hotel's city from check-in to the night before check-out."""
+        hotel = HotelReservation("Trident", "Nariman Point, Mumbai", date(2025, 2, 10), date(2025, 2, 13))
+        timeline = TravelTimeline([], [hotel])
+        self.assertEqual(timeline.location_on(date(2025, 2, 9)), "Bangalore")
+        self.assertEqual(timeline.location_on(date(2025, 2, 10)), "Mumbai")
+        self.assertEqual(timeline.location_on(date(2025, 2, 12)), "Mumbai")
+        self.assertEqual(timeline.location_on(date(2025, 2, 13)), "Bangalore")
+
+    def test_hotel_without_checkout_and_flight_days(self):
+        """A stay without a check-out date is one night; a flight on a hotel night wins."""
+        one_night = HotelReservation("Taj", "Galle Face, Colombo 03, Sri Lanka", date(2025, 2, 20))
+        self.assertEqual(TravelTimeline([], [one_night]).location_on(date(2025, 2, 21)), "Bangalore")
+
+        hotel = HotelReservation("Taj", "Galle Face, Colombo 03, Sri Lanka", date(2025, 2, 6), date(2025, 2, 10))
+        flights = [flight("Bangalore", "Colombo", date(2025, 2, 6)), flight("Colombo", "Mumbai", date(2025, 2, 8))]
+        timeline = TravelTimeline(flights, [hotel])
+        self.assertEqual(timeline.location_on(date(2025, 2, 7)), "Colombo")
+        self.assertEqual(timeline.location_on(date(2025, 2, 8)), "Mumbai")
+        self.assertEqual(timeline.location_on(date(2025, 2, 9)), "Colombo")   # back at the hotel
+        self.assertEqual(timeline.location_on(date(2025, 2, 10)), "Mumbai")
+
+
+class TestCarryOver(unittest.TestCase):
+    """The state at the end of a month starts the next month's timeline."""
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp(prefix="travel-state-test-")
+        self.overrides = account_config.overrides({"TRAVEL_STATE_DIR": self.state_dir})
+        self.overrides.__enter__()
+
+    def tearDown(self):
+        self.overrides.__exit__(None, None, None)
+        shutil.rmtree(self.state_dir, ignore_errors=True)
+
+    def test_trip_across_the_end_of_a_month(self):
+        """Flown out in January and back in February: February's run, which only sees its own flight, starts abroad."""
+        january = date(2025, 1, 1)
+        hotel = HotelReservation("Taj", "Galle Face, Colombo 03, Sri Lanka", date(2025, 1, 30), date(2025, 2, 3))
+        january_timeline = TravelTimeline([flight("Bangalore", "Colombo", date(2025, 1, 30))], [hotel])
+        save_travel_state(january, january_timeline, date(2025, 1, 31))
+
+        state = load_travel_state(january)
+        self.assertEqual(state, {
+            "date": "2025-02-01",
+            "location": "Colombo",
+            "open_stays": [{"checkin": "2025-01-30", "checkout": "2025-02-03", "city": "Colombo"}],
+        })
+
+        february = TravelTimeline([flight("Colombo", "Bangalore", date(2025, 2, 4))], carry_in=state)
+        days = february.calendar(*month_range(date(2025, 2, 1)))
+        self.assertEqual([days[date(2025, 2, d)] for d in range(1, 6)],
+                         ["Colombo", "Colombo", "Colombo", "Colombo", "Bangalore"])
+
+        # Without the carried state the same month starts at home
+        without_state = TravelTimeline([flight("Colombo", "Bangalore", date(2025, 2, 4))])
+        self.assertEqual(without_state.location_on(date(2025, 2, 1)), "Bangalore")
+
+    def test_open_stay_carries_without_flights(self):
+        """A hotel stay running past the month end still counts in the next month."""
+        state = {"date": "2025-03-01", "location": "Bangalore",
+                 "open_stays": [{"checkin": "2025-02-27", "checkout": "2025-03-03", "city": "Mumbai"}]}
+        timeline = TravelTimeline([], carry_in=state)
+        self.assertEqual(timeline.location_on(date(2025, 3, 2)), "Mumbai")
+        self.assertEqual(timeline.location_on(date(2025, 3, 3)), "Bangalore")
+
+    def test_carry_in_precedence(self):
+        """The carried-in location holds until the next flight; flights before it don't override it."""
+        state = {"date": "2025-02-01", "location": "Mumbai", "open_stays": []}
+        flights = [flight("Bangalore", "Chennai", date(2025, 1, 20)),    # older than the carried state
+                   flight("Mumbai", "New Delhi", date(2025, 2, 10))]
+        timeline = TravelTimeline(flights, carry_in=state)
+        self.assertEqual(timeline.location_on(date(2025, 1, 25)), "Chennai")
+        self.assertEqual(timeline.location_on(date(2025, 2, 1)), "Mumbai")
+        self.assertEqual(timeline.location_on(date(2025, 2, 9)), "Mumbai")
+        self.assertEqual(timeline.location_on(date(2025, 2, 10)), "New Delhi")
+        self.assertEqual(timeline.location_on(date(2025, 2, 11)), "New Delhi")
+
+    def test_carry_out_of_a_finished_trip(self):
+        timeline = TravelTimeline([flight("Bangalore", "Mumbai", date(2025, 1, 10)),
+                                   flight("Mumbai", "Bangalore", date(2025, 1, 14))])
+        self.assertEqual(timeline.carry_out(date(2025, 1, 31)),
+                         {"date": "2025-02-01", "location": "Bangalore", "open_stays": []})
+
+    def test_load_missing_or_unreadable_state(self):
+        self.assertIsNone(load_travel_state(date(2024, 12, 1)))
+        with open(os.path.join(self.state_dir, "2024-11.json"), "w", encoding="utf-8") as f:
+            f.write("{not json")
+        self.assertIsNone(load_travel_state(date(2024, 11, 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+# test_utils.py
+# Offline tests for the parsing and matching helpers in utils.
+# Run with: python -m pytest test_utils.py -v
+
+import contextlib
+import io
+import unittest
+
+import account_config
+import utils
+from records import HotelReservation
+
+CLASSIFIER_CONFIG = {
+    "HOME_AREA": "Rajajinagar",
+    # "Terminal"/"Term" and "Inn"/"Innovation" are prefixes of each other
+    "AIRPORT_KEYWORDS": ["Airport", "Terminal", "Term", "Bandaranaike"],
+    "HOTEL_KEYWORDS": ["Hotel", "Inn", "Resort", "Taj"],
+    "RESTAURANT_KEYWORDS": ["Restaurant", "Cafe", "Bistro", "Cafeteria"],
+    "COMPANIES": {
+        "Mumbai": ["Bandra Works", "Kurla Partners", "Innovation Labs"],
+        "Colombo": ["Galle Face Ltd", "Galleria Group", "Labs Colombo"],
+    },
+}
+
+HOTELS = [
+    HotelReservation("Taj Samudra", "25 Galle Face Centre Road, Colombo 03, Sri Lanka"),
+    HotelReservation("Marriott Juhu", "Juhu Tara Road, Colombo 03 Annexe, Mumbai"),
+]
+
+ADDRESSES = [
+    "1, Dr Rajkumar Rd, Rajajinagar, Bengaluru, Karnataka 560010, India",
+    "Kempegowda International Airport, Devanahalli, Bengaluru, Karnataka 560300, India",
+    "Chhatrapati Shivaji Maharaj International Terminal 2, Andheri East, Mumbai 400099, India",
+    "Termini Road, Andheri East, Mumbai 400099, India",
+    "25 Galle Face Centre Road, Colombo 03, Sri Lanka",
+    "Juhu Tara Road, Colombo 03 Annexe, Mumbai",
+    "Hotel Marriott Juhu, Juhu, Mumbai",
+    "Innovation Labs, 5 Bandra Kurla Complex, Bandra East, Mumbai 400051, India",
+    "Cafeteria, Colaba Causeway, Colaba, Mumbai 400001, India",
+    "Galleria Mall, Colombo 07, Sri Lanka",
+    "Kurla Partners, Bandra Works Estate, Mumbai",
+    "Labs Colombo, Innovation Park, Colombo 05, Sri Lanka",
+    "42 Dharmapala Mawatha, Colombo 07, Sri Lanka",
+    "",
+    None,
+]
+
+
+def classify_one_keyword_at_a_time(address, hotel_reservations):
+    """The per-keyword loop LocationClassifier replaced, kept as the reference."""
+    import config
+
+    if not address or not isinstance(address, str):
+        return "Unknown"
+    addr_lower = address.lower()
+    if config.HOME_AREA.lower() in addr_lower:
+        return "Home"
+    for keyword in config.AIRPORT_KEYWORDS:
+        if keyword.lower() in addr_lower:
+            return "Airport"
+    for hotel in hotel_reservations or []:
+        hotel_addr = (hotel.address or "").lower()
+        hotel_name = hotel.hotel_name or "Hotel"
+        addr_parts = [p.strip() for p in hotel_addr.split(",") if len(p.strip()) > 3]
+        for part in addr_parts[:2]:
+            if part in addr_lower:
+                return hotel_name
+        if hotel_name.lower() in addr_lower:
+            return hotel_name
+    for keyword in config.HOTEL_KEYWORDS:
+        if keyword.lower() in addr_lower:
+            return "Hotel"
+    for keyword in config.RESTAURANT_KEYWORDS:
+        if keyword.lower() in addr_lower:
+            return "Restaurant"
+    for city, companies in config.COMPANIES.items():
+        for company in companies:
+            for part in company.lower().split():
+                if len(part) > 3 and part in addr_lower:
+                    return company
+    city = utils.find_fare_city(address)
+    if city and city != "NA":
+        return city
+    return "Location"
+
+
+class TestLocationClassifier(unittest.TestCase):
+    """LocationClassifier gives the same answers as checking each keyword in turn."""
+
+    def test_same_as_keyword_loop(self):
+        with account_config.overrides(CLASSIFIER_CONFIG):
+            for hotels in (None, HOTELS, HOTELS[::-1]):
+                classifier = utils.LocationClassifier(hotels)
+                for address in ADDRESSES:
+                    with self.subTest(address=address, hotels=bool(hotels)):
+                        self.assertEqual(classifier.classify(address),
+                                         classify_one_keyword_at_a_time(address, hotels))
+
+    def test_prefix_keywords(self):
+        """A shorter keyword that is a prefix of a longer one found in the text still counts."""
+        with account_config.overrides(CLASSIFIER_CONFIG):
+            classifier = utils.LocationClassifier()
+            self.assertEqual(classifier.classify("Galleria Mall, Colombo 07, Sri Lanka"), "Galle Face Ltd")
+            self.assertEqual(classifier.classify("Termini Road, Andheri East, Mumbai"), "Airport")
+
+    def test_overlapping_hotel_parts(self):
+        """When two reservations match, the one listed first wins."""
+        with account_config.overrides(CLASSIFIER_CONFIG):
+            address = "Juhu Tara Road, Colombo 03 Annexe, Mumbai"
+            self.assertEqual(utils.LocationClassifier(HOTELS).classify(address), "Taj Samudra")
+            self.assertEqual(utils.LocationClassifier(HOTELS[::-1]).classify(address), "Marriott Juhu")
+
+
+class TestKeywordMatcher(unittest.TestCase):
+
+    def test_priority_not_position(self):
+        """The highest-priority keyword wins, wherever it appears in the text."""
+        matcher = utils.KeywordMatcher([("labs", "first"), ("acme labs", "second"), ("acme", "third")])
+        self.assertEqual(matcher.first("acme labs"), "first")
+        self.assertEqual(matcher.first("acme"), "third")
+        self.assertIsNone(matcher.first("globex"))
+        self.assertIsNone(utils.KeywordMatcher([]).first("anything"))
+
+
+POSTS = ["Mumbai (Bombay)", "New Delhi", "New Orleans", "Chennai (Madras)", "Bangalore", "Port Blair", "Other"]
+
+
+class TestPerDiemPostIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.rates = {post: {"total_mie": index} for index, post in enumerate(POSTS)}
+        self.index = utils.PerDiemPostIndex(self.rates)
+
+    def test_exact_names(self):
+        """Post names, the name in brackets and the name without it all match exactly."""
+        for city, post in [("Mumbai (Bombay)", "Mumbai (Bombay)"), ("Mumbai", "Mumbai (Bombay)"),
+                           ("BOMBAY", "Mumbai (Bombay)"), ("new delhi", "New Delhi"), ("Chennai", "Chennai (Madras)")]:
+            self.assertEqual(self.index.resolve(city), (post, 1.0), city)
+
+    def test_aliases(self):
+        self.assertEqual(self.index.resolve("Bengaluru"), ("Bangalore", 1.0))
+        self.assertEqual(self.index.resolve("Delhi"), ("New Delhi", 1.0))
+        with account_config.overrides({"CITY_ALIASES": {"Havelock": "Port Blair"}}):
+            self.assertEqual(utils.PerDiemPostIndex(self.rates).resolve("Havelock"), ("Port Blair", 1.0))
+
+    def test_whole_word_match_is_a_guess(self):
+        """A single shared word picks the post, but below the confidence at which it goes unreported."""
+        post, confidence = self.index.resolve("Port")
+        self.assertEqual(post, "Port Blair")
+        self.assertLess(confidence, utils.PerDiemPostIndex.CONFIDENT)
+        self.assertEqual(self.index.resolve("Blair Island"), ("Port Blair", utils.PerDiemPostIndex.WORD_MATCH_CONFIDENCE))
+        # "New" names two posts, so it isn't a whole-word match
+        self.assertNotEqual(self.index.resolve("New")[1], utils.PerDiemPostIndex.WORD_MATCH_CONFIDENCE)
+
+    def test_trigram_spelling_variants(self):
+        post, confidence = self.index.resolve("Chenai")
+        self.assertEqual(post, "Chennai (Madras)")
+        self.assertTrue(0.5 <= confidence < 1.0)
+        self.assertEqual(self.index.resolve("Banglore")[0], "Bangalore")
+        self.assertEqual(self.index.resolve("Zurich"), (None, 0.0))
+        with account_config.overrides({"PER_DIEM_MATCH_THRESHOLD": 0.9}):
+            self.assertIsNone(utils.PerDiemPostIndex(self.rates).resolve("Chenai")[0])
+
+    def test_rates_for_reports_guesses_once(self):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(self.index.rates_for("Mumbai"), self.rates["Mumbai (Bombay)"])
+            self.assertEqual(self.index.rates_for("Port"), self.rates["Port Blair"])
+            self.assertEqual(self.index.rates_for("Port"), self.rates["Port Blair"])
+            self.assertEqual(self.index.rates_for("Zurich"), self.rates["Other"])
+        warnings = out.getvalue().splitlines()
+        self.assertEqual(len(warnings), 2, warnings)
+        self.assertIn("'Port' guessed as 'Port Blair'", warnings[0])
+        self.assertIn("no per diem post matches 'Zurich'", warnings[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# test_yahoo_service.py
+# Offline tests for reading Uber receipts, against backends.FakeBackend.
+# Run with: python -m pytest test_yahoo_service.py -v
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+from unittest import mock
+
+import account_config
+import backends
+import yahoo_service
+from records import UberReceipt
+
+DAY = date(2025, 2, 3)
+
+
+def receipt_email(body, minute, day=DAY):
+    msg = MIMEText(body, "html", "utf-8")
+    msg["From"] = "Uber Receipts <noreply@uber.com>"
+    msg["Subject"] = "Your trip with Uber"
+    msg["Date"] = format_datetime(datetime(day.year, day.month, day.day, 9, minute))
+    return msg.as_bytes()
+
+
+def parse(body):
+    """Stands in for utils.parse_uber_receipt_email; bodies are "fare|pickup|dropoff"."""
+    fare, pickup, dropoff = body.split("|")
+    return UberReceipt(pickup=pickup, dropoff=dropoff, fare=Decimal(fare))
+
+
+class TestIterUberReceipts(unittest.TestCase):
+
+    def receipts(self, bodies):
+        backend = backends.FakeBackend("unused", mailbox=[receipt_email(body, i) for i, body in enumerate(bodies)])
+        with backends.use(backend), mock.patch("utils.parse_uber_receipt_email", parse):
+            # A high rate keeps every fare under $10, so nothing is rendered
+            return [(str(r.fare), r.pickup) for r in
+                    yahoo_service.iter_uber_receipts(backends.FakeIMAP(backend), DAY, usd_to_inr_rate=1000)]
+
+    def test_keeps_email_order(self):
+        """A receipt without addresses keeps its place ahead of later receipts."""
+        self.assertEqual(self.receipts(["100.00|N/A|N/A", "200.00|Home|Airport", "300.00|Airport|Hotel"]),
+                         [("100.00", "N/A"), ("200.00", "Home"), ("300.00", "Airport")])
+
+    def test_duplicates(self):
+        """A duplicate with addresses replaces one without (taking its own place); other duplicates are dropped."""
+        self.assertEqual(self.receipts(["100.00|N/A|N/A", "200.00|Home|Airport", "100.00|Hotel|Office",
+                                        "200.00|N/A|N/A", "100.00|Cafe|Home"]),
+                         [("200.00", "Home"), ("100.00", "Hotel")])
+
+    def test_streams_final_receipts(self):
+        """Receipts with addresses are yielded before the date's last email is read."""
+        backend = backends.FakeBackend("unused", mailbox=[receipt_email("100.00|Home|Airport", 0),
+                                                          receipt_email("200.00|Airport|Hotel", 1)])
+        session = backends.FakeIMAP(backend)
+        with backends.use(backend), mock.patch("utils.parse_uber_receipt_email", parse), \
+                mock.patch.object(session, "uid", wraps=session.uid) as fetch:
+            receipts = yahoo_service.iter_uber_receipts(session, DAY, usd_to_inr_rate=1000)
+            self.assertEqual(next(receipts).pickup, "Home")
+            self.assertEqual(fetch.call_count, 2)   # the search and one fetch
+            self.assertEqual(next(receipts).pickup, "Airport")
+
+
+class TestReceiptNames(unittest.TestCase):
+    """Receipt files are named by email UID, which deleting other emails doesn't change."""
+
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp(prefix="uber-receipts-test-")
+        self.addCleanup(shutil.rmtree, self.download_dir, ignore_errors=True)
+
+    def receipt_names(self, mailbox, skip_render=None):
+        def render(html_path, pdf_path, driver=None):
+            with open(pdf_path, "w") as f:
+                f.write("pdf")
+
+        backend = backends.FakeBackend("unused", mailbox=mailbox)
+        with backends.use(backend), account_config.overrides({"DOWNLOAD_DIR": self.download_dir}), \
+                mock.patch("utils.parse_uber_receipt_email", parse), mock.patch("utils.html_to_pdf_chrome", render):
+            return [os.path.basename(r.filepath) for r in yahoo_service.iter_uber_receipts(
+                backends.FakeIMAP(backend), DAY, usd_to_inr_rate=1, skip_render=skip_render)]
+
+    def test_names_survive_deleting_an_older_email(self):
+        receipts = [receipt_email("100.00|Home|Airport", 0), receipt_email("200.00|Airport|Hotel", 1)]
+        older = receipt_email("300.00|Home|Office", 0, day=DAY - timedelta(days=1))
+        names = self.receipt_names([older] + receipts)
+        self.assertEqual(len(set(names)), 2)
+        self.assertTrue(all(name.startswith("uber_receipt_20250203_") for name in names))
+        self.assertEqual(self.receipt_names(receipts), names)
+
+    def test_skip_render_sees_the_uid_name(self):
+        receipts = [receipt_email("100.00|Home|Airport", 0), receipt_email("200.00|Airport|Hotel", 1)]
+        names = self.receipt_names(receipts)
+        for name in names:
+            os.remove(os.path.join(self.download_dir, name))
+        checked = []
+
+        def already_uploaded(pdf_path):
+            checked.append(os.path.basename(pdf_path))
+            return os.path.basename(pdf_path) == names[0]
+
+        self.assertEqual(self.receipt_names(receipts, skip_render=already_uploaded), names)
+        self.assertEqual(checked, names)
+        self.assertEqual(os.listdir(self.download_dir), [names[1]])
+
+    def test_email_gone_before_fetch_is_skipped(self):
+        backend = backends.FakeBackend("unused", mailbox=[receipt_email("100.00|Home|Airport", 0)])
+        session = backends.FakeIMAP(backend)
+        with backends.use(backend), mock.patch("utils.parse_uber_receipt_email", parse), \
+                mock.patch("yahoo_service.search_uber_receipt_ids", return_value=[b"999"]), \
+                contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(list(yahoo_service.iter_uber_receipts(session, DAY, usd_to_inr_rate=1000)), [])
+        self.assertIn("no longer in the mailbox", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
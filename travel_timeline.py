@@ -0,0 +1,183 @@
+# travel_timeline.py
+# Where I was each night, as a sorted list of (location, start, end) intervals
+# built once from every flight leg and hotel stay in the Gmail search window.
+#
+# The rules are the ones the report has always used for a single month:
+#   - on a flight day the night is spent at the destination of the day's last
+#     flight, except on the way home, when the day counts for the city flown from;
+#   - after a flight you stay at its destination until the next flight;
+#   - a hotel stay (check-in to the night before check-out) puts you in the
+#     hotel's city on the nights without a flight.
+# Because the timeline covers the whole window, a trip that starts in one
+# report month and ends in the next carries over, and the same timeline
+# answers for every month of a multi-month run.
+#
+# The state at the end of each report month (where you are and any hotel stay
+# still open) is saved under config.TRAVEL_STATE_DIR (.travel_state by
+# default). The next month's timeline starts from it, so a trip booked before
+# the Gmail search window still carries over.
+
+import json
+import os
+from bisect import bisect_right
+from datetime import date, timedelta
+
+import config
+import utils
+
+HOME = "Bangalore"
+
+
+class TravelTimeline:
+    """
+    Args:
+        flights: Flight legs as returned by utils.parse_flight_pdf, any months, any order.
+        hotel_reservations: Stays as returned by utils.parse_hotel_reservation_pdf.
+        home: Where you are when not travelling.
+        carry_in: State saved at the end of the previous month (see carry_out),
+            used until the first flight found after it.
+    """
+
+    def __init__(self, flights=(), hotel_reservations=(), home=HOME, carry_in=None):
+        self.home = home
+        self._carry_in = None
+        if carry_in:
+            self._carry_in = (date.fromisoformat(carry_in["date"]), carry_in["location"])
+        self._flight_days = {}
+        seen = set()
+        for flight in sorted(flights, key=lambda f: f.departure):
+            key = (flight.origin, flight.destination, flight.departure)
+            if key in seen:   # the same itinerary can arrive in more than one email
+                continue
+            seen.add(key)
+            self._flight_days[flight.date] = flight   # last flight of the day wins
+        self._flight_dates = sorted(self._flight_days)
+
+        known_cities = {city for f in self._flight_days.values() for city in (f.origin, f.destination)}
+        self._stays = []
+        for hotel in hotel_reservations or ():
+            if not hotel or not hotel.checkin_date:
+                continue
+            checkin = hotel.checkin_date
+            checkout = hotel.checkout_date or checkin + timedelta(days=1)
+            if checkout > checkin:
+                self._stays.append((checkin, checkout, _hotel_city(hotel, known_cities)))
+        for stay in (carry_in or {}).get("open_stays", []):
+            self._stays.append((date.fromisoformat(stay["checkin"]), date.fromisoformat(stay["checkout"]), stay["city"]))
+        self._stays = sorted(set(self._stays))
+
+        self.intervals = self._build_intervals()
+        self._starts = [start for _, start, _ in self.intervals]
+
+    def _is_home(self, city):
+        return self.home.lower() in city.lower()
+
+    def _after_flight(self, flight):
+        return self.home if self._is_home(flight.destination) else flight.destination
+
+    def _location_at_boundary(self, day):
+        """The layered rule for one day; only used while building the intervals."""
+        flight = self._flight_days.get(day)
+        if flight:
+            return flight.origin if self._is_home(flight.destination) else flight.destination
+        for checkin, checkout, city in self._stays:
+            if checkin <= day < checkout:
+                return city
+        return self._resting_location(day)
+
+    def _resting_location(self, day):
+        """Where the last flight on or before day (or the carried-in state, if newer) left you."""
+        index = bisect_right(self._flight_dates, day) - 1
+        last_flight_date = self._flight_dates[index] if index >= 0 else None
+        if self._carry_in and self._carry_in[0] <= day and (
+                last_flight_date is None or last_flight_date < self._carry_in[0]):
+            return self._carry_in[1]
+        if last_flight_date is None:
+            return self.home
+        return self._after_flight(self._flight_days[last_flight_date])
+
+    def _build_intervals(self):
+        """
+        The location only changes on a flight day, the day after one, a
+        check-in or a check-out, so it is worked out once per boundary and
+        holds until the next. The last interval is open-ended (end None).
+        """
+        boundaries = {self._carry_in[0]} if self._carry_in else set()
+        for day in self._flight_dates:
+            boundaries.update((day, day + timedelta(days=1)))
+        for checkin, checkout, _ in self._stays:
+            boundaries.update((checkin, checkout))
+
+        intervals = []
+        for day in sorted(boundaries):
+            location = self._location_at_boundary(day)
+            if intervals and intervals[-1][0] == location:
+                continue
+            if intervals:
+                intervals[-1] = (intervals[-1][0], intervals[-1][1], day)
+            intervals.append((location, day, None))
+        return intervals
+
+    def location_on(self, day):
+        """Where the night of day was spent (home before the first trip)."""
+        index = bisect_right(self._starts, day) - 1
+        if index < 0:
+            return self.home
+        return self.intervals[index][0]
+
+    def calendar(self, start, end):
+        """{date: location} for every day from start to end, inclusive."""
+        days = {}
+        day = start
+        while day <= end:
+            days[day] = self.location_on(day)
+            day += timedelta(days=1)
+        return days
+
+    def carry_out(self, last_day):
+        """The state to start the day after last_day from: where you are, and stays running past it."""
+        next_day = last_day + timedelta(days=1)
+        return {
+            "date": next_day.isoformat(),
+            "location": self._resting_location(last_day),
+            "open_stays": [
+                {"checkin": checkin.isoformat(), "checkout": checkout.isoformat(), "city": city}
+                for checkin, checkout, city in self._stays
+                if checkin <= last_day and checkout > next_day
+            ],
+        }
+
+
+def _hotel_city(hotel, known_cities):
+    """The city of a hotel: a city flown to or from if the address names one, else the address's city part."""
+    address = hotel.address or ""
+    for city in sorted(known_cities, key=len, reverse=True):
+        if city and city.lower() in address.lower():
+            return city
+    return utils.find_fare_city(address)
+
+
+def _state_path(month_date):
+    return os.path.join(getattr(config, "TRAVEL_STATE_DIR", ".travel_state"), f"{month_date:%Y-%m}.json")
+
+
+def load_travel_state(month_date):
+    """The state saved at the end of month_date's month, or None."""
+    path = _state_path(month_date)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable travel state {path}: {e}")
+        return None
+
+
+def save_travel_state(month_date, timeline, last_day):
+    """Saves the state at last_day, the end of month_date's month, for the next month's run."""
+    path = _state_path(month_date)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(timeline.carry_out(last_day), f, indent=2)
+    if config.DEBUG_MODE: print(f"Saved end-of-month travel state to {path}")
@@ -1,58 +1,126 @@
 # utils.py
 # Utility functions for parsing data, and now, for scraping per diem rates.
+# Selenium, pdfplumber, BeautifulSoup and dateutil are imported inside the
+# functions that use them, so `python main.py --help` doesn't pay for them.
 
 import re
-import pdfplumber
 import calendar
+import backends
 import config
+import instrumentation
+import resilience
+from records import Currency, Flight, HotelReservation, UberReceipt, parse_amount
 import time
 from datetime import datetime
-from bs4 import BeautifulSoup
-from dateutil.parser import parse as parse_date
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import Select, WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+from functools import lru_cache
+from contextlib import contextmanager
+import queue
+import threading
 import os
 import base64
-import requests
 from datetime import date
+from urllib.parse import urlparse
+
+def create_pdf_driver():
+    """Starts a headless Chrome set up for printing pages to PDF."""
+    from selenium import webdriver
 
-def html_to_pdf_chrome(html_path, pdf_path):
     chrome_options = webdriver.ChromeOptions()
     chrome_options.add_argument("--headless=new")  # headless mode
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--kiosk-printing")
 
-    driver = webdriver.Chrome(options=chrome_options)
+    instrumentation.count("chrome.launches")
+    with instrumentation.timer("chrome.launch", "chrome"):
+        return backends.current().chrome(chrome_options)
+
+class DriverPool:
+    """
+    A bounded pool of Chrome drivers shared by concurrent report runs.
+    Drivers are started on first demand (up to size) and handed back for reuse.
+    """
+
+    def __init__(self, factory, size=1):
+        self._factory = factory
+        self._size = size
+        self._idle = queue.LifoQueue()
+        self._created = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def driver(self):
+        """Checks out a driver for the duration of the with-block."""
+        driver = None
+        with self._lock:
+            if self._idle.empty() and len(self._created) < self._size:
+                driver = self._factory()
+                self._created.append(driver)
+        if driver is None:
+            driver = self._idle.get()
+        try:
+            yield driver
+        finally:
+            self._idle.put(driver)
+
+    def close(self):
+        with self._lock:
+            for driver in self._created:
+                driver.quit()
+            self._created = []
+            self._idle = queue.LifoQueue()
+
+def html_to_pdf_chrome(html_path, pdf_path, driver=None):
+    """
+    Renders an HTML file to an A4 PDF with headless Chrome.
+    Pass a driver from create_pdf_driver() to reuse one browser for many
+    receipts; otherwise a browser is started and closed for this file.
+    """
+    own_driver = driver is None
+    if own_driver:
+        driver = create_pdf_driver()
 
     file_url = "file://" + os.path.abspath(html_path)
-    driver.get(file_url)
-
-    # Tell Chrome to print to PDF via DevTools
-    result = driver.execute_cdp_cmd(
-        "Page.printToPDF",
-        {
-            "printBackground": True,  # keep CSS background colors
-            "landscape": False,
-            "scale": 1,
-            "paperWidth": 8.27,  # A4
-            "paperHeight": 11.69,  # A4
-        }
-    )
+    instrumentation.count("chrome.pdf_renders")
+    with instrumentation.timer("chrome.print_to_pdf", "chrome"):
+        driver.get(file_url)
+
+        # Tell Chrome to print to PDF via DevTools
+        result = driver.execute_cdp_cmd(
+            "Page.printToPDF",
+            {
+                "printBackground": True,  # keep CSS background colors
+                "landscape": False,
+                "scale": 1,
+                "paperWidth": 8.27,  # A4
+                "paperHeight": 11.69,  # A4
+            }
+        )
 
     pdf_data = base64.b64decode(result['data'])
     with open(pdf_path, "wb") as f:
         f.write(pdf_data)
 
-    driver.quit()
+    if own_driver:
+        driver.quit()
+
+def http_get_json(url, params=None):
+    """GETs a JSON document, counting and timing the request (rate limited and retried per host)."""
+    host = urlparse(url).netloc
+
+    def attempt():
+        instrumentation.count("http.requests")
+        with instrumentation.timer(f"http.{host}", "http"):
+            return backends.current().http_get(url, params=params)
+
+    response = resilience.call("http", attempt, key=host)
+    instrumentation.count("bytes.http", len(response.content))
+    return response.json()
+
 def get_usd_to_inr_rate(report_date):
     url = f"https://api.frankfurter.app/{report_date.isoformat()}"
     params = {"from": "USD", "to": "INR"}
-    return requests.get(url, params=params).json()["rates"]["INR"]
+    return http_get_json(url, params=params)["rates"]["INR"]
 
 def get_exchange_rates(report_date):
     """
@@ -66,7 +134,7 @@ def get_exchange_rates(report_date):
     try:
         url = f"https://api.frankfurter.app/{report_date.isoformat()}"
         params = {"from": "USD", "to": "INR"}
-        response = requests.get(url, params=params).json()
+        response = http_get_json(url, params=params)
         rates["INR"] = response.get("rates", {}).get("INR")
     except Exception as e:
         if config.DEBUG_MODE:
@@ -75,7 +143,7 @@ def get_exchange_rates(report_date):
     # Get LKR rate from open.er-api.com (latest rates only, but supports LKR)
     try:
         url = "https://open.er-api.com/v6/latest/USD"
-        response = requests.get(url).json()
+        response = http_get_json(url)
         if response.get("result") == "success":
             rates["LKR"] = response.get("rates", {}).get("LKR")
     except Exception as e:
@@ -89,6 +157,13 @@ def get_usd_to_inr_rate_old(report_date):
     Gets the USD to INR conversion rate for a specific date.
     Uses the middle of the month for a stable average.
     """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from webdriver_manager.chrome import ChromeDriverManager
+
     url = "https://www.oanda.com/currency-converter/en/?from=USD&to=INR&amount=1"
     rates = {}
     
@@ -98,6 +173,7 @@ def get_usd_to_inr_rate_old(report_date):
     #options.add_argument('--headless') # Run in background without opening a browser window
     options.add_argument('--no-sandbox')
     options.add_argument('--disable-dev-shm-usage')
+    instrumentation.count("chrome.launches")
     driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
     wait = WebDriverWait(driver, 15) # Wait for up to 15 seconds
 
@@ -124,23 +200,66 @@ def get_mie_breakdown():
     return config.MIE_BREAKDOWN
 
 
-def get_per_diem_rates_with_selenium(year, month, country_name="India"):
-    """
-    Uses Selenium to navigate the US State Dept website and scrape per diem rates.
-    """
-    url = "https://allowances.state.gov/web920/per_diem.asp"
-    rates = {}
-    
-    # Setup Selenium WebDriver
+def create_scraper_driver():
+    """Starts the headless Chrome used to scrape the per diem website."""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+
     options = webdriver.ChromeOptions() 
     options.page_load_strategy = 'normal' # As requested, for faster interaction
     options.add_argument('--headless') # Run in background without opening a browser window
     options.add_argument('--no-sandbox')
     options.add_argument('--disable-dev-shm-usage')
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    instrumentation.count("chrome.launches")
+    with instrumentation.timer("chrome.launch", "chrome"):
+        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    driver.set_page_load_timeout(getattr(config, "PAGE_LOAD_TIMEOUT", 60))
+    return driver
+
+def parse_per_diem_table(page_html):
+    """
+    Reads the rates table from a per diem results page.
+    Returns {post name: {"lodging", "total_mie"}}, or None if the page has no rates table.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page_html, 'html.parser')
+    rows = [td.parent for td in soup.find_all('td', title='Country Name')]
+    if not rows:
+        return None
+    rates = {}
+    for row in rows:
+        cols = [" ".join(td.get_text(" ").split()) for td in row.find_all('td')]
+        if len(cols) >= 6:
+            post_name = cols[1] # "Post Name" is the second column
+            lodging = int(cols[4])
+            mie = int(cols[5])
+            rates[post_name] = {"lodging": lodging, "total_mie": mie}
+    return rates
+
+def fetch_per_diem_page(year, month, country_name="India", driver=None):
+    """
+    Uses Selenium to navigate the US State Dept website to the per diem rates
+    for one country and month, and returns the results page HTML (None on failure).
+    Pass a driver from create_scraper_driver() to reuse one browser across
+    countries and months; otherwise a browser is started and closed here.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import Select, WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+
+    url = "https://allowances.state.gov/web920/per_diem.asp"
+    
+    # Setup Selenium WebDriver
+    own_driver = driver is None
+    if own_driver:
+        driver = create_scraper_driver()
     wait = WebDriverWait(driver, 15) # Wait for up to 15 seconds
+    scrape_started = time.perf_counter()
 
-    try:
+    def navigate():
         if config.DEBUG_MODE: print(f"Navigating to per diem website for {calendar.month_name[month]} {year}...")
         driver.get(url)
         
@@ -165,36 +284,53 @@ def get_per_diem_rates_with_selenium(year, month, country_name="India"):
         go_button_2 = month_dropdown_element.find_element(By.XPATH, "../following-sibling::td/input")
         go_button_2.click()
         
-        # Now scrape the final table, waiting for it to be present
+        # Now wait for the final table to be present
         wait.until(EC.presence_of_element_located((By.XPATH, "//td[@title='Country Name']/..")))
-        rows = driver.find_elements(By.XPATH, "//td[@title='Country Name']/..")
-        if not rows:
-            print("Error: Per diem rates table not found on the final page.")
-            return None
-        for row in rows:
-            cols = row.find_elements(By.TAG_NAME, 'td')
-            if len(cols) >= 6:
-                post_name = cols[1].text # "Post Name" is the second column
-                lodging = int(cols[4].text)
-                mie = int(cols[5].text)
-                rates[post_name] = {"lodging": lodging, "total_mie": mie}
-        
-        if config.DEBUG_MODE: print(f"Successfully scraped per diem rates for {len(rates)} locations in {country_name}.")
-        return rates
+        return driver.page_source
 
+    def retryable(error):
+        # A page that didn't load in time is retried; a missing country or month isn't
+        return isinstance(error, TimeoutException) or resilience.is_transient(error)
+
+    try:
+        return resilience.call("per_diem", navigate, retryable=retryable, attempts=3)
     except Exception as e:
         print(f"An error occurred during Selenium scraping: {e}")
         return None
     finally:
-        driver.quit()
+        instrumentation.record(f"per_diem.scrape.{country_name}", "scrape", scrape_started, time.perf_counter() - scrape_started)
+        if own_driver:
+            driver.quit()
+
+def get_per_diem_rates_with_selenium(year, month, country_name="India", driver=None):
+    """
+    Scrapes the per diem rates for one country and month (see fetch_per_diem_page).
+    Returns {post name: {"lodging", "total_mie"}} or None.
+    """
+    page = fetch_per_diem_page(year, month, country_name, driver=driver)
+    if page is None:
+        return None
+    return rates_from_per_diem_page(page, country_name)
+
+def rates_from_per_diem_page(page, country_name):
+    """parse_per_diem_table() with the scraper's error and debug messages."""
+    rates = parse_per_diem_table(page)
+    if rates is None:
+        print("Error: Per diem rates table not found on the final page.")
+        return None
+    if config.DEBUG_MODE: print(f"Successfully scraped per diem rates for {len(rates)} locations in {country_name}.")
+    return rates
 
 def parse_hotel_reservation_pdf(pdf_path):
     """
     Parses a hotel reservation PDF to extract hotel details.
-    Returns dict with hotel_name, address, checkin_date, checkout_date or None if not a hotel PDF.
+    Returns a HotelReservation, or None if not a hotel PDF.
     """
+    import pdfplumber
+
     try:
         with pdfplumber.open(pdf_path) as pdf:
+            instrumentation.count("pdfplumber.pages", len(pdf.pages))
             full_text = ""
             for page in pdf.pages:
                 page_text = page.extract_text()
@@ -244,7 +380,7 @@ def parse_hotel_reservation_pdf(pdf_path):
             if hotel_info.get("hotel_name") and hotel_info.get("address"):
                 if config.DEBUG_MODE:
                     print(f"  -> Found hotel reservation: {hotel_info['hotel_name']} at {hotel_info['address']}")
-                return hotel_info
+                return HotelReservation(**hotel_info)
 
     except Exception as e:
         if config.DEBUG_MODE:
@@ -256,10 +392,14 @@ def parse_hotel_reservation_pdf(pdf_path):
 def parse_flight_pdf(pdf_path):
     """
     Parses a flight confirmation PDF to extract travel details for all flight legs.
+    Returns a list of Flight records.
     """
+    import pdfplumber
+
     flights = []
     try:
         with pdfplumber.open(pdf_path) as pdf:
+            instrumentation.count("pdfplumber.pages", len(pdf.pages))
             full_text = ""
             for page in pdf.pages:
                 page_text = page.extract_text()
@@ -285,29 +425,70 @@ def parse_flight_pdf(pdf_path):
                 arr_datetime = datetime.strptime(f"{date_str} {arr_time_str}", datetime_format)
                 if config.DEBUG_MODE: print(f"  -> Found flight in PDF: {from_city} to {to_city} on {dep_datetime} to {arr_datetime}")
 
-                flights.append({
-                    "from": from_city,
-                    "to": to_city,
-                    "date": dep_datetime.date(),
-                    "departure": dep_datetime,
-                    "arrival": arr_datetime
-                })
+                flights.append(Flight(
+                    origin=from_city,
+                    destination=to_city,
+                    date=dep_datetime.date(),
+                    departure=dep_datetime,
+                    arrival=arr_datetime,
+                ))
         return flights
     except Exception as e:
         print(f"Error parsing PDF file {pdf_path}: {e}")
         return []
 
     
-def classify_location(address, travel_city=None, hotel_reservations=None):
+class KeywordMatcher:
     """
-    Classifies an address into a meaningful location name.
+    Matches many keywords against a string with one compiled regex.
 
-    Args:
-        address: The address string to classify
-        travel_city: Optional city context for the trip
-        hotel_reservations: Optional list of hotel dicts with 'hotel_name' and 'address' keys
+    Entries are (keyword, result) pairs in priority order; first() returns the
+    result of the highest-priority keyword found anywhere in the text, exactly
+    as checking each keyword in turn with `in` would.
+    """
+
+    def __init__(self, entries):
+        self._priority = {}
+        for index, (keyword, result) in enumerate(entries):
+            keyword = keyword.lower()
+            if keyword and keyword not in self._priority:
+                self._priority[keyword] = (index, result)
+
+        keywords = sorted(self._priority, key=len, reverse=True)
+        # A lookahead finds a match starting at every position, so overlapping
+        # keywords are not hidden by each other.
+        self._pattern = re.compile("(?=(" + "|".join(map(re.escape, keywords)) + "))") if keywords else None
+        # Shorter keywords that are a prefix of a longer one start at the same
+        # position and would be shadowed by it, so remember them per keyword.
+        self._prefixes = {
+            kw: [other for other in keywords if kw.startswith(other)]
+            for kw in keywords
+        }
 
-    Returns one of:
+    def first(self, text):
+        if not self._pattern:
+            return None
+        best = None
+        for match in self._pattern.finditer(text):
+            for keyword in self._prefixes[match.group(1)]:
+                candidate = self._priority[keyword]
+                if best is None or candidate[0] < best[0]:
+                    best = candidate
+                    if best[0] == 0:
+                        return best[1]
+        return best[1] if best else None
+
+
+class LocationClassifier:
+    """
+    Classifies Uber pickup/drop-off addresses into meaningful location names.
+
+    Built once per run from config and the month's hotel reservations: keyword
+    lists, hotel address parts and company name parts are lowercased and compiled
+    up front, and results are memoised per address since the same home, airport
+    and hotel addresses repeat all month.
+
+    Checks, in priority order:
     - "Home" (if in Rajajinagar)
     - "Airport" (if contains airport keywords)
     - Hotel name (if matches a hotel reservation address)
@@ -316,63 +497,200 @@ def classify_location(address, travel_city=None, hotel_reservations=None):
     - Company name (if matches a known company location)
     - City name (fallback)
     """
-    if not address or not isinstance(address, str):
-        return "Unknown"
 
-    addr_lower = address.lower()
+    def __init__(self, hotel_reservations=None, cache_size=1024):
+        self._home = config.HOME_AREA.lower()
+        self._airport = KeywordMatcher((keyword, "Airport") for keyword in config.AIRPORT_KEYWORDS)
+
+        hotel_entries = []
+        for hotel in hotel_reservations or []:
+            hotel_addr = (hotel.address or "").lower()
+            hotel_name = hotel.hotel_name or "Hotel"
+            # Key parts of the hotel address: first 2 parts are usually street and area
+            addr_parts = [p.strip() for p in hotel_addr.split(",") if len(p.strip()) > 3]
+            for part in addr_parts[:2]:
+                hotel_entries.append((part, hotel_name))
+            # Also match the hotel name itself appearing in the address
+            hotel_entries.append((hotel_name, hotel_name))
+        self._hotel = KeywordMatcher(hotel_entries)
 
-    # Check for Home (Rajajinagar)
-    if config.HOME_AREA.lower() in addr_lower:
-        return "Home"
+        self._hotel_keywords = KeywordMatcher((keyword, "Hotel") for keyword in config.HOTEL_KEYWORDS)
+        self._restaurant = KeywordMatcher((keyword, "Restaurant") for keyword in config.RESTAURANT_KEYWORDS)
 
-    # Check for Airport
-    for keyword in config.AIRPORT_KEYWORDS:
-        if keyword.lower() in addr_lower:
-            return "Airport"
+        # Known companies (all cities): any word of the name longer than 3 characters
+        company_entries = []
+        for city, companies in config.COMPANIES.items():
+            for company in companies:
+                for part in company.lower().split():
+                    if len(part) > 3:
+                        company_entries.append((part, company))
+        self._company = KeywordMatcher(company_entries)
 
-    # Check for specific hotel from reservations (by address match)
-    if hotel_reservations:
-        for hotel in hotel_reservations:
-            hotel_addr = hotel.get("address", "").lower()
-            hotel_name = hotel.get("hotel_name", "Hotel")
-            # Check if key parts of the hotel address match
-            # Extract street/road name for matching
-            addr_parts = [p.strip() for p in hotel_addr.split(",") if len(p.strip()) > 3]
-            for part in addr_parts[:2]:  # Check first 2 parts (usually street and area)
-                if part in addr_lower:
-                    return hotel_name
-            # Also check if hotel name appears in address
-            if hotel_name.lower() in addr_lower:
-                return hotel_name
-
-    # Check for generic Hotel keywords
-    for keyword in config.HOTEL_KEYWORDS:
-        if keyword.lower() in addr_lower:
-            return "Hotel"
-
-    # Check for Restaurant
-    for keyword in config.RESTAURANT_KEYWORDS:
-        if keyword.lower() in addr_lower:
-            return "Restaurant"
-
-    # Check for known companies (search all cities)
-    for city, companies in config.COMPANIES.items():
-        for company in companies:
-            # Check if company name or part of it is in the address
-            company_parts = company.lower().split()
-            for part in company_parts:
-                if len(part) > 3 and part in addr_lower:
-                    return company
-
-    # Fallback: return the city from the address
-    city = find_fare_city(address)
-    if city and city != "NA":
-        return city
-
-    return "Location"
-
-
-def generate_uber_description(from_address, to_address, travel_city=None, hotel_reservations=None):
+        self._stages = [self._airport, self._hotel, self._hotel_keywords, self._restaurant, self._company]
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, address):
+        if not address or not isinstance(address, str):
+            return "Unknown"
+
+        addr_lower = address.lower()
+
+        if self._home in addr_lower:
+            return "Home"
+
+        for matcher in self._stages:
+            result = matcher.first(addr_lower)
+            if result:
+                return result
+
+        # Fallback: return the city from the address
+        city = find_fare_city(address)
+        if city and city != "NA":
+            return city
+
+        return "Location"
+
+
+# Other names flight itineraries use for cities with a State Dept post.
+# config.CITY_ALIASES (optional) adds to these.
+CITY_ALIASES = {
+    "bengaluru": "bangalore",
+    "bombay": "mumbai",
+    "madras": "chennai",
+    "calcutta": "kolkata",
+    "delhi": "new delhi",
+    "gurgaon": "new delhi",
+    "gurugram": "new delhi",
+    "noida": "new delhi",
+    "poona": "pune",
+    "cochin": "kochi",
+    "trivandrum": "thiruvananthapuram",
+}
+
+
+def _normalise_place(name):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", name.lower()).split())
+
+
+def _trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PerDiemPostIndex:
+    """
+    Finds the State Dept per diem post for a city name from a flight itinerary,
+    e.g. "Bombay" or "Mumbai" for "Mumbai (Bombay)", "Delhi" for "New Delhi".
+
+    Built once per rate table: post names are normalised (lowercase, no
+    punctuation, and a name in brackets becomes a name of its own), and indexed
+    by name, token and character trigram. A city is tried, in order, as an exact
+    name, through CITY_ALIASES, by whole words and by trigram similarity of at
+    least config.PER_DIEM_MATCH_THRESHOLD (default 0.5). Anything else gets the
+    "Other" rate. Results are memoised; guesses and fallbacks are reported once.
+    """
+
+    # Matches below this confidence are printed as guesses. A whole-word match
+    # is always one: a single shared word ("port", "new") can name the wrong post.
+    CONFIDENT = 0.8
+    WORD_MATCH_CONFIDENCE = 0.7
+
+    def __init__(self, per_diem_rates, cache_size=256):
+        self._rates = per_diem_rates
+        self._names = {}
+        self._tokens = {}
+        self._trigram_index = None   # built on the first lookup that needs it
+        for post in per_diem_rates:
+            if post == "Other":
+                continue
+            variants = [post] + re.findall(r"\(([^)]*)\)", post) + [re.sub(r"\([^)]*\)", " ", post)]
+            for variant in variants:
+                name = _normalise_place(variant)
+                if not name or name in self._names:
+                    continue
+                self._names[name] = post
+            for token in _normalise_place(post).split():
+                self._tokens.setdefault(token, set()).add(post)
+
+        self._aliases = dict(CITY_ALIASES)
+        self._aliases.update({_normalise_place(k): _normalise_place(v)
+                              for k, v in getattr(config, "CITY_ALIASES", {}).items()})
+        self._threshold = getattr(config, "PER_DIEM_MATCH_THRESHOLD", 0.5)
+        self._reported = set()
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _resolve(self, city):
+        """Returns (post name or None, confidence between 0 and 1)."""
+        name = _normalise_place(city or "")
+        if not name:
+            return None, 0.0
+        if name in self._names:
+            return self._names[name], 1.0
+        alias = self._aliases.get(name)
+        if alias in self._names:
+            return self._names[alias], 1.0
+
+        # Whole words: "Delhi" -> "New Delhi", "Colombo 03" -> "Colombo"
+        candidates = set()
+        for token in name.split():
+            candidates |= self._tokens.get(token, set())
+        if len(candidates) == 1:
+            return candidates.pop(), self.WORD_MATCH_CONFIDENCE
+
+        # Spelling variants: Dice similarity of character trigrams, over names sharing one
+        if self._trigram_index is None:
+            self._name_trigrams = {known: _trigrams(known) for known in self._names}
+            trigram_index = {}
+            for known, known_grams in self._name_trigrams.items():
+                for gram in known_grams:
+                    trigram_index.setdefault(gram, set()).add(known)
+            self._trigram_index = trigram_index
+        grams = _trigrams(name)
+        shared = {}
+        for gram in grams:
+            for candidate in self._trigram_index.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        best_name, best_score = None, 0.0
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + len(self._name_trigrams[candidate]))
+            if score > best_score:
+                best_name, best_score = candidate, score
+        if best_score >= self._threshold:
+            return self._names[best_name], best_score
+        return None, best_score
+
+    def rates_for(self, city):
+        """The rates for city's post, or the "Other" rates (None if there are none)."""
+        post, confidence = self.resolve(city)
+        if post is None:
+            if city not in self._reported:
+                print(f"Warning: no per diem post matches '{city}'; using the 'Other' rate.")
+                self._reported.add(city)
+            return self._rates.get("Other")
+        if confidence < self.CONFIDENT and city not in self._reported:
+            print(f"Warning: per diem post for '{city}' guessed as '{post}' (confidence {confidence:.2f}).")
+            self._reported.add(city)
+        elif config.DEBUG_MODE and post != city:
+            print(f"Per diem post for '{city}': '{post}'")
+        return self._rates[post]
+
+
+def classify_location(address, travel_city=None, hotel_reservations=None):
+    """
+    Classifies an address into a meaningful location name.
+
+    Args:
+        address: The address string to classify
+        travel_city: Optional city context for the trip
+        hotel_reservations: Optional list of HotelReservation records
+
+    Builds a one-off LocationClassifier; when classifying many addresses, build
+    the classifier once and call its classify() method instead.
+    """
+    return LocationClassifier(hotel_reservations).classify(address)
+
+
+def generate_uber_description(from_address, to_address, travel_city=None, hotel_reservations=None, classifier=None):
     """
     Generates a descriptive Uber ride description like:
     - "Home to Airport"
@@ -383,10 +701,13 @@ def generate_uber_description(from_address, to_address, travel_city=None, hotel_
         from_address: Pickup address
         to_address: Dropoff address
         travel_city: Optional city context
-        hotel_reservations: Optional list of hotel dicts for matching
+        hotel_reservations: Optional list of HotelReservation records for matching
+        classifier: Optional LocationClassifier to reuse across rides
     """
-    from_loc = classify_location(from_address, travel_city, hotel_reservations)
-    to_loc = classify_location(to_address, travel_city, hotel_reservations)
+    if classifier is None:
+        classifier = LocationClassifier(hotel_reservations)
+    from_loc = classifier.classify(from_address)
+    to_loc = classifier.classify(to_address)
 
     return f"{from_loc} to {to_loc}"
 
@@ -408,11 +729,14 @@ def find_fare_city(address):
 
 def parse_uber_receipt_email(email_body):
     """
-    Parses the HTML content of an Uber receipt email to extract trip details.
+    Parses the HTML content of an Uber receipt email into an UberReceipt.
     Supports both old and new Uber email formats.
     """
+    from bs4 import BeautifulSoup
+    from dateutil.parser import parse as parse_date
+
     soup = BeautifulSoup(email_body, 'html.parser')
-    details = {"from": "N/A", "to": "N/A", "fare": "N/A", "date": None, "fare-city": "N/A", "currency": "INR"}
+    details = UberReceipt()
 
     try:
         # === FARE EXTRACTION ===
@@ -422,12 +746,10 @@ def parse_uber_receipt_email(email_body):
             fare_text = fare_tag.get_text()
             # Detect currency from symbol
             if '₹' in fare_text:
-                details["currency"] = "INR"
+                details.currency = Currency.INR
             elif 'Rs' in fare_text or 'LKR' in fare_text or 'රු' in fare_text:
-                details["currency"] = "LKR"
-            fare_match = re.search(r'[\d,]+\.\d{2}', fare_text)
-            if fare_match:
-                details["fare"] = fare_match.group(0)
+                details.currency = Currency.LKR
+            details.fare = parse_amount(fare_text)
         else:
             # Old format: <td class="total_head">Total</td> followed by sibling
             total_header_tag = soup.find('td', class_='total_head', string='Total')
@@ -437,12 +759,10 @@ def parse_uber_receipt_email(email_body):
                     fare_text = total_value_tag.get_text()
                     # Detect currency from symbol
                     if '₹' in fare_text:
-                        details["currency"] = "INR"
+                        details.currency = Currency.INR
                     elif 'Rs' in fare_text or 'LKR' in fare_text or 'රු' in fare_text:
-                        details["currency"] = "LKR"
-                    fare_match = re.search(r'[\d,]+\.\d{2}', fare_text)
-                    if fare_match:
-                        details["fare"] = fare_match.group(0)
+                        details.currency = Currency.LKR
+                    details.fare = parse_amount(fare_text)
 
         # === DATE EXTRACTION ===
         # New format: <div class="date">Mar 21, 2026 , 11:04 AM</div>
@@ -452,12 +772,12 @@ def parse_uber_receipt_email(email_body):
             # Extract just the date part (before the time)
             date_match = re.search(r'([A-Za-z]+\s+\d{1,2},\s*\d{4})', date_text)
             if date_match:
-                details["date"] = parse_date(date_match.group(1)).date()
+                details.date = parse_date(date_match.group(1)).date()
         else:
             # Old format: <span class="Uber18_text_p1">
             header_date_tag = soup.find('span', class_='Uber18_text_p1', string=re.compile(r'\w+\s\d{1,2},\s\d{4}'))
             if header_date_tag:
-                details["date"] = parse_date(header_date_tag.get_text(strip=True)).date()
+                details.date = parse_date(header_date_tag.get_text(strip=True)).date()
 
         # === ADDRESS EXTRACTION ===
         # New format: <td class="address-point-desc"> contains the address
@@ -484,9 +804,9 @@ def parse_uber_receipt_email(email_body):
                                 addresses.append(address)
 
         if len(addresses) >= 2:
-            details["from"] = addresses[0]
-            details["to"] = addresses[1]
-            details["fare-city"] = find_fare_city(details["from"])
+            details.pickup = addresses[0]
+            details.dropoff = addresses[1]
+            details.fare_city = find_fare_city(details.pickup)
 
     except Exception as e:
         print(f"Warning: An error occurred while parsing Uber receipt: {e}")
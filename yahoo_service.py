@@ -4,18 +4,62 @@
 import imaplib
 import email
 from datetime import datetime
+import backends
 import config
+import instrumentation
+import resilience
 import utils # Import the utils module to access the new function
 import os
 
 IMAP_SERVER = "imap.mail.yahoo.com"
 
+def _run_command(mail_session, command, *args):
+    instrumentation.count("imap.commands")
+    # uid("SEARCH", ...) is timed as a search
+    name = args[0].lower() if command == "uid" else command
+    with instrumentation.timer(f"imap.{name}", "imap"):
+        return getattr(mail_session, command)(*args)
+
+def imap_command(mail_session, command, *args):
+    """
+    Runs one IMAP command (e.g. "uid", "noop"), counting and timing it.
+    Goes through resilience.call: on a YahooSession, a dropped connection is
+    logged into again and the command retried.
+    """
+    reconnect = getattr(mail_session, "reconnect", None)
+    return resilience.call("imap", lambda: _run_command(mail_session, command, *args),
+                           key=getattr(mail_session, "email_address", None), before_retry=reconnect,
+                           retryable=resilience.is_transient if reconnect else lambda e: False)
+
+class YahooSession:
+    """
+    A logged-in IMAP connection that can log in again. Commands go to the
+    current connection; reconnect() replaces it after the server drops it.
+    """
+
+    def __init__(self, email_address, app_password, mailbox="inbox"):
+        self.email_address = email_address
+        self._app_password = app_password
+        self._mailbox = mailbox
+        self.connection = None
+
+    def reconnect(self):
+        with instrumentation.timer("imap.connect", "imap"):
+            connection = backends.current().imap_connect(IMAP_SERVER)
+        _run_command(connection, "login", self.email_address, self._app_password)
+        _run_command(connection, "select", self._mailbox)
+        self.connection = connection
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "connection":
+            raise AttributeError(name)
+        return getattr(self.connection, name)
+
 def connect_to_yahoo(email_address, app_password):
     """Connects and logs into the Yahoo IMAP server."""
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(email_address, app_password)
-        mail.select("inbox")
+        mail = YahooSession(email_address, app_password)
+        resilience.call("imap", mail.reconnect, key=mail.email_address)
         print("Successfully connected to Yahoo Mail.")
         return mail
     except imaplib.IMAP4.error as e:
@@ -24,26 +68,72 @@ def connect_to_yahoo(email_address, app_password):
         print("Ensure you have generated and are using a 16-character 'App Password'.")
         return None
 
-def search_uber_receipts(mail_session, travel_date, usd_to_inr_rate):
+def ensure_connection(mail_session, email_address, app_password):
+    """
+    Returns a live IMAP session, reusing mail_session when the server still
+    answers a NOOP and reconnecting otherwise (e.g. after an idle timeout).
+    """
+    if mail_session:
+        try:
+            status, _ = imap_command(mail_session, "noop")
+            if status == "OK":
+                return mail_session
+        except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError):
+            pass
+        if config.DEBUG_MODE: print("Yahoo Mail connection dropped, reconnecting.")
+    return connect_to_yahoo(email_address, app_password)
+
+def search_uber_receipts(mail_session, travel_date, usd_to_inr_rate, pdf_driver=None):
     """
     Searches for Uber receipts on a specific date, saving only those over $10.
+    pdf_driver: optional Chrome driver reused to render every receipt to PDF.
+    Returns a list of UberReceipt records; see iter_uber_receipts to stream them.
+    """
+    return list(iter_uber_receipts(mail_session, travel_date, usd_to_inr_rate, pdf_driver=pdf_driver))
+
+def search_uber_receipt_ids(mail_session, travel_date):
+    """
+    Returns the UIDs of the Uber receipt emails sent on a specific date.
+    Unlike sequence numbers, a UID doesn't change when an older email is
+    deleted, so receipt file names (and the uploads the run manifest records
+    by name) keep pointing at the same email.
     """
     date_str = travel_date.strftime("%d-%b-%Y") # e.g., 29-Jul-2025
     search_query = f'(FROM "noreply@uber.com" SUBJECT "trip with Uber" ON "{date_str}")'
     if config.DEBUG_MODE: print(f"Executing Yahoo search with query: {search_query}")
+    _, selected_mails = imap_command(mail_session, "uid", "SEARCH", None, search_query)
+    return selected_mails[0].split()
 
+def iter_uber_receipts(mail_session, travel_date, usd_to_inr_rate, pdf_driver=None, skip_render=None):
+    """
+    Yields the Uber receipts for a specific date as they are parsed and
+    de-duplicated (same fare on the same date), in the order the report has
+    always listed them. A receipt without both addresses isn't final until the
+    date's last email, since a duplicate with addresses would replace it, so
+    it and the receipts after it wait; the others are yielded straight away.
+    skip_render(pdf_path): optional; True if the receipt's PDF isn't needed
+    (e.g. it was uploaded by an earlier run), so it isn't rendered again.
+    """
     try:
-        _, selected_mails = mail_session.search(None, search_query)
-        email_ids = selected_mails[0].split()
+        email_ids = search_uber_receipt_ids(mail_session, travel_date)
         if not email_ids:
-            return []
+            return
 
-        if config.DEBUG_MODE: print(f"Found {len(email_ids)} Uber receipt(s) for {date_str}.")
+        if config.DEBUG_MODE: print(f"Found {len(email_ids)} Uber receipt(s) for {travel_date:%d-%b-%Y}.")
         
-        receipts = []
+        yielded_fares = set()   # fares of receipts already yielded
+        pending = []            # receipts not yielded yet, in report order
         for email_id in email_ids:
-            _, data = mail_session.fetch(email_id, "(RFC822)")
+            try:
+                _, data = imap_command(mail_session, "uid", "FETCH", email_id, "(RFC822)")
+            except (imaplib.IMAP4.error, OSError) as e:
+                print(f"  -> Could not fetch email {email_id.decode()}, skipping it: {e}")
+                continue
+            if not data or not isinstance(data[0], (tuple, list)):
+                print(f"  -> Email {email_id.decode()} is no longer in the mailbox, skipping it.")
+                continue
             raw_email = data[0][1]
+            instrumentation.count("bytes.imap", len(raw_email))
             msg = email.message_from_bytes(raw_email)
             
             body = ""
@@ -63,42 +153,35 @@ def search_uber_receipts(mail_session, travel_date, usd_to_inr_rate):
                 
                 # Check if the fare exceeds $10
                 save_receipt = False
-                try:
-                    inr_fare = float(uber_details.get("fare", "0").replace(",", ""))
+                if uber_details.fare is not None:
+                    inr_fare = float(uber_details.fare)
                     usd_equivalent = inr_fare / usd_to_inr_rate
                     if usd_equivalent > 10:
                         save_receipt = True
                         if config.DEBUG_MODE: print(f"  -> Ride fare is ₹{inr_fare:.2f} (${usd_equivalent:.2f}), saving receipt.")
                     else:
                         if config.DEBUG_MODE: print(f"  -> Ride fare is ₹{inr_fare:.2f} (${usd_equivalent:.2f}), skipping receipt save.")
-                except (ValueError, TypeError):
+                else:
                     print("  -> Could not parse fare to check against $10 limit.")
 
                 filepath = None
-                current_from = uber_details.get("from", "N/A")
-                current_to = uber_details.get("to", "N/A")
-                current_fare = uber_details.get("fare", "0")
-                has_valid_addresses = current_from != "N/A" and current_to != "N/A"
+                has_valid_addresses = uber_details.has_addresses
 
                 # Check for duplicate receipts (same fare on same date)
-                duplicate_index = None
-                for i, existing in enumerate(receipts):
-                    if existing.get("fare", "0") == current_fare:
-                        duplicate_index = i
-                        break
-
-                if duplicate_index is not None:
-                    existing = receipts[duplicate_index]
-                    existing_has_valid = existing.get("from", "N/A") != "N/A" and existing.get("to", "N/A") != "N/A"
-
-                    if has_valid_addresses and not existing_has_valid:
+                if uber_details.fare in yielded_fares:
+                    if config.DEBUG_MODE:
+                        print("  -> Duplicate receipt found, skipping.")
+                    continue
+                existing = next((r for r in pending if r.fare == uber_details.fare), None)
+                if existing is not None:
+                    if has_valid_addresses and not existing.has_addresses:
                         # Replace N/A receipt with this one that has valid addresses
                         if config.DEBUG_MODE:
                             print(f"  -> Replacing N/A receipt with valid address version.")
                         # Delete old PDF if exists
-                        if existing.get("filepath") and os.path.exists(existing["filepath"]):
-                            os.remove(existing["filepath"])
-                        receipts.pop(duplicate_index)
+                        pending.remove(existing)
+                        if existing.filepath and os.path.exists(existing.filepath):
+                            os.remove(existing.filepath)
                         # Continue to add this receipt below
                     else:
                         # Skip this duplicate (either both have valid addresses or this one has N/A)
@@ -107,31 +190,43 @@ def search_uber_receipts(mail_session, travel_date, usd_to_inr_rate):
                         continue
 
                 if save_receipt:
-                    html_filename = f"uber_receipt_{travel_date.strftime('%Y%m%d')}_{email_id.decode()}.html"
-                    with open(html_filename, "w", encoding="utf-8") as html_file:
-                        html_file.write(html_string)
-
-                    # Convert HTML to PDF
+                    download_dir = getattr(config, "DOWNLOAD_DIR", ".")
+                    os.makedirs(download_dir, exist_ok=True)
+                    html_filename = os.path.join(
+                        download_dir, f"uber_receipt_{travel_date.strftime('%Y%m%d')}_{email_id.decode()}.html"
+                    )
                     pdf_filename = html_filename.replace(".html", ".pdf")
-                    utils.html_to_pdf_chrome(html_filename, pdf_filename)
 
-                    # Delete the HTML after conversion
-                    os.remove(html_filename)
+                    if skip_render and skip_render(pdf_filename):
+                        if config.DEBUG_MODE: print("  -> Receipt already uploaded, not rendering it again.")
+                    else:
+                        with open(html_filename, "w", encoding="utf-8") as html_file:
+                            html_file.write(html_string)
+
+                        # Convert HTML to PDF
+                        utils.html_to_pdf_chrome(html_filename, pdf_filename, driver=pdf_driver)
+
+                        # Delete the HTML after conversion
+                        os.remove(html_filename)
 
                     filepath = pdf_filename
 
-                # Add receipt to list
-                uber_details["filepath"] = filepath
-                receipts.append(uber_details)
-        
-        return receipts
+                uber_details.filepath = filepath
+                pending.append(uber_details)
+                while pending and pending[0].has_addresses:
+                    receipt = pending.pop(0)
+                    yielded_fares.add(receipt.fare)
+                    yield receipt
+
+        yield from pending
 
+    except resilience.CircuitOpenError:
+        raise
     except Exception as e:
         print(f"An error occurred while searching Yahoo Mail: {e}")
-        return []
 
 def close_connection(mail_session):
     """Closes the IMAP connection."""
     if mail_session:
-        mail_session.logout()
+        imap_command(mail_session, "logout")
         if config.DEBUG_MODE: print("Disconnected from Yahoo Mail.")